@@ -0,0 +1,43 @@
+"""Index retention times for range filters
+
+Revision ID: 5c2e8a41d7f3
+Revises: b36958980c56
+Create Date: 2024-10-02 18:12:37.412908
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+
+# revision identifiers, used by Alembic.
+revision: str = "5c2e8a41d7f3"
+down_revision: Union[str, None] = "b36958980c56"
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    # B-tree index for retention time window (range) filters
+    op.create_index(
+        op.f("ix_retention_times_retention_time"),
+        "retention_times",
+        ["retention_time"],
+        unique=False,
+    )
+    # join from the matching retention times to their measured compounds
+    op.create_index(
+        op.f("ix_measured_compounds_retention_time_id"),
+        "measured_compounds",
+        ["retention_time_id"],
+        unique=False,
+    )
+
+
+def downgrade() -> None:
+    op.drop_index(
+        op.f("ix_measured_compounds_retention_time_id"),
+        table_name="measured_compounds",
+    )
+    op.drop_index(
+        op.f("ix_retention_times_retention_time"), table_name="retention_times"
+    )
@@ -0,0 +1,35 @@
+"""Add the isotope envelopes of compounds and measured compounds
+
+Existing rows keep NULL until the recompute_masses job fills them.
+
+Revision ID: 7b5e2d9c4f10
+Revises: 3f1d9c7a2b84
+Create Date: 2024-10-09 14:03:52.771904
+
+"""
+from typing import Sequence, Union
+
+import sqlalchemy as sa
+from alembic import op
+
+# revision identifiers, used by Alembic.
+revision: str = "7b5e2d9c4f10"
+down_revision: Union[str, None] = "3f1d9c7a2b84"
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    op.add_column(
+        "compounds",
+        sa.Column("isotope_envelope", sa.LargeBinary(), nullable=True),
+    )
+    op.add_column(
+        "measured_compounds",
+        sa.Column("isotope_envelope", sa.LargeBinary(), nullable=True),
+    )
+
+
+def downgrade() -> None:
+    op.drop_column("measured_compounds", "isotope_envelope")
+    op.drop_column("compounds", "isotope_envelope")
@@ -0,0 +1,95 @@
+"""Make retention times unique
+
+Duplicate retention times (same value) are merged into the row with the smallest id.
+Measured compounds pointing to a removed duplicate are moved to the kept row; if that
+would duplicate a measured compound (uq_compound_retention_adduct), the newer one is removed.
+
+Revision ID: 9e4b7f2c6a15
+Revises: 5c2e8a41d7f3
+Create Date: 2024-10-04 16:48:09.127563
+
+"""  # noqa: E501
+from typing import Sequence, Union
+
+from alembic import op
+
+# revision identifiers, used by Alembic.
+revision: str = "9e4b7f2c6a15"
+down_revision: Union[str, None] = "5c2e8a41d7f3"
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    # map every retention time to the smallest id with the same value
+    op.execute(
+        """
+        CREATE TEMPORARY TABLE retention_time_keep AS
+        SELECT retention_time_id,
+               MIN(retention_time_id) OVER (PARTITION BY retention_time) AS keep_id
+        FROM retention_times
+        """  # noqa: E501
+    )
+    # measured compounds that would be duplicates after merging
+    op.execute(
+        """
+        DELETE FROM measured_compounds WHERE measured_compound_id IN (
+            SELECT measured_compound_id FROM (
+                SELECT m.measured_compound_id,
+                       ROW_NUMBER() OVER (
+                           PARTITION BY m.compound_id, m.adduct_id, k.keep_id
+                           ORDER BY m.measured_compound_id
+                       ) AS n
+                FROM measured_compounds m
+                JOIN retention_time_keep k
+                    ON k.retention_time_id = m.retention_time_id
+            ) ranked
+            WHERE n > 1
+        )
+        """
+    )
+    op.execute(
+        """
+        UPDATE measured_compounds SET retention_time_id = (
+            SELECT keep_id FROM retention_time_keep k
+            WHERE k.retention_time_id = measured_compounds.retention_time_id
+        )
+        WHERE retention_time_id IN (
+            SELECT retention_time_id FROM retention_time_keep
+            WHERE retention_time_id <> keep_id
+        )
+        """
+    )
+    op.execute(
+        """
+        DELETE FROM retention_times WHERE retention_time_id IN (
+            SELECT retention_time_id FROM retention_time_keep
+            WHERE retention_time_id <> keep_id
+        )
+        """
+    )
+    op.execute("DROP TABLE retention_time_keep")
+
+    # the unique index replaces the plain index for range filters
+    op.drop_index(
+        op.f("ix_retention_times_retention_time"), table_name="retention_times"
+    )
+    op.create_index(
+        op.f("ix_retention_times_retention_time"),
+        "retention_times",
+        ["retention_time"],
+        unique=True,
+    )
+
+
+def downgrade() -> None:
+    # merged duplicates are not restored
+    op.drop_index(
+        op.f("ix_retention_times_retention_time"), table_name="retention_times"
+    )
+    op.create_index(
+        op.f("ix_retention_times_retention_time"),
+        "retention_times",
+        ["retention_time"],
+        unique=False,
+    )
@@ -0,0 +1,33 @@
+"""Add the worker and heartbeat of running jobs
+
+Jobs that are running during the upgrade have no heartbeat and are
+failed as orphaned by the next worker that starts.
+
+Revision ID: a8c61e5f0b37
+Revises: d4a7c3e91b26
+Create Date: 2024-10-14 09:27:40.318520
+
+"""
+from typing import Sequence, Union
+
+import sqlalchemy as sa
+from alembic import op
+
+# revision identifiers, used by Alembic.
+revision: str = "a8c61e5f0b37"
+down_revision: Union[str, None] = "d4a7c3e91b26"
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    op.add_column("jobs", sa.Column("worker_id", sa.String(), nullable=True))
+    op.add_column(
+        "jobs",
+        sa.Column("heartbeat_at", sa.DateTime(timezone=True), nullable=True),
+    )
+
+
+def downgrade() -> None:
+    op.drop_column("jobs", "heartbeat_at")
+    op.drop_column("jobs", "worker_id")
@@ -0,0 +1,90 @@
+"""Add the denormalized measured_compound_search table
+
+The table is filled from the existing measured compounds.
+
+Revision ID: d4a7c3e91b26
+Revises: 7b5e2d9c4f10
+Create Date: 2024-10-11 09:41:17.205633
+
+"""
+from typing import Sequence, Union
+
+import sqlalchemy as sa
+from alembic import op
+
+# revision identifiers, used by Alembic.
+revision: str = "d4a7c3e91b26"
+down_revision: Union[str, None] = "7b5e2d9c4f10"
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    op.create_table(
+        "measured_compound_search",
+        sa.Column("measured_compound_id", sa.Integer(), nullable=False),
+        sa.Column("compound_id", sa.Integer(), nullable=False),
+        sa.Column("adduct_id", sa.Integer(), nullable=False),
+        sa.Column("retention_time_id", sa.Integer(), nullable=False),
+        sa.Column("measured_mass", sa.Float(), nullable=False),
+        sa.Column("retention_time", sa.Float(), nullable=False),
+        sa.Column("compound_type", sa.String(), nullable=True),
+        sa.Column("ion_mode", sa.String(), nullable=False),
+        sa.Column("compound_name", sa.String(), nullable=False),
+        sa.ForeignKeyConstraint(
+            ["measured_compound_id"],
+            ["measured_compounds.measured_compound_id"],
+        ),
+        sa.PrimaryKeyConstraint("measured_compound_id"),
+    )
+    op.execute(
+        """
+        INSERT INTO measured_compound_search (
+            measured_compound_id, compound_id, adduct_id, retention_time_id,
+            measured_mass, retention_time, compound_type, ion_mode,
+            compound_name
+        )
+        SELECT m.measured_compound_id, m.compound_id, m.adduct_id,
+            m.retention_time_id, m.measured_mass, r.retention_time, c.type,
+            a.ion_mode, c.compound_name
+        FROM measured_compounds m
+        JOIN compounds c ON c.compound_id = m.compound_id
+        JOIN retention_times r ON r.retention_time_id = m.retention_time_id
+        JOIN adducts a ON a.adduct_id = m.adduct_id
+        """
+    )
+    # created after the copy, which is faster than maintaining them row by row
+    op.create_index(
+        "ix_measured_compound_search_type_ion_mode_id",
+        "measured_compound_search",
+        ["compound_type", "ion_mode", "measured_compound_id"],
+        unique=False,
+    )
+    op.create_index(
+        "ix_measured_compound_search_ion_mode_id",
+        "measured_compound_search",
+        ["ion_mode", "measured_compound_id"],
+        unique=False,
+    )
+    op.create_index(
+        "ix_measured_compound_search_rt_type_ion_mode",
+        "measured_compound_search",
+        ["retention_time", "compound_type", "ion_mode"],
+        unique=False,
+    )
+
+
+def downgrade() -> None:
+    op.drop_index(
+        "ix_measured_compound_search_rt_type_ion_mode",
+        table_name="measured_compound_search",
+    )
+    op.drop_index(
+        "ix_measured_compound_search_ion_mode_id",
+        table_name="measured_compound_search",
+    )
+    op.drop_index(
+        "ix_measured_compound_search_type_ion_mode_id",
+        table_name="measured_compound_search",
+    )
+    op.drop_table("measured_compound_search")
@@ -0,0 +1,109 @@
+# 2024-09 Kai-Michael Kammer
+"""
+Load comparison of the async route stack against the previous sync stack.
+The async mode calls GET /measured-compounds/ of the app, the sync mode serves the same query from a
+sync def route with the blocking session, which Starlette runs in its threadpool.
+Both are driven in-process with httpx at a fixed concurrency and report p50/p99 latencies.
+Runs against DATABASE_URL, which should hold a populated library.
+Run from the backend folder: python -m benchmarks.bench_async_routes [--requests 2000] [--concurrency 200]
+"""  # noqa: E501
+import argparse
+import asyncio
+import time
+from typing import List, Tuple
+
+import httpx
+import numpy as np
+from fastapi import Depends, FastAPI
+from sqlalchemy.orm import Session
+
+from mass_spec_app.api import schemas
+from mass_spec_app.app import app as async_app
+from mass_spec_app.db import crud, models
+from mass_spec_app.db.session import get_db
+
+sync_app = FastAPI()
+
+
+@sync_app.get(
+    "/measured-compounds/",
+    response_model=List[schemas.MeasuredCompound],
+)
+def read_measured_compounds(
+    skip: int = 0, limit: int = 100, db: Session = Depends(get_db)
+) -> List[models.MeasuredCompound]:
+    return crud.get_measured_compounds(db, skip=skip, limit=limit)
+
+
+async def run_load(
+    app: FastAPI,
+    requests: int,
+    concurrency: int,
+    limit: int,
+    timeout: float = 30.0,
+) -> Tuple[List[float], int]:
+    """Send requests with at most concurrency in flight, return the latencies and error count."""  # noqa: E501
+    latencies: List[float] = []
+    errors = 0
+    semaphore = asyncio.Semaphore(concurrency)
+    transport = httpx.ASGITransport(app=app)
+    async with httpx.AsyncClient(
+        transport=transport, base_url="http://bench"
+    ) as client:
+
+        async def one_request() -> None:
+            nonlocal errors
+            async with semaphore:
+                started = time.perf_counter()
+                try:
+                    response = await asyncio.wait_for(
+                        client.get(
+                            "/measured-compounds/", params={"limit": limit}
+                        ),
+                        timeout,
+                    )
+                    response.raise_for_status()
+                except Exception:
+                    # e.g. pool checkout timeouts or a starved threadpool
+                    errors += 1
+                latencies.append(time.perf_counter() - started)
+
+        await asyncio.gather(*(one_request() for _ in range(requests)))
+    return latencies, errors
+
+
+def report(
+    mode: str, latencies: List[float], errors: int, elapsed: float
+) -> None:
+    ms = np.array(latencies) * 1000
+    print(
+        f"{mode:>5}: {len(ms) / elapsed:8.1f} req/s"
+        f"  p50 {np.percentile(ms, 50):8.1f} ms"
+        f"  p99 {np.percentile(ms, 99):8.1f} ms"
+        f"  errors {errors}"
+    )
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--requests", type=int, default=2000)
+    parser.add_argument("--concurrency", type=int, default=200)
+    parser.add_argument("--limit", type=int, default=100)
+    parser.add_argument("--timeout", type=float, default=30.0)
+    args = parser.parse_args()
+
+    async def bench(mode: str, app: FastAPI) -> None:
+        # warm up connections and caches in the same event loop
+        await run_load(app, 20, 10, args.limit)
+        started = time.perf_counter()
+        latencies, errors = await run_load(
+            app, args.requests, args.concurrency, args.limit, args.timeout
+        )
+        report(mode, latencies, errors, time.perf_counter() - started)
+
+    asyncio.run(bench("sync", sync_app))
+    asyncio.run(bench("async", async_app))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,131 @@
+# 2024-09 Kai-Michael Kammer
+"""
+Benchmark of the filtered measured-compound reads: the page of ids selected from the denormalized
+search table (crud.select_measured_compound_ids) against the same page selected through the joins
+of measured_compounds, compounds, retention_times and adducts, for every filter combination.
+Also times the whole crud.get_measured_compounds_filtered (ids plus loading the page) and prints
+the plans of both queries. The schema on --db-url is recreated and filled with a synthetic library,
+so never point it at a library you want to keep.
+Run from the backend folder: python -m benchmarks.bench_filtered_search --db-url postgresql+psycopg://... [--size 1000000]
+"""  # noqa: E501
+import argparse
+import statistics
+import time
+from typing import Any, Callable, Dict, List
+
+from sqlalchemy import Select, create_engine, make_url, text
+from sqlalchemy.orm import Session, sessionmaker
+from sqlalchemy_utils import create_database, database_exists
+
+from mass_spec_app import config
+from mass_spec_app.db import crud, models
+from mass_spec_app.scripts import synthetic_data
+
+# filters of the route, with a deep keyset page for the ion mode
+FILTERS: Dict[str, Dict[str, Any]] = {
+    "no filter": {},
+    "compound type": {"compound_type": "lipid"},
+    "ion mode": {"ion_mode": "negative"},
+    "ion mode, deep page": {"ion_mode": "negative", "after": None},
+    "type and ion mode": {"compound_type": "drug", "ion_mode": "positive"},
+    "rt window": {"retention_time": 15.0, "rt_tol": 0.05},
+    "rt window, type, ion mode": {
+        "rt_min": 10.0,
+        "rt_max": 12.0,
+        "compound_type": "metabolite",
+        "ion_mode": "negative",
+    },
+}
+
+
+def select_joined_ids(limit: int = 100, **filters: Any) -> Select:
+    """The page of ids through the joined tables, the plan before the search table."""  # noqa: E501
+    after = filters.pop("after", None)
+    statement = crud.select_measured_compounds_flat(
+        **filters
+    ).with_only_columns(models.MeasuredCompound.measured_compound_id)
+    if after is not None:
+        statement = statement.where(
+            models.MeasuredCompound.measured_compound_id > after
+        )
+    return statement.limit(limit)
+
+
+def median_ms(func: Callable[[], Any], repeat: int) -> float:
+    func()  # warm up
+    timings = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        func()
+        timings.append(time.perf_counter() - started)
+    return statistics.median(timings) * 1e3
+
+
+def plan(db: Session, statement: Select, engine: Any) -> List[str]:
+    sql = statement.compile(engine, compile_kwargs={"literal_binds": True})
+    return list(
+        db.execute(text(f"EXPLAIN (ANALYZE, COSTS OFF) {sql}")).scalars()
+    )
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--db-url", required=True)
+    parser.add_argument("--size", type=int, default=1_000_000)
+    parser.add_argument("--repeat", type=int, default=20)
+    parser.add_argument("--plans", action="store_true")
+    args = parser.parse_args()
+
+    url = make_url(args.db_url)
+    if url == make_url(config.DATABASE_URL):
+        parser.error("--db-url must not be the app database (DATABASE_URL)")
+    engine = create_engine(url)
+    if not database_exists(engine.url):
+        create_database(engine.url)
+    SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
+    models.Base.metadata.drop_all(bind=engine)
+    models.Base.metadata.create_all(bind=engine)
+    with SessionLocal() as db:
+        library = synthetic_data.generate_library(db, args.size)
+    print(f"library of {args.size}: {library}")
+
+    print(
+        f"{'filter':<28} {'joins':>10} {'search':>10} {'speedup':>8}"
+        f" {'filtered page':>14}"
+    )
+    with SessionLocal() as db:
+        for name, filters in FILTERS.items():
+            if "after" in filters:
+                filters = {**filters, "after": args.size // 2}
+            joined = select_joined_ids(**filters)
+            search = crud.select_measured_compound_ids(**filters)
+            # both plans return the same page
+            assert list(db.scalars(joined)) == list(db.scalars(search)), name
+            joined_ms = median_ms(
+                lambda: db.scalars(joined).all(), args.repeat
+            )
+            search_ms = median_ms(
+                lambda: db.scalars(search).all(), args.repeat
+            )
+            page_ms = median_ms(
+                lambda: crud.get_measured_compounds_filtered(db, **filters),
+                args.repeat,
+            )
+            print(
+                f"{name:<28} {joined_ms:>7.2f} ms {search_ms:>7.2f} ms"
+                f" {joined_ms / search_ms:>7.1f}x {page_ms:>11.2f} ms"
+            )
+            if args.plans:
+                for label, statement in (
+                    ("joins", joined),
+                    ("search", search),
+                ):
+                    print(f"  {label}:")
+                    for line in plan(db, statement, engine):
+                        print(f"    {line}")
+            db.rollback()
+    models.Base.metadata.drop_all(bind=engine)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,96 @@
+# 2024-09 Kai-Michael Kammer
+"""
+Throughput and queue latency of the job runner (see jobs.py) with short jobs.
+A burst of jobs that sleep a few milliseconds is submitted to a runner with --concurrency threads,
+then the jobs per second and the queue latency (created_at -> started_at) are reported,
+and the latency of a single submit to an idle runner.
+Runs against DATABASE_URL_TEST (created if needed), the tables are created and dropped again.
+Run from the backend folder: python -m benchmarks.bench_job_queue [--jobs 200] [--concurrency 4]
+"""  # noqa: E501
+import argparse
+import time
+from typing import Any, Dict, List
+
+import numpy as np
+from sqlalchemy import create_engine
+from sqlalchemy.orm import Session, sessionmaker
+from sqlalchemy_utils import create_database, database_exists
+
+from mass_spec_app import jobs
+from mass_spec_app.config import DATABASE_URL_TEST
+from mass_spec_app.db import models
+
+
+def short_job(
+    db: Session, params: Dict[str, Any], context: jobs.JobContext
+) -> Dict[str, Any]:
+    time.sleep(params["sleep"])
+    return {}
+
+
+def wait_for(db: Session, job_ids: List[str]) -> List[models.Job]:
+    while True:
+        db.expire_all()
+        found = [jobs.get_job(db, job_id) for job_id in job_ids]
+        if all(job.status not in (jobs.QUEUED, jobs.RUNNING) for job in found):
+            return found
+        time.sleep(0.01)
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--jobs", type=int, default=200)
+    parser.add_argument("--concurrency", type=int, default=4)
+    parser.add_argument("--sleep", type=float, default=0.005)
+    args = parser.parse_args()
+
+    engine = create_engine(DATABASE_URL_TEST, pool_size=args.concurrency + 2)
+    if not database_exists(engine.url):
+        create_database(engine.url)
+    models.Base.metadata.drop_all(bind=engine)
+    models.Base.metadata.create_all(bind=engine)
+    session_factory = sessionmaker(bind=engine)
+    jobs.register("bench_short")(short_job)
+    runner = jobs.JobRunner(concurrency=args.concurrency, poll_interval=0.05)
+    runner.start(session_factory)
+
+    try:
+        with session_factory() as db:
+            started = time.perf_counter()
+            job_ids = []
+            for _ in range(args.jobs):
+                job = jobs.submit(db, "bench_short", {"sleep": args.sleep})
+                job_ids.append(job.job_id)
+                runner.notify()
+            finished = wait_for(db, job_ids)
+            elapsed = time.perf_counter() - started
+            completed = sum(job.status == jobs.COMPLETED for job in finished)
+            latencies = np.array(
+                [
+                    (job.started_at - job.created_at).total_seconds()
+                    for job in finished
+                ]
+            )
+
+            job = jobs.submit(db, "bench_short", {"sleep": args.sleep})
+            runner.notify()
+            (job,) = wait_for(db, [job.job_id])
+            idle_latency = (job.started_at - job.created_at).total_seconds()
+    finally:
+        runner.stop()
+        models.Base.metadata.drop_all(bind=engine)
+
+    print(
+        f"{args.jobs} jobs with {args.concurrency} runners:"
+        f" {completed} completed in {elapsed:.2f} s"
+        f" ({len(finished) / elapsed:.0f} jobs/s)"
+    )
+    print(
+        f"queue latency p50: {np.percentile(latencies, 50):.3f} s,"
+        f" p95: {np.percentile(latencies, 95):.3f} s,"
+        f" idle runner: {idle_latency:.3f} s"
+    )
+
+
+if __name__ == "__main__":
+    main()
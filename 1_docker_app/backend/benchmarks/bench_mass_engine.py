@@ -0,0 +1,64 @@
+# 2024-09 Kai-Michael Kammer
+"""
+Benchmark of the batch mass engine against the molmass reference implementation.
+Run from the backend folder: python -m benchmarks.bench_mass_engine [--n 100000]
+"""  # noqa: E501
+import argparse
+import random
+import time
+
+import numpy as np
+from molmass import Formula
+
+from mass_spec_app.scripts import chem_utils as cu
+from mass_spec_app.scripts import mass_engine
+
+
+def synthetic_formulas(n: int, seed: int = 0) -> list:
+    """Generate n random, mostly distinct formulas incl. isotope notation."""
+    rng = random.Random(seed)
+    formulas = []
+    for _ in range(n):
+        formula = (
+            f"C{rng.randint(1, 60)}H{rng.randint(1, 120)}"
+            f"N{rng.randint(1, 8)}O{rng.randint(1, 20)}"
+        )
+        if rng.random() < 0.2:
+            formula += f"[2]H{rng.randint(1, 9)}"
+        if rng.random() < 0.1:
+            formula += f"[13]C{rng.randint(1, 6)}"
+        if rng.random() < 0.1:
+            formula += rng.choice(["S", "P", "Cl", "Na", "Br2"])
+        formulas.append(formula)
+    return formulas
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--n", type=int, default=100_000)
+    args = parser.parse_args()
+    formulas = synthetic_formulas(args.n)
+
+    started = time.perf_counter()
+    reference = np.array(
+        [
+            Formula(cu.convert_isotope_notation(f)).isotope.mass
+            for f in formulas
+        ]
+    )
+    molmass_time = time.perf_counter() - started
+
+    started = time.perf_counter()
+    masses = mass_engine.batch_monoisotopic_mass(formulas)
+    engine_time = time.perf_counter() - started
+
+    max_error = float(np.max(np.abs(masses - reference)))
+    print(f"formulas:     {args.n}")
+    print(f"molmass:      {molmass_time:.2f}s")
+    print(f"mass engine:  {engine_time:.2f}s")
+    print(f"speedup:      {molmass_time / engine_time:.1f}x")
+    print(f"max |error|:  {max_error:.2e} Da")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,83 @@
+# 2024-09 Kai-Michael Kammer
+"""
+Benchmark of the batch peak annotation (MassIndex.match_peaks) against one lookup per peak.
+The library is synthetic and held in memory only, no database is needed.
+Run from the backend folder: python -m benchmarks.bench_peak_annotation [--peaks 50000] [--library 1000000]
+"""  # noqa: E501
+import argparse
+import time
+
+import numpy as np
+
+from mass_spec_app.db.mass_index import MassIndex
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--peaks", type=int, default=50_000)
+    parser.add_argument("--library", type=int, default=1_000_000)
+    parser.add_argument("--ppm", type=float, default=5.0)
+    parser.add_argument("--rt-tol", type=float, default=0.2)
+    args = parser.parse_args()
+    rng = np.random.default_rng(0)
+
+    library_masses = rng.uniform(100, 1200, args.library)
+    library_rts = rng.uniform(0.5, 30, args.library)
+    index = MassIndex()
+    started = time.perf_counter()
+    index.add_many(
+        ids=range(1, args.library + 1),
+        masses=library_masses,
+        compound_ids=rng.integers(1, args.library // 4, args.library),
+        retention_times=library_rts,
+        ion_modes=rng.choice(["positive", "negative"], args.library),
+    )
+    build_time = time.perf_counter() - started
+
+    # half of the peaks are library entries with measurement noise
+    known = rng.integers(0, args.library, args.peaks // 2)
+    peak_mzs = np.concatenate(
+        [
+            library_masses[known] * (1 + rng.normal(0, 1e-6, len(known))),
+            rng.uniform(100, 1200, args.peaks - len(known)),
+        ]
+    )
+    peak_rts = np.concatenate(
+        [
+            library_rts[known] + rng.normal(0, 0.05, len(known)),
+            rng.uniform(0.5, 30, args.peaks - len(known)),
+        ]
+    )
+
+    started = time.perf_counter()
+    matches = index.match_peaks(
+        mzs=peak_mzs, ppm=args.ppm, rts=peak_rts, rt_tol=args.rt_tol
+    )
+    batch_time = time.perf_counter() - started
+
+    # what a client does today: one mass search per peak, rt checked after
+    rt_by_id = dict(zip(range(1, args.library + 1), library_rts))
+    started = time.perf_counter()
+    per_peak_matches = 0
+    for mz, rt in zip(peak_mzs, peak_rts):
+        per_peak_matches += sum(
+            abs(rt_by_id[i] - rt) <= args.rt_tol
+            for i in index.search(mz=mz, ppm=args.ppm)
+        )
+    loop_time = time.perf_counter() - started
+    assert per_peak_matches == len(matches.ids)
+
+    print(
+        f"library:        {args.library} entries (built in {build_time:.2f}s)"
+    )  # noqa: E501
+    print(f"peaks:          {args.peaks}")
+    print(f"matches:        {len(matches.ids)}")
+    print(f"match_peaks:    {batch_time * 1000:.0f} ms")
+    print(
+        f"per-peak loop:  {loop_time * 1000:.0f} ms (without HTTP round trips)"
+    )  # noqa: E501
+    print(f"speedup:        {loop_time / batch_time:.1f}x")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,93 @@
+# 2024-09 Kai-Michael Kammer
+"""
+Concurrency stress test of the retention time upsert (crud.get_or_create_retention_time).
+Several processes upsert the same retention times at the same time, each value in its own transaction,
+then the table is checked for duplicates and the throughput is reported.
+Runs against DATABASE_URL_TEST (created if needed), the tables are created and dropped again.
+Run from the backend folder: python -m benchmarks.bench_retention_time_upsert [--processes 8] [--values 2000]
+"""  # noqa: E501
+import argparse
+import multiprocessing
+import time
+from typing import List
+
+from sqlalchemy import create_engine, func, select
+from sqlalchemy.orm import Session
+from sqlalchemy_utils import create_database, database_exists
+
+from mass_spec_app.api import schemas
+from mass_spec_app.config import DATABASE_URL_TEST
+from mass_spec_app.db import crud, models
+
+
+def upsert_all(
+    worker: int, retention_times: List[float], start: "multiprocessing.Event"
+) -> None:
+    engine = create_engine(DATABASE_URL_TEST, pool_size=1)
+    # every worker walks the values in a different order
+    shift = worker * len(retention_times) // 7
+    ordered = retention_times[shift:] + retention_times[:shift]
+    start.wait()
+    with Session(engine) as db:
+        for rt in ordered:
+            crud.get_or_create_retention_time(
+                db, schemas.RetentionTimeCreate(retention_time=rt)
+            )
+            db.commit()
+    engine.dispose()
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--processes", type=int, default=8)
+    parser.add_argument("--values", type=int, default=2000)
+    args = parser.parse_args()
+
+    engine = create_engine(DATABASE_URL_TEST)
+    if not database_exists(engine.url):
+        create_database(engine.url)
+    models.Base.metadata.drop_all(bind=engine)
+    models.Base.metadata.create_all(bind=engine)
+    retention_times = [round(0.5 + i * 0.01, 2) for i in range(args.values)]
+
+    start = multiprocessing.Event()
+    workers = [
+        multiprocessing.Process(
+            target=upsert_all, args=(worker, retention_times, start)
+        )
+        for worker in range(args.processes)
+    ]
+    for worker in workers:
+        worker.start()
+    # give the workers time to connect before they all start at once
+    time.sleep(1.0)
+    started = time.perf_counter()
+    start.set()
+    for worker in workers:
+        worker.join()
+    elapsed = time.perf_counter() - started
+    failed = sum(worker.exitcode != 0 for worker in workers)
+
+    with Session(engine) as db:
+        rows = db.scalar(
+            select(func.count(models.RetentionTime.retention_time_id))
+        )
+        distinct = db.scalar(
+            select(func.count(models.RetentionTime.retention_time.distinct()))
+        )
+    models.Base.metadata.drop_all(bind=engine)
+
+    upserts = args.processes * args.values
+    print(
+        f"{args.processes} processes x {args.values} values:"
+        f" {upserts} upserts in {elapsed:.2f} s"
+        f" ({upserts / elapsed:.0f} upserts/s), failed workers: {failed}"
+    )
+    print(
+        f"rows: {rows}, distinct retention times: {distinct},"
+        f" duplicates: {rows - distinct}"
+    )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,362 @@
+# 2024-09 Kai-Michael Kammer
+"""
+End-to-end HTTP load generator for a running app (e.g. gunicorn with UvicornWorker as in docker_entrypoint.sh).
+Replays a weighted mix of reads and writes over GET /compounds/, GET /measured-compounds_filtered/,
+POST /measured-compounds/ and the /tools/ endpoints, either closed-loop at a fixed concurrency
+or open-loop at a target rate (--rps). In open-loop mode latencies are measured from the scheduled
+start, so a server that falls behind shows up in the percentiles instead of lowering the rate.
+Reports throughput, p50/p95/p99 latencies and error rates per route, optionally as JSON (--output).
+Request parameters are drawn from the library served by the app. --populate fills an empty, migrated
+DATABASE_URL with a synthetic library (see scripts/synthetic_data.py) and exits. Run locally, e.g.:
+    cd 1_docker_app && alembic upgrade head
+    cd backend && python -m benchmarks.load_test --populate 100000
+    cd backend && gunicorn --bind 127.0.0.1:8255 -w 4 -k uvicorn.workers.UvicornWorker mass_spec_app:app
+    python -m benchmarks.load_test --base-url http://127.0.0.1:8255 --duration 60 --concurrency 50
+"""  # noqa: E501
+import argparse
+import asyncio
+import json
+import time
+from collections import Counter, defaultdict
+from dataclasses import dataclass, field
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+import httpx
+import numpy as np
+
+# route label, method, path and the keyword arguments of the request
+Request = Tuple[str, str, str, Dict[str, Any]]
+
+DEFAULT_MIX = "compounds=30,filtered=30,create=10,tools=30"
+
+
+@dataclass
+class Library:
+    """Values of the served library the requests are built from."""
+
+    compound_ids: List[int]
+    formulas: List[str]
+    adduct_names: List[str]
+    retention_times: List[float]
+
+
+@dataclass
+class RouteStats:
+    latencies: List[float] = field(default_factory=list)
+    statuses: Counter = field(default_factory=Counter)
+    errors: int = 0
+
+
+class Scenarios:
+    """Builds the requests of the mix, each returns (route, method, path, request kwargs)."""  # noqa: E501
+
+    # statuses other than 200 that are a valid answer of a route
+    EXPECTED = {"GET /measured-compounds_filtered/": {404}}
+
+    def __init__(self, library: Library, seed: int) -> None:
+        self.library = library
+        self.rng = np.random.default_rng(seed)
+        # every create gets a new retention time, drawn independently of the
+        # seed, so repeated runs do not collide with the rows of earlier runs
+        self._retention_time = 1000.0 + float(
+            np.random.default_rng().integers(0, 10**9) / 1000
+        )
+
+    def _pick(self, values: List[Any]) -> Any:
+        return values[int(self.rng.integers(0, len(values)))]
+
+    def compounds(self) -> Request:
+        return (
+            "GET /compounds/",
+            "GET",
+            "/compounds/",
+            {
+                "params": {
+                    "skip": int(
+                        self.rng.integers(0, len(self.library.compound_ids))
+                    ),
+                    "limit": 100,
+                }
+            },
+        )
+
+    def filtered(self) -> Request:
+        params: Dict[str, Any] = {
+            "retention_time": self._pick(self.library.retention_times),
+            "rt_tol": 0.05,
+        }
+        if self.rng.random() < 0.5:
+            params["ion_mode"] = self._pick(["positive", "negative"])
+        return (
+            "GET /measured-compounds_filtered/",
+            "GET",
+            "/measured-compounds_filtered/",
+            {"params": params},
+        )
+
+    def create(self) -> Request:
+        self._retention_time += 0.001
+        return (
+            "POST /measured-compounds/",
+            "POST",
+            "/measured-compounds/",
+            {
+                "json": {
+                    "compound_id": self._pick(self.library.compound_ids),
+                    "retention_time": round(self._retention_time, 3),
+                    "adduct_name": self._pick(self.library.adduct_names),
+                }
+            },
+        )
+
+    def tools(self) -> Request:
+        formula = self._pick(self.library.formulas)
+        if self.rng.random() < 0.5:
+            return (
+                "GET /tools/monoisotopic-mass/",
+                "GET",
+                "/tools/monoisotopic-mass/",
+                {"params": {"molecular_formula": formula}},
+            )
+        return (
+            "GET /tools/formula-adduct-calc/",
+            "GET",
+            "/tools/formula-adduct-calc/",
+            {
+                "params": {
+                    "molecular_formula": formula,
+                    "adduct": self._pick(self.library.adduct_names),
+                }
+            },
+        )
+
+
+def parse_mix(mix: str) -> Dict[str, float]:
+    """Parse "compounds=30,filtered=30,..." into normalized weights."""
+    weights = {}
+    for part in mix.split(","):
+        name, _, weight = part.partition("=")
+        name = name.strip()
+        if name.startswith("_") or not callable(
+            getattr(Scenarios, name, None)
+        ):
+            raise ValueError(f"Unknown scenario {name} in mix")
+        weights[name] = float(weight)
+    total = sum(weights.values())
+    if total <= 0:
+        raise ValueError("The mix needs a positive weight")
+    return {name: weight / total for name, weight in weights.items()}
+
+
+async def load_library(client: httpx.AsyncClient) -> Library:
+    """Fetch compounds, adducts and retention times to build requests from."""
+    compounds = (
+        await client.get("/compounds/", params={"limit": 1000})
+    ).json()
+    adducts = (await client.get("/adducts/", params={"limit": 100})).json()
+    retention_times = (
+        await client.get("/retention-times/", params={"limit": 1000})
+    ).json()
+    if not compounds or not adducts or not retention_times:
+        raise SystemExit(
+            "The app serves an empty library, populate its database first"
+            " (--populate)"
+        )
+    return Library(
+        compound_ids=[c["compound_id"] for c in compounds],
+        formulas=[c["molecular_formula"] for c in compounds],
+        adduct_names=[a["adduct_name"] for a in adducts],
+        retention_times=[rt["retention_time"] for rt in retention_times],
+    )
+
+
+async def send(
+    client: httpx.AsyncClient,
+    request: Request,
+    stats: Dict[str, RouteStats],
+    started: float,
+    record: bool,
+) -> None:
+    route, method, path, kwargs = request
+    try:
+        response = await client.request(method, path, **kwargs)
+        status: Any = response.status_code
+        failed = status != 200 and status not in Scenarios.EXPECTED.get(
+            route, ()
+        )
+    except httpx.HTTPError as e:
+        status, failed = type(e).__name__, True
+    if record:
+        route_stats = stats[route]
+        route_stats.latencies.append(time.perf_counter() - started)
+        route_stats.statuses[status] += 1
+        route_stats.errors += failed
+
+
+async def run_load(
+    client: httpx.AsyncClient,
+    next_request: Callable[[], Request],
+    duration: float,
+    warmup: float,
+    concurrency: int,
+    rps: Optional[float],
+) -> Tuple[Dict[str, RouteStats], float]:
+    """Run the mix for warmup + duration seconds, return the stats of the recorded part."""  # noqa: E501
+    stats: Dict[str, RouteStats] = defaultdict(RouteStats)
+    begin = time.perf_counter()
+    record_from = begin + warmup
+    deadline = record_from + duration
+
+    if rps is None:
+        # closed loop: every worker sends its next request once the last one is done  # noqa: E501
+        async def worker() -> None:
+            while (now := time.perf_counter()) < deadline:
+                await send(
+                    client, next_request(), stats, now, now >= record_from
+                )
+
+        await asyncio.gather(*(worker() for _ in range(concurrency)))
+    else:
+        # open loop: requests start on schedule, at most concurrency in flight  # noqa: E501
+        semaphore = asyncio.Semaphore(concurrency)
+        tasks = set()
+
+        async def scheduled(request: Request, at: float) -> None:
+            async with semaphore:
+                await send(client, request, stats, at, at >= record_from)
+
+        sent = 0
+        while (at := begin + sent / rps) < deadline:
+            await asyncio.sleep(max(0.0, at - time.perf_counter()))
+            task = asyncio.create_task(scheduled(next_request(), at))
+            tasks.add(task)
+            task.add_done_callback(tasks.discard)
+            sent += 1
+        await asyncio.gather(*tasks)
+    return stats, time.perf_counter() - record_from
+
+
+def summarize(
+    stats: Dict[str, RouteStats], elapsed: float
+) -> Dict[str, Dict[str, Any]]:
+    """Throughput, latency percentiles (ms) and error rate per route and in total."""  # noqa: E501
+    total = RouteStats()
+    for route_stats in stats.values():
+        total.latencies += route_stats.latencies
+        total.statuses += route_stats.statuses
+        total.errors += route_stats.errors
+    summary = {}
+    for route, route_stats in sorted(stats.items()) + [("total", total)]:
+        ms = np.array(route_stats.latencies) * 1000
+        if not len(ms):
+            continue
+        summary[route] = {
+            "requests": len(ms),
+            "throughput": len(ms) / elapsed,
+            "p50": float(np.percentile(ms, 50)),
+            "p95": float(np.percentile(ms, 95)),
+            "p99": float(np.percentile(ms, 99)),
+            "max": float(ms.max()),
+            "errors": route_stats.errors,
+            "error_rate": route_stats.errors / len(ms),
+            "statuses": {str(k): v for k, v in route_stats.statuses.items()},
+        }
+    return summary
+
+
+def report(summary: Dict[str, Dict[str, Any]]) -> None:
+    print(
+        f"{'route':<36} {'requests':>8} {'req/s':>8} {'p50 ms':>8}"
+        f" {'p95 ms':>8} {'p99 ms':>8} {'errors':>7}"
+    )
+    for route, row in summary.items():
+        print(
+            f"{route:<36} {row['requests']:>8} {row['throughput']:>8.1f}"
+            f" {row['p50']:>8.1f} {row['p95']:>8.1f} {row['p99']:>8.1f}"
+            f" {row['error_rate']:>7.2%}"
+        )
+
+
+def populate(measured_compounds: int) -> None:
+    """
+    Fill the empty app database (DATABASE_URL) with a synthetic library.
+    The database is marked as initialized, so the app does not load the input files on startup.
+    """  # noqa: E501
+    # imported here, the load generator itself does not need the app's config
+    from mass_spec_app.db import crud, models
+    from mass_spec_app.db.session import SessionLocal
+    from mass_spec_app.scripts import synthetic_data
+
+    with SessionLocal() as db:
+        if db.query(models.Compound).first() is not None:
+            raise SystemExit("--populate needs an empty database")
+        print(synthetic_data.generate_library(db, measured_compounds))
+        crud.set_initialization_status(db)
+
+
+async def main_async(args: argparse.Namespace) -> Dict[str, Any]:
+    weights = parse_mix(args.mix)
+    async with httpx.AsyncClient(
+        base_url=args.base_url,
+        timeout=args.timeout,
+        limits=httpx.Limits(max_connections=args.concurrency),
+    ) as client:
+        library = await load_library(client)
+        scenarios = Scenarios(library, args.seed)
+        names = list(weights)
+        probabilities = list(weights.values())
+
+        def next_request() -> Request:
+            name = names[scenarios.rng.choice(len(names), p=probabilities)]
+            return getattr(scenarios, name)()
+
+        stats, elapsed = await run_load(
+            client,
+            next_request,
+            args.duration,
+            args.warmup,
+            args.concurrency,
+            args.rps,
+        )
+    return summarize(stats, elapsed)
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(
+        description=__doc__, formatter_class=argparse.RawTextHelpFormatter
+    )
+    parser.add_argument("--base-url", default="http://127.0.0.1:8255")
+    parser.add_argument("--mix", default=DEFAULT_MIX)
+    parser.add_argument("--duration", type=float, default=30.0)
+    parser.add_argument("--warmup", type=float, default=5.0)
+    parser.add_argument("--concurrency", type=int, default=50)
+    parser.add_argument(
+        "--rps", type=float, default=None, help="target rate (open loop)"
+    )
+    parser.add_argument("--timeout", type=float, default=30.0)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--output", default=None, help="JSON report file")
+    parser.add_argument(
+        "--populate",
+        type=int,
+        default=None,
+        help="fill an empty database with a synthetic library of this many"
+        " measured compounds and exit",
+    )
+    args = parser.parse_args()
+
+    if args.populate:
+        populate(args.populate)
+        return
+    summary = asyncio.run(main_async(args))
+    report(summary)
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(
+                {"arguments": vars(args), "routes": summary}, f, indent=2
+            )
+        print(f"report written to {args.output}")
+
+
+if __name__ == "__main__":
+    main()
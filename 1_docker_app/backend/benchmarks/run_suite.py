@@ -0,0 +1,413 @@
+# 2024-09 Kai-Michael Kammer
+"""
+Micro-benchmark suite for chem_utils, the crud read/write functions and the route handlers.
+For every library size the schema on --db-url is recreated and filled with a synthetic library
+(see scripts/synthetic_data.py), then every benchmark is timed --repeat times.
+The results are written as JSON to --output, --baseline compares them with an earlier run.
+The database on --db-url is created if needed and its tables are dropped, so never point it at a library you want to keep.
+Routes are called in-process with httpx and need an async driver for the database
+(psycopg for PostgreSQL, aiosqlite for SQLite), without one they are skipped.
+Run from the backend folder: python -m benchmarks.run_suite [--sizes 10000 100000 1000000] [--db-url sqlite:///bench.db]
+"""  # noqa: E501
+import argparse
+import asyncio
+import json
+import platform
+import statistics
+import subprocess
+import time
+from datetime import datetime, timezone
+from importlib import metadata
+from typing import Any, Awaitable, Callable, Dict, List, Optional
+
+import httpx
+import numpy as np
+from pydantic import TypeAdapter
+from sqlalchemy import URL, create_engine, make_url
+from sqlalchemy.ext.asyncio import async_sessionmaker, create_async_engine
+from sqlalchemy.orm import sessionmaker
+from sqlalchemy_utils import create_database, database_exists
+
+from mass_spec_app import config
+from mass_spec_app.api import schemas
+from mass_spec_app.api.response_cache import response_cache
+from mass_spec_app.app import app
+from mass_spec_app.db import crud, models
+from mass_spec_app.db.session import get_async_db, get_db
+from mass_spec_app.scripts import chem_utils as cu
+from mass_spec_app.scripts import synthetic_data
+
+PACKAGES = ("sqlalchemy", "numpy", "molmass", "pydantic", "fastapi")
+
+
+def summarize(
+    name: str, group: str, size: Optional[int], timings: List[float]
+) -> Dict[str, Any]:
+    """Summary of the per-call timings (seconds) of one benchmark."""
+    median = statistics.median(timings)
+    return {
+        "name": name,
+        "group": group,
+        "size": size,
+        "repeat": len(timings),
+        "min": min(timings),
+        "median": median,
+        "mean": statistics.fmean(timings),
+        "max": max(timings),
+        "stdev": statistics.stdev(timings) if len(timings) > 1 else 0.0,
+        "ops_per_s": 1 / median if median > 0 else None,
+    }
+
+
+def measure(
+    func: Callable[[], Any],
+    repeat: int,
+    setup: Optional[Callable[[], Any]] = None,
+) -> List[float]:
+    """Time repeat calls of func, setup runs untimed before every call."""
+    timings = []
+    for _ in range(repeat):
+        if setup is not None:
+            setup()
+        started = time.perf_counter()
+        func()
+        timings.append(time.perf_counter() - started)
+    return timings
+
+
+async def measure_async(
+    func: Callable[[], Awaitable[Any]], repeat: int
+) -> List[float]:
+    timings = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        await func()
+        timings.append(time.perf_counter() - started)
+    return timings
+
+
+def bench_chem_utils(repeat: int, formulas: List[str]) -> List[Dict]:
+    """Mass and measured formula of a batch of formulas, with cold and warm caches."""  # noqa: E501
+
+    def masses() -> None:
+        for formula in formulas:
+            cu.get_monoisotopic_mass(formula)
+
+    def measured_formulas() -> None:
+        for formula in formulas:
+            cu.get_measured_formula(formula, "M+Na")
+
+    group = f"chem_utils ({len(formulas)} formulas)"
+    return [
+        summarize(
+            "get_monoisotopic_mass cold",
+            group,
+            None,
+            measure(masses, repeat, setup=cu.clear_caches),
+        ),
+        summarize(
+            "get_monoisotopic_mass warm", group, None, measure(masses, repeat)
+        ),
+        summarize(
+            "get_measured_formula cold",
+            group,
+            None,
+            measure(measured_formulas, repeat, setup=cu.clear_caches),
+        ),
+        summarize(
+            "get_measured_formula warm",
+            group,
+            None,
+            measure(measured_formulas, repeat),
+        ),
+    ]
+
+
+def bench_crud(
+    SessionLocal: sessionmaker, size: int, repeat: int
+) -> List[Dict]:
+    """Reads and writes of the crud functions, each with a new session."""
+    rng = np.random.default_rng(1)
+    ids = [int(i) for i in rng.integers(1, size + 1, 100)]
+    compounds = size // len(synthetic_data.ADDUCTS)
+    # new retention times for the writes, above the generated 0.5 to 30
+    next_rt = iter(np.round(np.arange(31.0, 1000.0, 0.001), 3))
+
+    def read(func: Callable, **kwargs: Any) -> Callable[[], Any]:
+        def call() -> Any:
+            with SessionLocal() as db:
+                return func(db, **kwargs)
+
+        return call
+
+    def create_one() -> None:
+        with SessionLocal() as db:
+            crud.create_measured_compound_and_retention_time(
+                db,
+                schemas.MeasuredCompoundCreate(
+                    compound_id=int(rng.integers(1, compounds + 1)),
+                    retention_time=float(next(next_rt)),
+                    adduct_name="M+H",
+                ),
+            )
+
+    def create_bulk() -> None:
+        retention_time = float(next(next_rt))
+        with SessionLocal() as db:
+            crud.create_measured_compounds_bulk(
+                db,
+                [
+                    schemas.MeasuredCompoundCreate(
+                        compound_id=compound_id,
+                        retention_time=retention_time,
+                        adduct_name="M-H",
+                    )
+                    for compound_id in range(1, min(compounds, 1000) + 1)
+                ],
+            )
+
+    benchmarks = {
+        "get_measured_compounds first page": read(
+            crud.get_measured_compounds, limit=100
+        ),
+        "get_measured_compounds offset page": read(
+            crud.get_measured_compounds, skip=size // 2, limit=100
+        ),
+        "get_measured_compounds cursor page": read(
+            crud.get_measured_compounds, after=size // 2, limit=100
+        ),
+        "get_measured_compounds_filtered rt window": read(
+            crud.get_measured_compounds_filtered,
+            retention_time=15.0,
+            rt_tol=0.05,
+            limit=100,
+        ),
+        "get_measured_compounds_filtered ion mode": read(
+            crud.get_measured_compounds_filtered,
+            ion_mode="negative",
+            limit=100,
+        ),
+        "get_measured_compounds_by_ids 100": read(
+            crud.get_measured_compounds_by_ids, measured_compound_ids=ids
+        ),
+        "get_compounds first page": read(crud.get_compounds, limit=100),
+        "create_measured_compound_and_retention_time": create_one,
+        "create_measured_compounds_bulk 1000": create_bulk,
+    }
+    return [
+        summarize(name, "crud", size, measure(func, repeat))
+        for name, func in benchmarks.items()
+    ]
+
+
+def bench_serialization(
+    SessionLocal: sessionmaker, size: int, repeat: int
+) -> List[Dict]:
+    """Response model validation and JSON encoding of 1000 measured compounds."""  # noqa: E501
+    with SessionLocal() as db:
+        rows = crud.get_measured_compounds(db, limit=1000)
+    adapter = TypeAdapter(List[schemas.MeasuredCompound])
+    return [
+        summarize(
+            "MeasuredCompound response 1000 rows",
+            "serialization",
+            size,
+            measure(
+                lambda: adapter.dump_json(
+                    adapter.validate_python(rows, from_attributes=True)
+                ),
+                repeat,
+            ),
+        )
+    ]
+
+
+def async_url(url: URL) -> Optional[URL]:
+    """Return the URL with an async driver, None if none is installed."""
+    if url.get_backend_name() == "postgresql":
+        return url.set(drivername="postgresql+psycopg")
+    if url.get_backend_name() == "sqlite":
+        try:
+            import aiosqlite  # noqa: F401
+        except ImportError:
+            return None
+        return url.set(drivername="sqlite+aiosqlite")
+    return None
+
+
+async def bench_routes(
+    url: URL, SessionLocal: sessionmaker, size: int, repeat: int
+) -> List[Dict]:
+    """GET routes through the whole app (routing, validation, serialization)."""  # noqa: E501
+    async_engine = create_async_engine(url)
+    AsyncSessionLocal = async_sessionmaker(
+        bind=async_engine, autoflush=False, expire_on_commit=False
+    )
+
+    async def get_bench_async_db():
+        async with AsyncSessionLocal() as db:
+            yield db
+
+    def get_bench_db():
+        with SessionLocal() as db:
+            yield db
+
+    app.dependency_overrides[get_async_db] = get_bench_async_db
+    app.dependency_overrides[get_db] = get_bench_db
+    paths = {
+        "GET /measured-compounds/": "/measured-compounds/?limit=100",
+        "GET /measured-compounds_filtered/": (
+            "/measured-compounds_filtered/?retention_time=15&rt_tol=0.05"
+        ),
+        "GET /measured-compounds/search-mass": (
+            "/measured-compounds/search-mass?mz=300&ppm=5"
+        ),
+        "GET /measured-compounds/{id}": f"/measured-compounds/{size // 2}",
+        "GET /compounds/": "/compounds/?limit=100",
+        "GET /tools/monoisotopic-mass/": (
+            "/tools/monoisotopic-mass/?molecular_formula=C8H10N4O2"
+        ),
+    }
+    results = []
+    try:
+        async with httpx.AsyncClient(
+            transport=httpx.ASGITransport(app=app), base_url="http://bench"
+        ) as client:
+            for name, path in paths.items():
+
+                async def call() -> None:
+                    response = await client.get(path)
+                    response.raise_for_status()
+
+                await call()  # warm up
+                results.append(
+                    summarize(
+                        name, "routes", size, await measure_async(call, repeat)
+                    )
+                )
+    finally:
+        app.dependency_overrides.clear()
+        await async_engine.dispose()
+    return results
+
+
+def git_commit() -> Optional[str]:
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "HEAD"],
+            capture_output=True,
+            text=True,
+            check=True,
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def environment(url: URL, engine: Any) -> Dict[str, Any]:
+    versions = {}
+    for package in PACKAGES:
+        try:
+            versions[package] = metadata.version(package)
+        except metadata.PackageNotFoundError:
+            versions[package] = None
+    with engine.connect():
+        server_version = engine.dialect.server_version_info
+    return {
+        "created": datetime.now(tz=timezone.utc).isoformat(),
+        "git_commit": git_commit(),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "packages": versions,
+        "database": {
+            "dialect": url.get_backend_name(),
+            "server_version": ".".join(map(str, server_version or ())),
+        },
+    }
+
+
+def compare(results: List[Dict], baseline_file: str, threshold: float) -> None:
+    """Print the median of every benchmark relative to the baseline run."""
+    with open(baseline_file) as f:
+        baseline = {
+            (result["name"], result["size"]): result
+            for result in json.load(f)["results"]
+        }
+    print(f"\ncompared with {baseline_file} (ratio = current / baseline)")
+    for result in results:
+        before = baseline.get((result["name"], result["size"]))
+        if before is None:
+            continue
+        ratio = result["median"] / before["median"]
+        flag = " SLOWER" if ratio > threshold else ""
+        print(
+            f"{result['name']:<48} {str(result['size']):>8}"
+            f" {before['median'] * 1e3:>10.3f} ms"
+            f" {result['median'] * 1e3:>10.3f} ms {ratio:>6.2f}{flag}"
+        )
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument(
+        "--sizes", type=int, nargs="+", default=[10_000, 100_000]
+    )
+    parser.add_argument("--db-url", default="sqlite:///bench.db")
+    parser.add_argument("--repeat", type=int, default=20)
+    parser.add_argument("--formulas", type=int, default=1000)
+    parser.add_argument("--output", default="bench_results.json")
+    parser.add_argument("--baseline", default=None)
+    parser.add_argument("--threshold", type=float, default=1.2)
+    args = parser.parse_args()
+
+    url = make_url(args.db_url)
+    if url == make_url(config.DATABASE_URL):
+        parser.error("--db-url must not be the app database (DATABASE_URL)")
+    engine = create_engine(url)
+    if not database_exists(engine.url):
+        create_database(engine.url)
+    SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
+    routes_url = async_url(url)
+    # measure the route handlers, not the response cache
+    response_cache.maxsize = 0
+
+    rng = np.random.default_rng(0)
+    results = bench_chem_utils(
+        args.repeat, synthetic_data.random_formulas(rng, args.formulas)
+    )
+    library = {}
+    for size in args.sizes:
+        models.Base.metadata.drop_all(bind=engine)
+        models.Base.metadata.create_all(bind=engine)
+        with SessionLocal() as db:
+            library[size] = synthetic_data.generate_library(db, size)
+        print(f"library of {size}: {library[size]}")
+        results += bench_crud(SessionLocal, size, args.repeat)
+        results += bench_serialization(SessionLocal, size, args.repeat)
+        if routes_url is not None:
+            results += asyncio.run(
+                bench_routes(routes_url, SessionLocal, size, args.repeat)
+            )
+        else:
+            print(f"no async driver for {url.drivername}, routes skipped")
+    models.Base.metadata.drop_all(bind=engine)
+
+    for result in results:
+        print(
+            f"{result['group']:<28} {result['name']:<48}"
+            f" {str(result['size']):>8} median {result['median'] * 1e3:10.3f} ms"  # noqa: E501
+        )
+    report = {
+        "environment": environment(url, engine),
+        "arguments": vars(args),
+        "library": library,
+        "results": results,
+    }
+    with open(args.output, "w") as f:
+        json.dump(report, f, indent=2)
+    print(f"results written to {args.output}")
+    if args.baseline:
+        compare(results, args.baseline, args.threshold)
+
+
+if __name__ == "__main__":
+    main()
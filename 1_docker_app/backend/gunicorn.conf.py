@@ -0,0 +1,22 @@
+# 2024-09 Kai-Michael Kammer
+"""
+gunicorn settings, read from the working directory when the app is started with gunicorn.
+"""  # noqa: E501
+import os
+
+from prometheus_client import multiprocess
+
+# import the app once in the master, so (re)started workers are forked ready to run its startup  # noqa: E501
+preload_app = True
+
+
+def post_fork(server, worker):
+    from mass_spec_app.startup import startup_report
+
+    startup_report.forked()
+
+
+def child_exit(server, worker):
+    # drop the live gauges (e.g. requests in progress) of a stopped worker
+    if os.environ.get("PROMETHEUS_MULTIPROC_DIR"):
+        multiprocess.mark_process_dead(worker.pid)
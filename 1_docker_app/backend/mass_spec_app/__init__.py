@@ -1,3 +1,8 @@
-from mass_spec_app.app import app  # noqa: F401
+import time
+
+# start of the app import, the first phase of the startup report (startup.py)
+IMPORT_STARTED = time.perf_counter()
+
+from mass_spec_app.app import app  # noqa: E402, F401
 
 all = ["app"]
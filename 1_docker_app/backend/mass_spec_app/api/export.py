@@ -0,0 +1,57 @@
+# 2024-09 Kai-Michael Kammer
+"""
+Serializes streamed database rows as NDJSON or CSV for the export endpoints.
+Rows are written batch by batch, so a StreamingResponse never holds more than one batch in memory.
+"""  # noqa: E501
+import csv
+import io
+import json
+from typing import AsyncIterator, List, Sequence
+
+from sqlalchemy import RowMapping, Select
+from sqlalchemy.ext.asyncio import AsyncEngine
+
+from mass_spec_app.db import async_crud
+
+MEDIA_TYPES = {"ndjson": "application/x-ndjson", "csv": "text/csv"}
+
+
+def format_header(export_format: str, columns: List[str]) -> str:
+    """Return the header of an export (CSV only)."""
+    if export_format != "csv":
+        return ""
+    buffer = io.StringIO()
+    csv.writer(buffer).writerow(columns)
+    return buffer.getvalue()
+
+
+def format_batch(
+    export_format: str, batch: Sequence[RowMapping], columns: List[str]
+) -> str:
+    """Serialize a batch of rows as CSV or NDJSON."""
+    if export_format == "csv":
+        buffer = io.StringIO()
+        csv.DictWriter(buffer, fieldnames=columns).writerows(batch)
+        return buffer.getvalue()
+    return "".join(json.dumps(dict(row)) + "\n" for row in batch)
+
+
+async def iter_export(
+    engine: AsyncEngine,
+    statement: Select,
+    export_format: str,
+    batch_size: int,
+) -> AsyncIterator[str]:
+    """
+    Yield the rows of statement as NDJSON lines or CSV, one chunk per batch.
+    A dedicated connection is used, as the request's session is closed before the response is streamed.
+    """  # noqa: E501
+    columns = list(statement.selected_columns.keys())
+    header = format_header(export_format, columns)
+    if header:
+        yield header
+    async with engine.connect() as connection:
+        async for batch in async_crud.stream_rows(
+            connection, statement, batch_size
+        ):
+            yield format_batch(export_format, batch, columns)
@@ -0,0 +1,44 @@
+# 2024-09 Kai-Michael Kammer
+"""
+Opaque cursors for keyset pagination of the list endpoints.
+A cursor wraps the primary key of the last row of a page; the next page continues after it
+with "WHERE id > :last_id ORDER BY id LIMIT :limit", which costs the same on every page.
+"""  # noqa: E501
+import base64
+import binascii
+import json
+from typing import Optional, Sequence
+
+from fastapi import HTTPException, Response
+
+# response header holding the cursor of the next page
+NEXT_CURSOR_HEADER = "X-Next-Cursor"
+
+
+def encode_cursor(last_id: int) -> str:
+    """Encode the primary key of the last row into an opaque cursor."""
+    payload = json.dumps({"id": last_id}).encode()
+    return base64.urlsafe_b64encode(payload).decode()
+
+
+def decode_cursor(cursor: Optional[str]) -> Optional[int]:
+    """Decode a cursor into the primary key to continue after."""
+    if cursor is None:
+        return None
+    try:
+        last_id = json.loads(base64.urlsafe_b64decode(cursor.encode()))["id"]
+    except (binascii.Error, ValueError, KeyError, TypeError):
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+    if not isinstance(last_id, int):
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+    return last_id
+
+
+def set_next_cursor(
+    response: Response, rows: Sequence, limit: int, id_attribute: str
+) -> None:
+    """Add the cursor of the next page to the response if the page was full."""
+    if rows and len(rows) == limit:
+        response.headers[NEXT_CURSOR_HEADER] = encode_cursor(
+            getattr(rows[-1], id_attribute)
+        )
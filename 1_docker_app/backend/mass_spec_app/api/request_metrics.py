@@ -0,0 +1,70 @@
+# 2024-09 Kai-Michael Kammer
+"""
+ASGI middleware recording the duration and the in-flight count of every HTTP request (see metrics.py).
+Requests are labelled with the route template (e.g. /compounds/{compound_id}) instead of the path,
+so the number of label values stays bounded; paths without a route are labelled "unmatched".
+"""  # noqa: E501
+import time
+from typing import List, Optional, Pattern, Set, Tuple
+
+from starlette.types import ASGIApp, Message, Receive, Scope, Send
+
+from mass_spec_app.metrics import REQUEST_DURATION, REQUESTS_IN_PROGRESS
+
+# path regex, path template and methods (None: all) of a route
+Route = Tuple[Pattern, str, Optional[Set[str]]]
+
+
+def route_template(routes: List[Route], scope: Scope) -> str:
+    """Return the path template of the route matching the request."""
+    path, method = scope["path"], scope["method"]
+    partial = None
+    for path_regex, template, methods in routes:
+        if path_regex.match(path):
+            if methods is None or method in methods:
+                return template
+            # the path matches but the method does not (405)
+            partial = partial or template
+    return partial or "unmatched"
+
+
+class RequestMetricsMiddleware:
+    def __init__(self, app: ASGIApp) -> None:
+        self.app = app
+        # the app's routes, built on the first request
+        self._routes: Optional[List[Route]] = None
+
+    async def __call__(
+        self, scope: Scope, receive: Receive, send: Send
+    ) -> None:
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        if self._routes is None:
+            # matching the compiled path regexes directly is much cheaper than Route.matches  # noqa: E501
+            self._routes = [
+                (route.path_regex, route.path, getattr(route, "methods", None))
+                for route in scope["app"].routes
+                if hasattr(route, "path_regex")
+            ]
+        method = scope["method"]
+        route = route_template(self._routes, scope)
+        status = 500
+
+        async def send_with_status(message: Message) -> None:
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = message["status"]
+            await send(message)
+
+        in_progress = REQUESTS_IN_PROGRESS.labels(method, route)
+        in_progress.inc()
+        started = time.perf_counter()
+        try:
+            await self.app(scope, receive, send_with_status)
+        finally:
+            REQUEST_DURATION.labels(method, route, str(status)).observe(
+                time.perf_counter() - started
+            )
+            in_progress.dec()
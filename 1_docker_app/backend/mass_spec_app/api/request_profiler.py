@@ -0,0 +1,158 @@
+# 2024-09 Kai-Michael Kammer
+"""
+ASGI middleware profiling single requests on demand (see profiling.py for the stored profiles).
+A request is profiled if it carries the X-Admin-Token header with the ADMIN_TOKEN and either the
+X-Profile: 1 header or the profile=1 query parameter. It runs under cProfile, its SQL statements
+are recorded with their durations, and the response gets an X-Profile-Id header to download the
+profile from /admin/profiles/. All other requests only pay for a header lookup.
+cProfile follows the event loop thread, which runs the async routes and awaits their queries;
+requests served concurrently by the same worker show up in the profile too, so profile a quiet one.
+Sync routes (ProfiledRoute) and functions passed to run_in_threadpool (profiling.profiled) run in
+the threadpool, their calls are profiled in their thread and merged into the request's profile.
+"""  # noqa: E501
+import cProfile
+import hmac
+import inspect
+import pstats
+import threading
+import time
+import uuid
+from typing import Any, Callable, Dict, List, Optional
+
+from fastapi.routing import APIRoute
+from starlette.datastructures import Headers, QueryParams
+from starlette.types import ASGIApp, Message, Receive, Scope, Send
+
+from mass_spec_app import config
+from mass_spec_app.profiling import (
+    ProfileStore,
+    captured_statements,
+    profile_store,
+    profiled,
+    thread_profilers,
+)
+
+# scope key set on profiled requests, so they bypass the response cache
+PROFILE_SCOPE_KEY = "mass_spec_app.profile"
+
+
+def is_admin(headers: Headers) -> bool:
+    """Return whether the request carries the configured admin token."""
+    token = headers.get("x-admin-token")
+    return bool(config.ADMIN_TOKEN) and (
+        token is not None
+        and hmac.compare_digest(token.encode(), config.ADMIN_TOKEN.encode())
+    )
+
+
+def _profile_requested(scope: Scope, headers: Headers) -> bool:
+    if headers.get("x-profile") == "1":
+        return True
+    query_string = scope.get("query_string", b"")
+    return (
+        b"profile=" in query_string
+        and QueryParams(query_string).get("profile") == "1"
+    )
+
+
+class ProfiledRoute(APIRoute):
+    """Route class whose sync endpoints are profiled in the threadpool when their request is."""  # noqa: E501
+
+    def __init__(
+        self, path: str, endpoint: Callable[..., Any], **kwargs: Any
+    ) -> None:
+        if not inspect.iscoroutinefunction(endpoint):
+            endpoint = profiled(endpoint)
+        super().__init__(path, endpoint, **kwargs)
+
+
+class ProfilingMiddleware:
+    def __init__(self, app: ASGIApp, store: ProfileStore = profile_store):
+        self.app = app
+        self.store = store
+        # only one profiler can be active per process
+        self._lock = threading.Lock()
+
+    async def __call__(
+        self, scope: Scope, receive: Receive, send: Send
+    ) -> None:
+        if scope["type"] != "http" or not config.ADMIN_TOKEN:
+            await self.app(scope, receive, send)
+            return
+        headers = Headers(scope=scope)
+        if not _profile_requested(scope, headers) or not is_admin(headers):
+            await self.app(scope, receive, send)
+            return
+
+        if not self._lock.acquire(blocking=False):
+            await self.app(
+                scope,
+                receive,
+                _with_header(send, b"x-profile-error", b"profiler busy"),
+            )
+            return
+        try:
+            await self._profile(scope, receive, send)
+        finally:
+            self._lock.release()
+
+    async def _profile(
+        self, scope: Scope, receive: Receive, send: Send
+    ) -> None:
+        profile_id = uuid.uuid4().hex
+        statements: List[Dict[str, Any]] = []
+        status: Optional[int] = None
+        send_id = _with_header(send, b"x-profile-id", profile_id.encode())
+
+        async def send_with_id(message: Message) -> None:
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = message["status"]
+            await send_id(message)
+
+        scope[PROFILE_SCOPE_KEY] = profile_id
+        token = captured_statements.set(statements)
+        profilers: List[cProfile.Profile] = []
+        profilers_token = thread_profilers.set(profilers)
+        profiler = cProfile.Profile()
+        started = time.perf_counter()
+        profiler.enable()
+        try:
+            await self.app(scope, receive, send_with_id)
+        finally:
+            profiler.disable()
+            duration = time.perf_counter() - started
+            captured_statements.reset(token)
+            thread_profilers.reset(profilers_token)
+            # the threadpool calls are merged into the request's profile
+            stats = pstats.Stats(profiler, *profilers)
+            self.store.save(
+                profile_id,
+                {
+                    "profile_id": profile_id,
+                    "method": scope["method"],
+                    "path": scope["path"],
+                    "query_string": scope["query_string"].decode("latin-1"),
+                    "status": status,
+                    "created": time.time(),
+                    "duration_ms": duration * 1e3,
+                    "sql_ms": sum(s["duration_ms"] for s in statements),
+                    "statements": statements,
+                    "threadpool_calls": len(profilers),
+                },
+                stats,
+            )
+
+
+def _with_header(send: Send, name: bytes, value: bytes) -> Send:
+    """Wrap send to add a header to the response start."""
+
+    async def wrapped(message: Message) -> None:
+        if message["type"] == "http.response.start":
+            message = {
+                **message,
+                "headers": [*message.get("headers", []), (name, value)],
+            }
+        await send(message)
+
+    return wrapped
@@ -0,0 +1,313 @@
+# 2024-09 Kai-Michael Kammer
+"""
+In-process cache for the responses of the read (GET) routes, with ETag/If-None-Match support.
+Responses are cached per path and query string together with the versions of the tables they read.
+The create routes bump the version of the tables they write (invalidate), so later requests miss the
+stale entries, which then age out of the LRU. Entries also expire after a TTL, which bounds how long
+writes made by other gunicorn workers (with their own cache) stay invisible.
+The LRU is bounded by its number of entries and the total size of their bodies. Responses larger than
+RESPONSE_CACHE_MAX_BODY are streamed through as soon as they exceed it, without an ETag.
+"""  # noqa: E501
+import hashlib
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Dict, List, Optional, Tuple
+
+from starlette.datastructures import Headers, MutableHeaders
+from starlette.types import ASGIApp, Message, Receive, Scope, Send
+
+from mass_spec_app import config
+from mass_spec_app.api.request_profiler import PROFILE_SCOPE_KEY
+from mass_spec_app.db import models
+
+ADDUCTS = models.Adduct.__tablename__
+COMPOUNDS = models.Compound.__tablename__
+RETENTION_TIMES = models.RetentionTime.__tablename__
+MEASURED_COMPOUNDS = models.MeasuredCompound.__tablename__
+
+# cached path prefixes and the tables their responses are built from (first match wins)  # noqa: E501
+CACHED_ROUTES: Tuple[Tuple[str, Tuple[str, ...]], ...] = (
+    ("/measured-compounds/export", ()),  # streamed, never cached
+    (
+        "/measured-compounds",
+        (MEASURED_COMPOUNDS, COMPOUNDS, ADDUCTS, RETENTION_TIMES),
+    ),
+    ("/compounds", (COMPOUNDS,)),
+    ("/adducts", (ADDUCTS,)),
+    ("/retention-times", (RETENTION_TIMES,)),
+)
+
+
+class _Entry:
+    __slots__ = ("versions", "expires", "status", "headers", "body", "etag")
+
+    def __init__(
+        self,
+        versions: Tuple[int, ...],
+        expires: float,
+        status: int,
+        headers: List[Tuple[bytes, bytes]],
+        body: bytes,
+        etag: str,
+    ) -> None:
+        self.versions = versions
+        self.expires = expires
+        self.status = status
+        self.headers = headers
+        self.body = body
+        self.etag = etag
+
+
+class ResponseCache:
+    """Thread-safe LRU of responses with a TTL and per-table version counters."""  # noqa: E501
+
+    def __init__(
+        self,
+        maxsize: int,
+        ttl: float,
+        max_body: int = config.RESPONSE_CACHE_MAX_BODY,
+        max_bytes: int = config.RESPONSE_CACHE_MAX_BYTES,
+    ) -> None:
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.max_body = max_body
+        self.max_bytes = max_bytes
+        self._data: OrderedDict[Tuple[str, str], _Entry] = OrderedDict()
+        self._bytes = 0
+        self._versions: Dict[str, int] = {}
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.not_modified = 0
+        self.too_large = 0
+
+    def versions(self, tables: Tuple[str, ...]) -> Tuple[int, ...]:
+        """Return the current version of each table."""
+        with self._lock:
+            return tuple(self._versions.get(table, 0) for table in tables)
+
+    def invalidate(self, *tables: str) -> None:
+        """Bump the version of the given tables, making their cached responses stale."""  # noqa: E501
+        with self._lock:
+            for table in tables:
+                self._versions[table] = self._versions.get(table, 0) + 1
+
+    def get(
+        self, key: Tuple[str, str], versions: Tuple[int, ...]
+    ) -> Optional[_Entry]:
+        """Return the entry for key if it is fresh and built from the given versions."""  # noqa: E501
+        with self._lock:
+            entry = self._data.get(key)
+            if (
+                entry is None
+                or entry.versions != versions
+                or entry.expires < time.monotonic()
+            ):
+                self.misses += 1
+                return None
+            self._data.move_to_end(key)
+            self.hits += 1
+            return entry
+
+    def set(self, key: Tuple[str, str], entry: _Entry) -> None:
+        if self.maxsize <= 0 or self.ttl <= 0:
+            return
+        if len(entry.body) > min(self.max_body, self.max_bytes):
+            self.record_too_large()
+            return
+        with self._lock:
+            previous = self._data.pop(key, None)
+            if previous is not None:
+                self._bytes -= len(previous.body)
+            self._data[key] = entry
+            self._bytes += len(entry.body)
+            while (
+                len(self._data) > self.maxsize or self._bytes > self.max_bytes
+            ):
+                _, evicted = self._data.popitem(last=False)
+                self._bytes -= len(evicted.body)
+
+    def record_not_modified(self) -> None:
+        with self._lock:
+            self.not_modified += 1
+
+    def record_too_large(self) -> None:
+        with self._lock:
+            self.too_large += 1
+
+    def clear(self) -> None:
+        """Remove all entries and reset the counters (versions are kept)."""
+        with self._lock:
+            self._data.clear()
+            self._bytes = 0
+            self.hits = self.misses = self.not_modified = self.too_large = 0
+
+    def stats(self) -> Dict[str, float]:
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "not_modified": self.not_modified,
+                "too_large": self.too_large,
+                "size": len(self._data),
+                "maxsize": self.maxsize,
+                "bytes": self._bytes,
+                "max_bytes": self.max_bytes,
+                "hit_rate": self.hits / lookups if lookups else 0.0,
+            }
+
+
+def _tables_for_path(path: str) -> Optional[Tuple[str, ...]]:
+    for prefix, tables in CACHED_ROUTES:
+        if path.startswith(prefix):
+            return tables or None
+    return None
+
+
+def _etag(body: bytes) -> str:
+    return f'"{hashlib.blake2b(body, digest_size=16).hexdigest()}"'
+
+
+def _etag_matches(if_none_match: Optional[str], etag: str) -> bool:
+    if not if_none_match:
+        return False
+    candidates = [
+        candidate.strip().removeprefix("W/")
+        for candidate in if_none_match.split(",")
+    ]
+    return "*" in candidates or etag in candidates
+
+
+class ResponseCacheMiddleware:
+    """
+    ASGI middleware serving GET requests of the CACHED_ROUTES from the response cache.
+    Every cacheable 200 response gets an ETag, a matching If-None-Match is answered with 304.
+    """  # noqa: E501
+
+    def __init__(self, app: ASGIApp, cache: "ResponseCache") -> None:
+        self.app = app
+        self.cache = cache
+
+    async def __call__(
+        self, scope: Scope, receive: Receive, send: Send
+    ) -> None:
+        if (
+            scope["type"] != "http"
+            or scope["method"] != "GET"
+            # profiled requests run the route (see request_profiler.py)
+            or PROFILE_SCOPE_KEY in scope
+        ):
+            await self.app(scope, receive, send)
+            return
+        tables = _tables_for_path(scope["path"])
+        if tables is None:
+            await self.app(scope, receive, send)
+            return
+
+        key = (scope["path"], scope["query_string"].decode("latin-1"))
+        if_none_match = Headers(scope=scope).get("if-none-match")
+        # versions are read before the request, so a concurrent write can not
+        # be cached under the new versions with the old data
+        versions = self.cache.versions(tables)
+        entry = self.cache.get(key, versions)
+        if entry is None:
+            entry = await self._call_app(scope, receive, send, versions)
+            if entry is None:
+                return
+            self.cache.set(key, entry)
+        await self._send_entry(send, entry, if_none_match)
+
+    async def _call_app(
+        self,
+        scope: Scope,
+        receive: Receive,
+        send: Send,
+        versions: Tuple[int, ...],
+    ) -> Optional[_Entry]:
+        """
+        Run the route and buffer its response.
+        Responses other than 200 and bodies larger than the cache's max_body are passed through
+        unchanged and None is returned.
+        """  # noqa: E501
+        start: Dict[str, Any] = {}
+        chunks: List[bytes] = []
+        size = 0
+        passthrough = False
+
+        async def buffer(message: Message) -> None:
+            nonlocal passthrough, size
+            if message["type"] == "http.response.start":
+                start.update(message)
+                if message["status"] != 200:
+                    passthrough = True
+                    await send(message)
+            elif passthrough:
+                await send(message)
+            else:
+                chunks.append(message.get("body", b""))
+                size += len(chunks[-1])
+                if size > min(self.cache.max_body, self.cache.max_bytes):
+                    # send what was buffered and stream the rest through
+                    self.cache.record_too_large()
+                    passthrough = True
+                    await send(start)
+                    await send(
+                        {
+                            "type": "http.response.body",
+                            "body": b"".join(chunks),
+                            "more_body": message.get("more_body", False),
+                        }
+                    )
+
+        await self.app(scope, receive, buffer)
+        if passthrough:
+            return None
+        body = b"".join(chunks)
+        headers = [
+            (name, value)
+            for name, value in start.get("headers", [])
+            if name.lower() != b"content-length"
+        ]
+        return _Entry(
+            versions=versions,
+            expires=time.monotonic() + self.cache.ttl,
+            status=start["status"],
+            headers=headers,
+            body=body,
+            etag=_etag(body),
+        )
+
+    async def _send_entry(
+        self, send: Send, entry: _Entry, if_none_match: Optional[str]
+    ) -> None:
+        headers = MutableHeaders(raw=list(entry.headers))
+        headers["etag"] = entry.etag
+        if _etag_matches(if_none_match, entry.etag):
+            self.cache.record_not_modified()
+            del headers["content-type"]
+            await send(
+                {
+                    "type": "http.response.start",
+                    "status": 304,
+                    "headers": headers.raw,
+                }
+            )
+            await send({"type": "http.response.body", "body": b""})
+            return
+        headers["content-length"] = str(len(entry.body))
+        await send(
+            {
+                "type": "http.response.start",
+                "status": entry.status,
+                "headers": headers.raw,
+            }
+        )
+        await send({"type": "http.response.body", "body": entry.body})
+
+
+# one cache per process
+response_cache = ResponseCache(
+    maxsize=config.RESPONSE_CACHE_SIZE, ttl=config.RESPONSE_CACHE_TTL
+)
@@ -2,22 +2,52 @@
 """
 Defines the API routes for all API requests to the appropriate endpoints for database interactions.
 """  # noqa: E501
-from typing import Dict, List
-
-from fastapi import APIRouter, Depends, HTTPException
-from fastapi.responses import HTMLResponse
+import os
+import shutil
+import tempfile
+from typing import Any, Dict, List, Literal, Optional
+
+import numpy as np
+from fastapi import (
+    APIRouter,
+    Depends,
+    HTTPException,
+    Query,
+    Response,
+    UploadFile,
+)
+from fastapi.responses import FileResponse, HTMLResponse, StreamingResponse
 from fastapi.templating import Jinja2Templates
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy.orm import Session
+from starlette.concurrency import run_in_threadpool
 from starlette.requests import Request
 
 import mass_spec_app.scripts.chem_utils as cu
-from mass_spec_app import config
-from mass_spec_app.api import schemas
-from mass_spec_app.db import crud, models
-from mass_spec_app.db.session import get_db
+from mass_spec_app import config, jobs, metrics
+from mass_spec_app.api import export, schemas
+from mass_spec_app.api.pagination import decode_cursor, set_next_cursor
+from mass_spec_app.api.request_profiler import ProfiledRoute, is_admin
+from mass_spec_app.api.response_cache import response_cache
+from mass_spec_app.db import async_crud, crud, models, session
+from mass_spec_app.db.mass_index import PeakMatches, mass_index
+from mass_spec_app.db.pool_metrics import get_pool_metrics
+from mass_spec_app.db.session import get_async_db, get_db
+from mass_spec_app.profiling import profile_store, profiled
+from mass_spec_app.scripts import (  # noqa: F401
+    file_import,
+    job_tasks,
+    mass_engine,
+)
 
 # Create an APIRouter instance
-router = APIRouter()
+router = APIRouter(route_class=ProfiledRoute)
+
+DUPLICATE_MEASURED_COMPOUND = (
+    "Measured compound with this compound, retention time and adduct"
+    " already exists."
+)
 
 # Set up Jinja2 templates
 templates = Jinja2Templates(directory="templates")
@@ -37,25 +67,36 @@ async def read_root(request: Request) -> HTMLResponse:
     response_model=List[schemas.Compound],
     tags=[config.STR_COMPOUNDS],
 )
-def read_compounds(
-    skip: int = 0, limit: int = 100, db: Session = Depends(get_db)
+async def read_compounds(
+    response: Response,
+    skip: int = 0,
+    limit: int = 100,
+    cursor: Optional[str] = None,
+    db: AsyncSession = Depends(get_async_db),
 ) -> List[models.Compound]:
-    return crud.get_compounds(db, skip=skip, limit=limit)
+    """Fetch compounds, pass the X-Next-Cursor header as cursor for the next page."""  # noqa: E501
+    compounds = await async_crud.get_compounds(
+        db, skip=skip, limit=limit, after=decode_cursor(cursor)
+    )
+    set_next_cursor(response, compounds, limit, "compound_id")
+    return compounds
 
 
 # Route for creating Compounds
 @router.post(
     "/compounds/", response_model=schemas.Compound, tags=[config.STR_COMPOUNDS]
 )
-def create_compound(
-    compound: schemas.CompoundCreate, db: Session = Depends(get_db)
+async def create_compound(
+    compound: schemas.CompoundCreate, db: AsyncSession = Depends(get_async_db)
 ) -> models.Compound:
     try:
-        return crud.create_compound(db, compound=compound)
+        db_compound = await async_crud.create_compound(db, compound=compound)
     except ValueError as e:
         raise HTTPException(
             status_code=404, detail=f"Not able to create compound: {e}"
         )
+    response_cache.invalidate(models.Compound.__tablename__)
+    return db_compound
 
 
 # Route for a Single Compound by ID
@@ -64,11 +105,11 @@ def create_compound(
     response_model=schemas.Compound,
     tags=[config.STR_COMPOUNDS],
 )
-def get_compound_by_id(
-    compound_id: int, db: Session = Depends(get_db)
+async def get_compound_by_id(
+    compound_id: int, db: AsyncSession = Depends(get_async_db)
 ) -> models.Compound:
     """Fetch a single compound by ID."""
-    compound = crud.get_compound_by_id(db, compound_id=compound_id)
+    compound = await async_crud.get_compound_by_id(db, compound_id=compound_id)
     if compound is None:
         raise HTTPException(status_code=404, detail="Compound not found")
     return compound
@@ -78,21 +119,31 @@ def get_compound_by_id(
 @router.get(
     "/adducts/", response_model=List[schemas.Adduct], tags=[config.STR_ADDUCTS]
 )
-def get_adducts(
-    skip: int = 0, limit: int = 100, db: Session = Depends(get_db)
+async def get_adducts(
+    response: Response,
+    skip: int = 0,
+    limit: int = 100,
+    cursor: Optional[str] = None,
+    db: AsyncSession = Depends(get_async_db),
 ) -> List[models.Adduct]:
     """Fetch adducts with pagination."""
-    return crud.get_adducts(db, skip=skip, limit=limit)
+    adducts = await async_crud.get_adducts(
+        db, skip=skip, limit=limit, after=decode_cursor(cursor)
+    )
+    set_next_cursor(response, adducts, limit, "adduct_id")
+    return adducts
 
 
 # Route for creating Adducts
 @router.post(
     "/adducts/", response_model=schemas.Compound, tags=[config.STR_ADDUCTS]
 )
-def create_adducts(
-    adduct: schemas.AdductCreate, db: Session = Depends(get_db)
+async def create_adducts(
+    adduct: schemas.AdductCreate, db: AsyncSession = Depends(get_async_db)
 ) -> models.Adduct:
-    return crud.create_adduct(db, adduct=adduct)
+    db_adduct = await async_crud.create_adduct(db, adduct=adduct)
+    response_cache.invalidate(models.Adduct.__tablename__)
+    return db_adduct
 
 
 # Route for a Single Adduct by ID
@@ -101,11 +152,11 @@ def create_adducts(
     response_model=schemas.Adduct,
     tags=[config.STR_ADDUCTS],
 )
-def get_adduct_by_id(
-    adduct_id: int, db: Session = Depends(get_db)
+async def get_adduct_by_id(
+    adduct_id: int, db: AsyncSession = Depends(get_async_db)
 ) -> models.Adduct:
     """Fetch a single adduct by ID."""
-    adduct = crud.get_adduct_by_id(db, adduct_id=adduct_id)
+    adduct = await async_crud.get_adduct_by_id(db, adduct_id=adduct_id)
     if adduct is None:
         raise HTTPException(status_code=404, detail="Adduct not found")
     return adduct
@@ -117,10 +168,21 @@ def get_adduct_by_id(
     response_model=List[schemas.MeasuredCompound],
     tags=[config.STR_MEASURED_COMPOUNDS],
 )
-def read_measured_compounds(
-    skip: int = 0, limit: int = 100, db: Session = Depends(get_db)
+async def read_measured_compounds(
+    response: Response,
+    skip: int = 0,
+    limit: int = 100,
+    cursor: Optional[str] = None,
+    db: AsyncSession = Depends(get_async_db),
 ) -> List[models.MeasuredCompound]:
-    return crud.get_measured_compounds(db, skip=skip, limit=limit)
+    """Fetch measured compounds, pass the X-Next-Cursor header as cursor for the next page."""  # noqa: E501
+    measured_compounds = await async_crud.get_measured_compounds(
+        db, skip=skip, limit=limit, after=decode_cursor(cursor)
+    )
+    set_next_cursor(
+        response, measured_compounds, limit, "measured_compound_id"
+    )
+    return measured_compounds
 
 
 # Route for Measured Compounds with filter
@@ -129,27 +191,44 @@ def read_measured_compounds(
     response_model=List[schemas.MeasuredCompound],
     tags=[config.STR_MEASURED_COMPOUNDS],
 )
-def read_measured_compounds_filtered(
+async def read_measured_compounds_filtered(
+    response: Response,
     skip: int = 0,
     limit: int = 100,
     retention_time: float = None,
     compound_type: str = None,
     ion_mode: str = None,
-    db: Session = Depends(get_db),
+    rt_tol: float = 0.0,
+    rt_min: Optional[float] = None,
+    rt_max: Optional[float] = None,
+    cursor: Optional[str] = None,
+    db: AsyncSession = Depends(get_async_db),
 ) -> List[models.MeasuredCompound]:
-    compounds = crud.get_measured_compounds_filtered(
-        db,
-        skip=skip,
-        limit=limit,
-        retention_time=retention_time,
-        compound_type=compound_type,
-        ion_mode=ion_mode,
-    )
+    """
+    Filter measured compounds by compound type, ion mode and a retention time window.
+    The window is retention_time +/- rt_tol and/or rt_min to rt_max (inclusive).
+    """  # noqa: E501
+    try:
+        compounds = await async_crud.get_measured_compounds_filtered(
+            db,
+            skip=skip,
+            limit=limit,
+            retention_time=retention_time,
+            compound_type=compound_type,
+            ion_mode=ion_mode,
+            after=decode_cursor(cursor),
+            rt_tol=rt_tol,
+            rt_min=rt_min,
+            rt_max=rt_max,
+        )
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
     if not compounds:
         raise HTTPException(
             status_code=404,
             detail="No measured compounds found with the given criteria",
         )
+    set_next_cursor(response, compounds, limit, "measured_compound_id")
     return compounds
 
 
@@ -159,18 +238,248 @@ def read_measured_compounds_filtered(
     response_model=schemas.MeasuredCompound,
     tags=[config.STR_MEASURED_COMPOUNDS],
 )
-def create_measured_compound(
+async def create_measured_compound(
     measured_compound: schemas.MeasuredCompoundCreate,
-    db: Session = Depends(get_db),
+    db: AsyncSession = Depends(get_async_db),
 ) -> models.MeasuredCompound:
     try:
-        return crud.create_measured_compound_and_retention_time(
-            db, measured_compound=measured_compound
+        db_measured_compound = (
+            await async_crud.create_measured_compound_and_retention_time(
+                db, measured_compound=measured_compound
+            )
         )
     except ValueError as e:
         raise HTTPException(
             status_code=404, detail=f"Not able to create compound: {e}"
         )
+    except IntegrityError:
+        raise HTTPException(
+            status_code=409, detail=DUPLICATE_MEASURED_COMPOUND
+        )
+    response_cache.invalidate(
+        models.MeasuredCompound.__tablename__,
+        models.RetentionTime.__tablename__,
+    )
+    return db_measured_compound
+
+
+# Route for creating many measured compounds at once
+# a sync route on purpose: the formula computations are CPU bound and the
+# transaction is long, so it runs in the threadpool instead of the event loop
+@router.post(
+    "/measured-compounds/bulk",
+    response_model=List[schemas.MeasuredCompoundBulkResult],
+    tags=[config.STR_MEASURED_COMPOUNDS],
+)
+def create_measured_compounds_bulk(
+    measured_compounds: List[schemas.MeasuredCompoundCreate],
+    db: Session = Depends(get_db),
+) -> List[schemas.MeasuredCompoundBulkResult]:
+    """Create measured compounds in one transaction with a per-row report."""
+    try:
+        results = crud.create_measured_compounds_bulk(
+            db, measured_compounds=measured_compounds
+        )
+    except IntegrityError:
+        # a concurrent writer inserted one of the rows, nothing was created
+        raise HTTPException(
+            status_code=409, detail=DUPLICATE_MEASURED_COMPOUND
+        )
+    response_cache.invalidate(
+        models.MeasuredCompound.__tablename__,
+        models.RetentionTime.__tablename__,
+    )
+    return results
+
+
+async def sync_mass_index(db: AsyncSession, sync_db: Session) -> None:
+    """
+    Pick up rows written by other workers before searching the mass index.
+    A rebuild after a recompute reads and sorts every row, so it runs in the threadpool
+    with the sync session instead of blocking the event loop.
+    """  # noqa: E501
+    if await db.run_sync(mass_index.rebuild_due):
+        await run_in_threadpool(profiled(mass_index.rebuild), sync_db)
+    else:
+        await db.run_sync(mass_index.sync_new_rows)
+
+
+# Route for searching Measured Compounds by mass
+# has to be registered before the route with the measured_compound_id path
+@router.get(
+    "/measured-compounds/search-mass",
+    response_model=List[schemas.MeasuredCompound],
+    tags=[config.STR_MEASURED_COMPOUNDS],
+)
+async def search_measured_compounds_by_mass(
+    mz: float,
+    ppm: float = 10.0,
+    db: AsyncSession = Depends(get_async_db),
+    sync_db: Session = Depends(get_db),
+) -> List[models.MeasuredCompound]:
+    """Find all measured compounds with a measured mass within mz +/- ppm."""
+    await sync_mass_index(db, sync_db)
+    try:
+        measured_compound_ids = mass_index.search(mz=mz, ppm=ppm)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    return await async_crud.get_measured_compounds_by_ids(
+        db, measured_compound_ids=measured_compound_ids
+    )
+
+
+# Route for annotating a whole peak list against the measured compounds
+@router.post(
+    "/measured-compounds/annotate",
+    response_model=List[schemas.PeakMatch],
+    tags=[config.STR_MEASURED_COMPOUNDS],
+)
+async def annotate_peaks(
+    request: schemas.PeakAnnotationRequest,
+    db: AsyncSession = Depends(get_async_db),
+    sync_db: Session = Depends(get_db),
+) -> List[Dict]:
+    """
+    Match (mz, rt, ion_mode) peaks against all measured compounds within ppm and rt_tol.
+    Returns one entry per candidate with its mass error, grouped by peak.
+    """  # noqa: E501
+    await sync_mass_index(db, sync_db)
+    peaks = request.peaks
+    try:
+        # vectorized, but CPU bound for large peak lists
+        matches = await run_in_threadpool(
+            profiled(mass_index.match_peaks),
+            mzs=[peak.mz for peak in peaks],
+            ppm=request.ppm,
+            rts=[peak.rt for peak in peaks],
+            rt_tol=request.rt_tol,
+            ion_modes=[peak.ion_mode for peak in peaks],
+        )
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    return matches.records()
+
+
+def _score_isotopes(
+    request: schemas.IsotopeScoreRequest,
+    matches: PeakMatches,
+    envelopes: Dict[int, Optional[bytes]],
+) -> List[Dict]:
+    """Score the candidates of all patterns at once, best score per pattern first."""  # noqa: E501
+    patterns = request.patterns
+    envelope_mzs, envelope_abundances = mass_engine.unpack_isotope_envelopes(
+        [envelopes.get(i) for i in matches.ids.tolist()],
+        matches.masses,
+        config.ISOTOPE_PEAKS,
+    )
+    indices = matches.peak_indices
+    scores = mass_engine.score_isotope_patterns(
+        mass_engine.pad_patterns([p.mzs for p in patterns])[indices],
+        mass_engine.pad_patterns([p.intensities for p in patterns])[indices],
+        envelope_mzs,
+        envelope_abundances,
+        request.ppm,
+    )
+    # candidates without an envelope (NaN) are left out
+    keep = np.flatnonzero(scores.scores >= request.min_score)
+    keep = keep[np.lexsort((-scores.scores[keep], indices[keep]))]
+    columns = {
+        "pattern_index": indices[keep].tolist(),
+        "measured_compound_id": matches.ids[keep].tolist(),
+        "compound_id": matches.compound_ids[keep].tolist(),
+        "measured_mass": matches.masses[keep].tolist(),
+        "mass_error_ppm": matches.mass_errors_ppm[keep].tolist(),
+        "score": scores.scores[keep].tolist(),
+        "matched_peaks": scores.matched_peaks[keep].tolist(),
+        "expected_abundances": np.nan_to_num(
+            envelope_abundances[keep]
+        ).tolist(),
+        "observed_abundances": scores.observed_abundances[keep].tolist(),
+    }
+    return [dict(zip(columns, row)) for row in zip(*columns.values())]
+
+
+# Route for scoring observed isotope patterns against the stored envelopes
+@router.post(
+    "/measured-compounds/score-isotopes",
+    response_model=List[schemas.IsotopeScore],
+    tags=[config.STR_MEASURED_COMPOUNDS],
+)
+async def score_isotope_patterns(
+    request: schemas.IsotopeScoreRequest,
+    db: AsyncSession = Depends(get_async_db),
+    sync_db: Session = Depends(get_db),
+) -> List[Dict]:
+    """
+    Find the candidates of every pattern's monoisotopic peak like /measured-compounds/annotate
+    and score the whole pattern against their stored isotope envelopes (M, M+1, M+2, ...).
+    Returns the candidates grouped by pattern, best score first.
+    """  # noqa: E501
+    patterns = request.patterns
+    if any(not p.mzs or len(p.mzs) != len(p.intensities) for p in patterns):
+        raise HTTPException(
+            status_code=400,
+            detail="Every pattern needs mzs and as many intensities",
+        )
+    await sync_mass_index(db, sync_db)
+    try:
+        matches = await run_in_threadpool(
+            profiled(mass_index.match_peaks),
+            mzs=[min(p.mzs) for p in patterns],
+            ppm=request.ppm,
+            rts=[p.rt for p in patterns],
+            rt_tol=request.rt_tol,
+            ion_modes=[p.ion_mode for p in patterns],
+        )
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    envelopes = await async_crud.get_measured_isotope_envelopes(
+        db, measured_compound_ids=np.unique(matches.ids).tolist()
+    )
+    # vectorized, but CPU bound for many candidates
+    return await run_in_threadpool(
+        profiled(_score_isotopes), request, matches, envelopes
+    )
+
+
+# Route for exporting all (filtered) Measured Compounds as a stream
+@router.get(
+    "/measured-compounds/export",
+    response_class=StreamingResponse,
+    tags=[config.STR_MEASURED_COMPOUNDS],
+)
+async def export_measured_compounds(
+    export_format: Literal["ndjson", "csv"] = Query("ndjson", alias="format"),
+    retention_time: float = None,
+    compound_type: str = None,
+    ion_mode: str = None,
+    rt_tol: float = 0.0,
+    rt_min: Optional[float] = None,
+    rt_max: Optional[float] = None,
+    db: AsyncSession = Depends(get_async_db),
+) -> StreamingResponse:
+    """Stream measured compounds with their compound, adduct and retention time as NDJSON or CSV."""  # noqa: E501
+    try:
+        statement = crud.select_measured_compounds_flat(
+            retention_time=retention_time,
+            compound_type=compound_type,
+            ion_mode=ion_mode,
+            rt_tol=rt_tol,
+            rt_min=rt_min,
+            rt_max=rt_max,
+        )
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    return StreamingResponse(
+        export.iter_export(
+            db.bind, statement, export_format, config.EXPORT_BATCH_SIZE
+        ),
+        media_type=export.MEDIA_TYPES[export_format],
+        headers={
+            "Content-Disposition": "attachment;"
+            f' filename="measured_compounds.{export_format}"'
+        },
+    )
 
 
 # Route for a Single Measured Compound by ID
@@ -179,11 +488,11 @@ def create_measured_compound(
     response_model=schemas.MeasuredCompound,
     tags=[config.STR_MEASURED_COMPOUNDS],
 )
-def get_measured_compound_by_id(
-    measured_compound_id: int, db: Session = Depends(get_db)
+async def get_measured_compound_by_id(
+    measured_compound_id: int, db: AsyncSession = Depends(get_async_db)
 ) -> models.MeasuredCompound:
     """Fetch a single measured compound by ID."""
-    measured_compound = crud.get_measured_compound_by_id(
+    measured_compound = await async_crud.get_measured_compound_by_id(
         db, measured_compound_id=measured_compound_id
     )
     if measured_compound is None:
@@ -199,11 +508,19 @@ def get_measured_compound_by_id(
     response_model=List[schemas.RetentionTime],
     tags=[config.STR_RETENTION_TIME],
 )
-def get_retention_times(
-    skip: int = 0, limit: int = 100, db: Session = Depends(get_db)
+async def get_retention_times(
+    response: Response,
+    skip: int = 0,
+    limit: int = 100,
+    cursor: Optional[str] = None,
+    db: AsyncSession = Depends(get_async_db),
 ) -> List[models.RetentionTime]:
     """Fetch retention times with pagination."""
-    return crud.get_retention_times(db, skip=skip, limit=limit)
+    retention_times = await async_crud.get_retention_times(
+        db, skip=skip, limit=limit, after=decode_cursor(cursor)
+    )
+    set_next_cursor(response, retention_times, limit, "retention_time_id")
+    return retention_times
 
 
 # Route for a Single Retention Time by ID
@@ -212,11 +529,11 @@ def get_retention_times(
     response_model=schemas.RetentionTime,
     tags=[config.STR_RETENTION_TIME],
 )
-def get_retention_time_by_id(
-    retention_time_id: int, db: Session = Depends(get_db)
+async def get_retention_time_by_id(
+    retention_time_id: int, db: AsyncSession = Depends(get_async_db)
 ) -> models.RetentionTime:
     """Fetch a single retention time by ID."""
-    retention_time = crud.get_retention_time_by_id(
+    retention_time = await async_crud.get_retention_time_by_id(
         db, retention_time_id=retention_time_id
     )
     if retention_time is None:
@@ -254,3 +571,288 @@ def get_measured_formula(molecular_formula: str, adduct: str) -> Dict:
         return {"measured_formula": molecular_formula, "adduct": adduct}
     except ValueError as e:
         raise HTTPException(status_code=400, detail=str(e))
+
+
+@router.get(
+    "/tools/isotope-envelope/",
+    tags=[config.STR_TOOLS],
+)
+def get_isotope_envelope(molecular_formula: str) -> Dict:
+    """Calculate the first isotope peaks (M, M+1, ...) of a molecular formula."""  # noqa: E501
+    try:
+        mass = cu.get_monoisotopic_mass(molecular_formula=molecular_formula)
+        envelope = cu.get_isotope_envelope(molecular_formula)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    return {
+        "molecular_formula": molecular_formula,
+        "masses": [mass + offset for offset in envelope.offsets],
+        "abundances": list(envelope.abundances),
+    }
+
+
+@router.get(
+    "/tools/cache-stats/",
+    tags=[config.STR_TOOLS],
+)
+def get_cache_stats() -> Dict:
+    """Hit/miss/eviction counters of the formula, mass and response caches."""
+    return {**cu.get_cache_stats(), "response": response_cache.stats()}
+
+
+# Routes for importing uploaded files
+# the upload is copied to JOB_DIR, shared by the workers, and imported by a
+# job, the returned job_id is used to follow the progress under /jobs/
+def _submit_import(kind: str, file: UploadFile, db: Session) -> models.Job:
+    try:
+        file_format = file_import.file_format(file.filename or "")
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    os.makedirs(config.JOB_DIR, exist_ok=True)
+    with tempfile.NamedTemporaryFile(
+        dir=config.JOB_DIR, suffix=f".{file_format}", delete=False
+    ) as f:
+        shutil.copyfileobj(file.file, f, 1 << 20)
+    job = jobs.submit(
+        db,
+        kind,
+        {
+            "path": f.name,
+            "file_format": file_format,
+            "filename": file.filename,
+        },
+    )
+    jobs.job_runner.notify()
+    return job
+
+
+# sync routes, copying the upload blocks and runs in the threadpool
+@router.post(
+    "/compounds/upload",
+    response_model=schemas.Job,
+    status_code=202,
+    tags=[config.STR_JOBS],
+)
+def upload_compounds(
+    file: UploadFile, db: Session = Depends(get_db)
+) -> models.Job:
+    """Import compounds from an xlsx or csv file with the columns of CompoundCreate."""  # noqa: E501
+    return _submit_import("import_compounds", file, db)
+
+
+@router.post(
+    "/measured-compounds/upload",
+    response_model=schemas.Job,
+    status_code=202,
+    tags=[config.STR_JOBS],
+)
+def upload_measured_compounds(
+    file: UploadFile, db: Session = Depends(get_db)
+) -> models.Job:
+    """Import measured compounds from an xlsx or csv file with the columns of MeasuredCompoundCreate."""  # noqa: E501
+    return _submit_import("import_measured_compounds", file, db)
+
+
+# Routes for the jobs
+@router.post(
+    "/jobs/recompute-masses",
+    response_model=schemas.Job,
+    status_code=202,
+    tags=[config.STR_JOBS],
+)
+def submit_recompute_masses(db: Session = Depends(get_db)) -> models.Job:
+    """Recompute the masses of all compounds and measured compounds."""
+    job = jobs.submit(db, "recompute_masses", {})
+    jobs.job_runner.notify()
+    return job
+
+
+@router.post(
+    "/jobs/export",
+    response_model=schemas.Job,
+    status_code=202,
+    tags=[config.STR_JOBS],
+)
+def submit_export(
+    export_format: Literal["ndjson", "csv"] = Query("ndjson", alias="format"),
+    retention_time: float = None,
+    compound_type: str = None,
+    ion_mode: str = None,
+    rt_tol: float = 0.0,
+    rt_min: Optional[float] = None,
+    rt_max: Optional[float] = None,
+    db: Session = Depends(get_db),
+) -> models.Job:
+    """Export the (filtered) measured compounds to a file, downloaded from /jobs/{job_id}/result."""  # noqa: E501
+    filters = {
+        "retention_time": retention_time,
+        "compound_type": compound_type,
+        "ion_mode": ion_mode,
+        "rt_tol": rt_tol,
+        "rt_min": rt_min,
+        "rt_max": rt_max,
+    }
+    try:
+        # validate the filters before queueing
+        crud.select_measured_compounds_flat(**filters)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    job = jobs.submit(
+        db,
+        "export_measured_compounds",
+        {"format": export_format, "filters": filters},
+    )
+    jobs.job_runner.notify()
+    return job
+
+
+@router.get(
+    "/jobs/",
+    response_model=List[schemas.Job],
+    tags=[config.STR_JOBS],
+)
+def get_jobs(
+    status: Optional[str] = None,
+    skip: int = 0,
+    limit: int = 100,
+    db: Session = Depends(get_db),
+) -> List[models.Job]:
+    """Fetch the jobs, newest first, optionally only those with a status."""
+    return jobs.get_jobs(db, status=status, skip=skip, limit=limit)
+
+
+@router.get(
+    "/jobs/{job_id}",
+    response_model=schemas.Job,
+    tags=[config.STR_JOBS],
+)
+def get_job(job_id: str, db: Session = Depends(get_db)) -> models.Job:
+    """Status and progress of a job."""
+    job = jobs.get_job(db, job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="Job not found")
+    return job
+
+
+@router.get(
+    "/jobs/{job_id}/result",
+    tags=[config.STR_JOBS],
+)
+def get_job_result(job_id: str, db: Session = Depends(get_db)) -> Any:
+    """Result of a completed job, exports are downloaded as their file."""
+    job = jobs.get_job(db, job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="Job not found")
+    if job.status != jobs.COMPLETED:
+        raise HTTPException(
+            status_code=409, detail=f"Job is {job.status}, not completed"
+        )
+    if job.kind == "export_measured_compounds":
+        if not os.path.exists(job.result["path"]):
+            raise HTTPException(
+                status_code=410, detail="The export file expired"
+            )
+        export_format = job.result["format"]
+        return FileResponse(
+            job.result["path"],
+            media_type=export.MEDIA_TYPES[export_format],
+            filename=f"measured_compounds.{export_format}",
+        )
+    return job.result
+
+
+@router.post(
+    "/jobs/{job_id}/cancel",
+    response_model=schemas.Job,
+    tags=[config.STR_JOBS],
+)
+def cancel_job(job_id: str, db: Session = Depends(get_db)) -> models.Job:
+    """Cancel a queued job, or stop a running one at its next progress report."""  # noqa: E501
+    job = jobs.cancel(db, job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="Job not found")
+    return job
+
+
+# Route for the admin endpoints
+@router.get(
+    "/admin/pool-metrics/",
+    tags=[config.STR_ADMIN],
+)
+def get_connection_pool_metrics() -> Dict:
+    """Usage, checkout latency and connection errors of the database pools."""
+    return {
+        "sync": get_pool_metrics(session.engine),
+        "async": get_pool_metrics(session.async_engine.sync_engine),
+    }
+
+
+# Route for the Prometheus metrics
+@router.get(
+    "/metrics",
+    tags=[config.STR_ADMIN],
+)
+def get_metrics() -> Response:
+    """Request, SQL statement, pool and formula cache metrics in the Prometheus text format."""  # noqa: E501
+    content, content_type = metrics.render_metrics()
+    return Response(content=content, media_type=content_type)
+
+
+def require_admin(request: Request) -> None:
+    """Allow only requests with the X-Admin-Token header matching ADMIN_TOKEN."""  # noqa: E501
+    if not config.ADMIN_TOKEN:
+        raise HTTPException(status_code=404, detail="Profiling is disabled")
+    if not is_admin(request.headers):
+        raise HTTPException(status_code=403, detail="Invalid admin token")
+
+
+# Route for the stored request profiles
+@router.get(
+    "/admin/profiles/",
+    tags=[config.STR_ADMIN],
+    dependencies=[Depends(require_admin)],
+)
+def get_profiles() -> List[Dict]:
+    """Summaries of the most recent request profiles, newest first."""
+    profiles = (
+        profile_store.get(profile_id) for profile_id in profile_store.ids()
+    )
+    return [
+        {
+            key: value
+            for key, value in profile.items()
+            if key not in ("statements", "functions")
+        }
+        for profile in profiles
+        if profile is not None
+    ]
+
+
+@router.get(
+    "/admin/profiles/{profile_id}",
+    tags=[config.STR_ADMIN],
+    dependencies=[Depends(require_admin)],
+)
+def get_profile(profile_id: str) -> Dict:
+    """Profile of a request with its SQL statements and slowest functions."""
+    profile = profile_store.get(profile_id)
+    if profile is None:
+        raise HTTPException(status_code=404, detail="Profile not found")
+    return profile
+
+
+@router.get(
+    "/admin/profiles/{profile_id}/pstats",
+    tags=[config.STR_ADMIN],
+    dependencies=[Depends(require_admin)],
+)
+def download_profile_stats(profile_id: str) -> FileResponse:
+    """Raw cProfile stats of a request, to be read with pstats or snakeviz."""
+    path = profile_store.stats_path(profile_id)
+    if path is None:
+        raise HTTPException(status_code=404, detail="Profile not found")
+    return FileResponse(
+        path,
+        media_type="application/octet-stream",
+        filename=f"{profile_id}.prof",
+    )
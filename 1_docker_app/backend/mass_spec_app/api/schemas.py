@@ -4,7 +4,8 @@ Defines Pydantic schemas for data validation and serialization of request/respon
 Schemas are used for ensuring valid input when interacting with compounds, measured-compounds, retention times, and adducts.
 They are split into three parts—Base (common to all), Create (POST), and Response (GET, which includes auto-generated fields).
 """  # noqa: E501
-from typing import Optional
+from datetime import datetime
+from typing import Any, Dict, List, Optional
 
 from pydantic import BaseModel
 
@@ -89,3 +90,88 @@ class MeasuredCompound(MeasuredCompoundBase):
 
     class Config:
         from_attributes = True  # allows Pydantic to extract data from SQLAlchemy objects using their attributes # noqa: E501
+
+
+# Bulk Measured Compound Schema
+class MeasuredCompoundBulkResult(BaseModel):
+    index: int  # position of the row in the request
+    success: bool
+    measured_compound_id: Optional[int] = None
+    error: Optional[str] = None
+
+
+# Peak Annotation Schemas
+class Peak(BaseModel):
+    mz: float
+    rt: Optional[float] = (
+        None  # without rt the peak matches any retention time  # noqa: E501
+    )
+    ion_mode: Optional[str] = None  # without ion_mode the peak matches both
+
+
+class PeakAnnotationRequest(BaseModel):
+    peaks: List[Peak]
+    ppm: float = 10.0
+    rt_tol: Optional[float] = (
+        None  # without rt_tol retention times are ignored  # noqa: E501
+    )
+
+
+class PeakMatch(BaseModel):
+    peak_index: int  # position of the peak in the request
+    measured_compound_id: int
+    compound_id: int
+    measured_mass: float
+    retention_time: float
+    ion_mode: str
+    mass_error_ppm: float  # (peak mz - measured mass) / measured mass * 1e6
+
+
+# Isotope Pattern Scoring Schemas
+class IsotopePattern(BaseModel):
+    # observed isotope peaks, the lowest mz is the monoisotopic peak
+    mzs: List[float]
+    intensities: List[float]
+    rt: Optional[float] = (
+        None  # without rt the pattern matches any retention time  # noqa: E501
+    )
+    ion_mode: Optional[str] = None  # without ion_mode the pattern matches both
+
+
+class IsotopeScoreRequest(BaseModel):
+    patterns: List[IsotopePattern]
+    ppm: float = 10.0  # for the monoisotopic peak and every isotope peak
+    rt_tol: Optional[float] = (
+        None  # without rt_tol retention times are ignored  # noqa: E501
+    )
+    min_score: float = 0.0  # candidates scoring lower are left out
+
+
+class IsotopeScore(BaseModel):
+    pattern_index: int  # position of the pattern in the request
+    measured_compound_id: int
+    compound_id: int
+    measured_mass: float
+    mass_error_ppm: float  # of the monoisotopic peak
+    score: float  # cosine similarity of the observed and expected envelope
+    matched_peaks: int  # envelope peaks found in the pattern
+    expected_abundances: List[float]  # stored envelope (M, M+1, ...)
+    observed_abundances: List[float]  # matched intensities, relative
+
+
+# Job Schema
+class Job(BaseModel):
+    job_id: str
+    kind: str
+    status: str  # queued, running, completed, failed or cancelled
+    params: Dict[str, Any]
+    progress: Dict[str, Any]  # reported by the running job
+    result: Optional[Dict[str, Any]] = None
+    error: Optional[str] = None  # why the job failed
+    cancel_requested: bool
+    created_at: datetime
+    started_at: Optional[datetime] = None
+    finished_at: Optional[datetime] = None
+
+    class Config:
+        from_attributes = True  # allows Pydantic to extract data from SQLAlchemy objects using their attributes # noqa: E501
@@ -7,9 +7,20 @@ from contextlib import asynccontextmanager
 
 from fastapi import FastAPI
 
+from mass_spec_app import IMPORT_STARTED
+from mass_spec_app.api.request_metrics import RequestMetricsMiddleware
+from mass_spec_app.api.request_profiler import ProfilingMiddleware
+from mass_spec_app.api.response_cache import (
+    ResponseCacheMiddleware,
+    response_cache,
+)
 from mass_spec_app.api.routes import router
+from mass_spec_app.db import crud
+from mass_spec_app.db.adduct_registry import adduct_registry
+from mass_spec_app.db.mass_index import mass_index
 from mass_spec_app.db.session import SessionLocal
-from mass_spec_app.scripts.populate_data import populate_data
+from mass_spec_app.jobs import job_runner
+from mass_spec_app.startup import startup_report
 
 
 @asynccontextmanager
@@ -17,11 +28,30 @@ async def lifespan(app: FastAPI):
     # Manually create the database session as lifespan does not work with Depends # noqa: E501
     db = SessionLocal()
     try:
-        # Run the data population logic
-        populate_data(
-            db
-        )  # Pass the session manually to the populate_data function
+        with startup_report.phase("initialization check"):
+            initialized = crud.check_initialization_status(db)
+        if not initialized:
+            with startup_report.phase("population"):
+                # pandas and the input parsing are only imported when the
+                # database is empty, restarted workers skip them
+                from mass_spec_app.scripts.populate_data import populate_data
+
+                # Run the data population logic
+                populate_data(
+                    db
+                )  # Pass the session manually to the populate_data function
+        # Load the parsed adducts used when creating measured compounds
+        with startup_report.phase("adduct registry"):
+            adduct_registry.load(db)
+        # Load the measured masses into the in-memory search index
+        with startup_report.phase("mass index"):
+            mass_index.build(db)
+        print(startup_report.summary())
+        # run the queued jobs (see jobs.py)
+        job_runner.start(SessionLocal)
         yield
+        # wait for running jobs, unfinished ones are failed once their heartbeat is stale (see jobs.py)  # noqa: E501
+        job_runner.stop(timeout=10)
     finally:
         # Close the database session
         db.close()
@@ -40,6 +70,14 @@ app = FastAPI(
 
 # include api routes
 app.include_router(router=router)
+# serve repeated GET requests from memory, with ETag/If-None-Match support
+app.add_middleware(ResponseCacheMiddleware, cache=response_cache)
+# profiles requests flagged by an admin, outside the cache so they bypass it
+app.add_middleware(ProfilingMiddleware)
+# outermost, so requests answered from the response cache are measured too
+app.add_middleware(RequestMetricsMiddleware)
+# the app and all its dependencies are imported at this point
+startup_report.record("import", IMPORT_STARTED)
 
 # Create all database tables
 # we are using alembic instead
@@ -4,13 +4,97 @@ Imports strings from the os environment
 Contains global string declarations
 """
 import os
+import tempfile
 
 DATABASE_URL = os.environ["DATABASE_URL"]
 DATABASE_URL_TEST = os.environ["DATABASE_URL_TEST"]
 
+# number of rows written per transaction when populating the database
+POPULATE_CHUNK_SIZE = int(os.environ.get("POPULATE_CHUNK_SIZE", 5000))
+# processes computing the measured formulas of the chunks while the import writes (0: none)  # noqa: E501
+POPULATE_WORKERS = int(os.environ.get("POPULATE_WORKERS", 0))
+# number of rows parsed and written per transaction by the upload imports
+IMPORT_CHUNK_SIZE = int(os.environ.get("IMPORT_CHUNK_SIZE", 5000))
+# jobs all workers together run at the same time, every worker has as many runner threads (see jobs.py)  # noqa: E501
+JOB_CONCURRENCY = int(os.environ.get("JOB_CONCURRENCY", 2))
+# seconds between checks for jobs submitted to other workers
+JOB_POLL_INTERVAL = float(os.environ.get("JOB_POLL_INTERVAL", 1))
+# seconds between the heartbeats a worker writes for its running jobs
+JOB_HEARTBEAT_INTERVAL = float(os.environ.get("JOB_HEARTBEAT_INTERVAL", 10))
+# seconds without a heartbeat after which a running job counts as orphaned (its worker died)  # noqa: E501
+JOB_HEARTBEAT_TIMEOUT = float(os.environ.get("JOB_HEARTBEAT_TIMEOUT", 60))
+# directory shared by the gunicorn workers for job files (uploads, exports)
+JOB_DIR = os.environ.get(
+    "JOB_DIR", os.path.join(tempfile.gettempdir(), "mass_spec_jobs")
+)
+# seconds job files (exports, uploads) are kept after their last change, the job runners delete older ones  # noqa: E501
+JOB_FILE_RETENTION = float(os.environ.get("JOB_FILE_RETENTION", 24 * 3600))
+# number of rows fetched per server-side cursor batch when exporting
+EXPORT_BATCH_SIZE = int(os.environ.get("EXPORT_BATCH_SIZE", 1000))
+# isotope peaks (M, M+1, M+2, ...) stored per compound and measured compound
+ISOTOPE_PEAKS = int(os.environ.get("ISOTOPE_PEAKS", 4))
+# seconds sync keeps looking for missing ids below the highest indexed id, longer than any insert transaction  # noqa: E501
+MASS_INDEX_GAP_TIMEOUT = float(os.environ.get("MASS_INDEX_GAP_TIMEOUT", 600))
+# seconds between the checks of the mass index for a completed recompute job
+MASS_INDEX_GENERATION_INTERVAL = float(
+    os.environ.get("MASS_INDEX_GENERATION_INTERVAL", 5)
+)
+# maximum number of entries per formula/mass cache in chem_utils
+FORMULA_CACHE_SIZE = int(os.environ.get("FORMULA_CACHE_SIZE", 65536))
+
+# Connection pools
+# gunicorn reads its worker count from WEB_CONCURRENCY as well
+WEB_CONCURRENCY = int(os.environ.get("WEB_CONCURRENCY", 1))
+# connections all workers together may open, keep below postgres' max_connections (default 100)  # noqa: E501
+DB_MAX_CONNECTIONS = int(os.environ.get("DB_MAX_CONNECTIONS", 80))
+# every worker has a sync and an async engine, by default each pool gets an equal share  # noqa: E501
+_POOL_SHARE = max(DB_MAX_CONNECTIONS // (2 * WEB_CONCURRENCY), 2)
+DB_POOL_SIZE = int(os.environ.get("DB_POOL_SIZE", _POOL_SHARE // 2))
+DB_MAX_OVERFLOW = int(
+    os.environ.get("DB_MAX_OVERFLOW", _POOL_SHARE - DB_POOL_SIZE)
+)
+# seconds to wait for a free connection before failing the request
+DB_POOL_TIMEOUT = float(os.environ.get("DB_POOL_TIMEOUT", 10))
+# seconds after which a connection is replaced (-1 disables recycling)
+DB_POOL_RECYCLE = int(os.environ.get("DB_POOL_RECYCLE", 1800))
+# test connections on checkout, to survive database restarts
+DB_POOL_PRE_PING = os.environ.get("DB_POOL_PRE_PING", "true").lower() in (
+    "1",
+    "true",
+    "yes",
+)
+# seconds to wait for postgres when opening a new connection
+DB_CONNECT_TIMEOUT = int(os.environ.get("DB_CONNECT_TIMEOUT", 10))
+# minimum seconds between reloads of the adduct registry for unknown adduct names  # noqa: E501
+ADDUCT_RELOAD_INTERVAL = float(os.environ.get("ADDUCT_RELOAD_INTERVAL", 1))
+# number of GET responses kept in the response cache (0 disables caching, ETags stay)  # noqa: E501
+RESPONSE_CACHE_SIZE = int(os.environ.get("RESPONSE_CACHE_SIZE", 1024))
+# seconds a cached response is served, bounds staleness across gunicorn workers  # noqa: E501
+RESPONSE_CACHE_TTL = float(os.environ.get("RESPONSE_CACHE_TTL", 30))
+# responses with a larger body (bytes) are streamed through and never cached
+RESPONSE_CACHE_MAX_BODY = int(
+    os.environ.get("RESPONSE_CACHE_MAX_BODY", 1024 * 1024)
+)
+# bytes of cached bodies kept in total, least recently used entries are evicted first  # noqa: E501
+RESPONSE_CACHE_MAX_BYTES = int(
+    os.environ.get("RESPONSE_CACHE_MAX_BYTES", 64 * 1024 * 1024)
+)
+# directory shared by the gunicorn workers to aggregate the Prometheus metrics (unset: one process)  # noqa: E501
+PROMETHEUS_MULTIPROC_DIR = os.environ.get("PROMETHEUS_MULTIPROC_DIR")
+# token for the admin-only endpoints and headers, per-request profiling is disabled if unset  # noqa: E501
+ADMIN_TOKEN = os.environ.get("ADMIN_TOKEN")
+# directory shared by the gunicorn workers to store request profiles
+PROFILE_DIR = os.environ.get(
+    "PROFILE_DIR", os.path.join(tempfile.gettempdir(), "mass_spec_profiles")
+)
+# number of most recent profiles kept in PROFILE_DIR
+PROFILE_KEEP = int(os.environ.get("PROFILE_KEEP", 50))
+
 
 STR_COMPOUNDS = "compounds"
 STR_MEASURED_COMPOUNDS = "measured_compounds"
 STR_RETENTION_TIME = "retention_time"
 STR_ADDUCTS = "adducts"
 STR_TOOLS = "tools"
+STR_ADMIN = "admin"
+STR_JOBS = "jobs"
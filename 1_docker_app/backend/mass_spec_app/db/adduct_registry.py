@@ -0,0 +1,98 @@
+# 2024-09 Kai-Michael Kammer
+"""
+In-memory registry of all adducts with their parsed elemental and mass change (see chem_utils.parse_adduct).
+Measured compounds look up their adduct here instead of querying the adducts table for every row,
+and compute the measured formula and mass by arithmetic on the compound's formula and mass.
+The registry is loaded in the app lifespan, extended by create_adduct and reloaded from the database
+when an unknown adduct name is requested (e.g. created by another gunicorn worker).
+Unknown names come from clients, so these reloads happen at most every ADDUCT_RELOAD_INTERVAL seconds.
+"""  # noqa: E501
+import threading
+import time
+from typing import Dict, NamedTuple, Optional, Tuple
+
+from sqlalchemy import select
+from sqlalchemy.orm import Session
+
+from mass_spec_app import config
+from mass_spec_app.db import models
+from mass_spec_app.scripts import chem_utils as cu
+
+
+class RegisteredAdduct(NamedTuple):
+    adduct_id: int
+    adduct_name: str
+    ion_mode: str
+    delta: Optional[cu.AdductDelta]  # None if the name can not be parsed
+    error: Optional[str] = None
+
+    def measured_formula_and_mass(
+        self, molecular_formula: str, compound_mass: float
+    ) -> Tuple[str, float]:
+        """Return the measured formula and mass of a compound with this adduct."""  # noqa: E501
+        if self.delta is None:
+            raise ValueError(self.error)
+        return cu.measured_formula_and_mass(
+            molecular_formula, compound_mass, self.delta
+        )
+
+
+def _register(adduct: models.Adduct) -> RegisteredAdduct:
+    try:
+        delta, error = cu.parse_adduct(adduct.adduct_name), None
+    except ValueError as e:
+        delta, error = None, str(e)
+    return RegisteredAdduct(
+        adduct_id=adduct.adduct_id,
+        adduct_name=adduct.adduct_name,
+        ion_mode=adduct.ion_mode,
+        delta=delta,
+        error=error,
+    )
+
+
+class AdductRegistry:
+    """Thread-safe mapping of adduct_name -> RegisteredAdduct."""
+
+    def __init__(self) -> None:
+        self._lock = threading.Lock()
+        self._adducts: Dict[str, RegisteredAdduct] = {}
+        # monotonic time of the last load
+        self._loaded_at = float("-inf")
+
+    def __len__(self) -> int:
+        return len(self._adducts)
+
+    def load(self, db: Session) -> None:
+        """(Re)load all adducts from the database."""
+        self._loaded_at = time.monotonic()
+        adducts = {
+            adduct.adduct_name: _register(adduct)
+            for adduct in db.scalars(select(models.Adduct))
+        }
+        with self._lock:
+            self._adducts = adducts
+
+    def add(self, adduct: models.Adduct) -> RegisteredAdduct:
+        """Register a newly created adduct."""
+        registered = _register(adduct)
+        with self._lock:
+            self._adducts = {**self._adducts, adduct.adduct_name: registered}
+        return registered
+
+    def get(self, db: Session, adduct_name: str) -> Optional[RegisteredAdduct]:
+        """
+        Return the adduct with this name, reloading once if it is unknown
+        and the last load is more than ADDUCT_RELOAD_INTERVAL seconds ago.
+        """
+        if (
+            adduct_name not in self._adducts
+            and time.monotonic() - self._loaded_at
+            >= config.ADDUCT_RELOAD_INTERVAL
+        ):
+            self.load(db)
+        return self._adducts.get(adduct_name)
+
+
+# one registry per process, loaded in the app lifespan
+adduct_registry = AdductRegistry()
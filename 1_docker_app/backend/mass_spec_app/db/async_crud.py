@@ -0,0 +1,223 @@
+# 2024-09 Kai-Michael Kammer
+"""
+Async versions of the CRUD operations in crud.py for the async API routes.
+Each function runs the sync CRUD logic through AsyncSession.run_sync, which executes it on the
+async driver without blocking the event loop, so the queries and business rules are defined once.
+CPU bound steps between the queries (formula, mass and isotope envelope computations, mass index updates)
+run in the threadpool instead, as run_sync executes on the event loop thread.
+Returned objects have all attributes needed for the response schemas loaded,
+as lazy loading is not possible once we are back in async code.
+"""  # noqa: E501
+from typing import AsyncIterator, Dict, List, Optional, Sequence
+
+from sqlalchemy import RowMapping, Select
+from sqlalchemy.ext.asyncio import AsyncConnection, AsyncSession
+from sqlalchemy.orm import Session
+from starlette.concurrency import run_in_threadpool
+
+from mass_spec_app.api import schemas
+from mass_spec_app.db import crud, models
+from mass_spec_app.db.mass_index import mass_index
+from mass_spec_app.profiling import profiled
+
+
+# Adduct CRUD
+async def get_adducts(
+    db: AsyncSession,
+    skip: int = 0,
+    limit: int = 100,
+    after: Optional[int] = None,
+) -> List[models.Adduct]:
+    """Retrieve a list of adducts with pagination."""
+    return await db.run_sync(
+        crud.get_adducts, skip=skip, limit=limit, after=after
+    )
+
+
+async def create_adduct(
+    db: AsyncSession, adduct: schemas.AdductCreate
+) -> models.Adduct:
+    return await db.run_sync(crud.create_adduct, adduct=adduct)
+
+
+async def get_adduct_by_id(
+    db: AsyncSession, adduct_id: int
+) -> Optional[models.Adduct]:
+    """Retrieve an adduct by its ID."""
+    return await db.run_sync(crud.get_adduct_by_id, adduct_id=adduct_id)
+
+
+# Compound CRUD
+async def create_compound(
+    db: AsyncSession, compound: schemas.CompoundCreate
+) -> models.Compound:
+    return await db.run_sync(crud.create_compound, compound=compound)
+
+
+async def get_compounds(
+    db: AsyncSession,
+    skip: int = 0,
+    limit: int = 100,
+    after: Optional[int] = None,
+) -> List[models.Compound]:
+    """Retrieve a list of compounds with pagination."""
+    return await db.run_sync(
+        crud.get_compounds, skip=skip, limit=limit, after=after
+    )
+
+
+async def get_compound_by_id(
+    db: AsyncSession, compound_id: int
+) -> Optional[models.Compound]:
+    """Retrieve a compound by its ID."""
+    return await db.run_sync(crud.get_compound_by_id, compound_id=compound_id)
+
+
+# Retention Time CRUD
+async def get_retention_times(
+    db: AsyncSession,
+    skip: int = 0,
+    limit: int = 100,
+    after: Optional[int] = None,
+) -> List[models.RetentionTime]:
+    """Retrieve a list of retention times with pagination."""
+    return await db.run_sync(
+        crud.get_retention_times, skip=skip, limit=limit, after=after
+    )
+
+
+async def get_retention_time_by_id(
+    db: AsyncSession, retention_time_id: int
+) -> Optional[models.RetentionTime]:
+    """Retrieve a retention time by its ID."""
+    return await db.run_sync(
+        crud.get_retention_time_by_id, retention_time_id=retention_time_id
+    )
+
+
+# Measured Compound CRUD
+async def get_measured_compounds(
+    db: AsyncSession,
+    skip: int = 0,
+    limit: int = 100,
+    after: Optional[int] = None,
+) -> List[models.MeasuredCompound]:
+    """Retrieve a list of measured compounds with pagination."""
+    return await db.run_sync(
+        crud.get_measured_compounds, skip=skip, limit=limit, after=after
+    )
+
+
+async def get_measured_compounds_filtered(
+    db: AsyncSession,
+    skip: int = 0,
+    limit: int = 100,
+    retention_time: float = None,
+    compound_type: str = None,
+    ion_mode: str = None,
+    after: Optional[int] = None,
+    rt_tol: float = 0.0,
+    rt_min: Optional[float] = None,
+    rt_max: Optional[float] = None,
+) -> List[models.MeasuredCompound]:
+    return await db.run_sync(
+        crud.get_measured_compounds_filtered,
+        skip=skip,
+        limit=limit,
+        retention_time=retention_time,
+        compound_type=compound_type,
+        ion_mode=ion_mode,
+        after=after,
+        rt_tol=rt_tol,
+        rt_min=rt_min,
+        rt_max=rt_max,
+    )
+
+
+async def get_measured_compound_by_id(
+    db: AsyncSession, measured_compound_id: int
+) -> Optional[models.MeasuredCompound]:
+    """Retrieve a measured compound by its ID."""
+    return await db.run_sync(
+        crud.get_measured_compound_by_id,
+        measured_compound_id=measured_compound_id,
+    )
+
+
+async def get_measured_compounds_by_ids(
+    db: AsyncSession, measured_compound_ids: List[int]
+) -> List[models.MeasuredCompound]:
+    """Retrieve measured compounds by their IDs, keeping the order of the IDs."""  # noqa: E501
+    return await db.run_sync(
+        crud.get_measured_compounds_by_ids,
+        measured_compound_ids=measured_compound_ids,
+    )
+
+
+async def get_measured_isotope_envelopes(
+    db: AsyncSession, measured_compound_ids: List[int]
+) -> Dict[int, Optional[bytes]]:
+    """Return the packed isotope envelopes by measured_compound_id."""
+    return await db.run_sync(
+        crud.get_measured_isotope_envelopes,
+        measured_compound_ids=measured_compound_ids,
+    )
+
+
+async def create_measured_compound_and_retention_time(
+    db: AsyncSession, measured_compound: schemas.MeasuredCompoundCreate
+) -> models.MeasuredCompound:
+    adduct, compound = await db.run_sync(
+        crud.get_measured_compound_inputs, measured_compound=measured_compound
+    )
+    molecular_formula, measured_mass, isotope_envelope = (
+        await run_in_threadpool(
+            profiled(crud.compute_measured_compound),
+            adduct,
+            compound.molecular_formula,
+            compound.computed_mass,
+        )
+    )
+
+    def _insert(session: Session) -> models.MeasuredCompound:
+        db_measured_compound = crud.insert_measured_compound(
+            session,
+            measured_compound,
+            adduct,
+            molecular_formula,
+            measured_mass,
+            isotope_envelope,
+        )
+        # load the relationships needed for the response in the same step
+        session.refresh(
+            db_measured_compound,
+            attribute_names=["compound", "adduct", "retention_time"],
+        )
+        return db_measured_compound
+
+    db_measured_compound = await db.run_sync(_insert)
+    # keep the in-memory mass index in sync with the new row
+    await run_in_threadpool(
+        profiled(mass_index.add),
+        db_measured_compound.measured_compound_id,
+        measured_mass,
+        compound_id=measured_compound.compound_id,
+        retention_time=measured_compound.retention_time,
+        ion_mode=adduct.ion_mode,
+    )
+    return db_measured_compound
+
+
+# Streaming
+async def stream_rows(
+    connection: AsyncConnection, statement: Select, batch_size: int = 1000
+) -> AsyncIterator[Sequence[RowMapping]]:
+    """
+    Execute a statement through a server-side cursor and yield the rows in batches.
+    Memory stays flat no matter how many rows the statement returns.
+    """  # noqa: E501
+    result = await connection.stream(
+        statement.execution_options(yield_per=batch_size)
+    )
+    async for batch in result.mappings().partitions():
+        yield batch
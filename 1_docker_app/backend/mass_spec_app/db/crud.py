@@ -4,24 +4,66 @@ Contains the core database interaction logic, providing CRUD (Create, Read, Upda
 operations for compounds, measured-compounds, adducts and retention times.
 Implements business logic for ensuring data integrity and querying with filtering.
 """  # noqa: E501
-from typing import List, Optional
+from datetime import datetime, timezone
+from itertools import islice
+from typing import (
+    Any,
+    Dict,
+    Iterable,
+    Iterator,
+    List,
+    Optional,
+    Sequence,
+    Tuple,
+    TypeVar,
+)
 
-from sqlalchemy.orm import Session
+from sqlalchemy import Connection, RowMapping, Select, insert, select, tuple_
+from sqlalchemy.dialects import postgresql, sqlite
+from sqlalchemy.orm import Query, Session, joinedload
 
 from mass_spec_app.api import schemas
 from mass_spec_app.db import models
+from mass_spec_app.db.adduct_registry import RegisteredAdduct, adduct_registry
+from mass_spec_app.db.mass_index import mass_index
 from mass_spec_app.scripts.chem_utils import (
-    get_measured_formula,
+    get_isotope_envelope,
     get_monoisotopic_mass,
 )
 
+T = TypeVar("T")
+# values bound per statement by the bulk lookups and upserts, far below the
+# bind parameter limits (65535 on PostgreSQL, 32766 on SQLite)
+BULK_PARAMETER_CHUNK_SIZE = 10000
+
+
+def _chunked(values: Iterable[T]) -> Iterator[List[T]]:
+    values = iter(values)
+    while chunk := list(islice(values, BULK_PARAMETER_CHUNK_SIZE)):
+        yield chunk
+
+
+# Pagination shared by the list queries
+def _paginate(
+    query: Query, id_column: Any, skip: int, limit: int, after: Optional[int]
+) -> Query:
+    """
+    Order a query by its primary key and apply keyset (after) and offset (skip) pagination.
+    Keyset pagination continues after the given id and costs the same on every page.
+    """  # noqa: E501
+    if after is not None:
+        query = query.filter(id_column > after)
+    return query.order_by(id_column).offset(skip).limit(limit)
+
 
 # Adduct CRUD
 def get_adducts(
-    db: Session, skip: int = 0, limit: int = 100
+    db: Session, skip: int = 0, limit: int = 100, after: Optional[int] = None
 ) -> List[models.Adduct]:
     """Retrieve a list of adducts with pagination."""
-    return db.query(models.Adduct).offset(skip).limit(limit).all()
+    return _paginate(
+        db.query(models.Adduct), models.Adduct.adduct_id, skip, limit, after
+    ).all()
 
 
 def create_adduct(db: Session, adduct: schemas.AdductCreate) -> models.Adduct:
@@ -32,6 +74,7 @@ def create_adduct(db: Session, adduct: schemas.AdductCreate) -> models.Adduct:
     )
     db.add(db_adduct)
     db.commit()
+    adduct_registry.add(db_adduct)
     return db_adduct
 
 
@@ -50,6 +93,9 @@ def create_compound(
         molecular_formula=compound.molecular_formula,
         type=compound.type,
         computed_mass=monoisotopic_mass,  # Use the computed monoisotopic mass
+        isotope_envelope=get_isotope_envelope(
+            compound.molecular_formula
+        ).pack(),
     )
     db.add(db_compound)
     db.commit()
@@ -57,60 +103,107 @@ def create_compound(
 
 
 def get_compounds(
-    db: Session, skip: int = 0, limit: int = 100
+    db: Session, skip: int = 0, limit: int = 100, after: Optional[int] = None
 ) -> List[models.Compound]:
     """Retrieve a list of compounds with pagination."""
-    return db.query(models.Compound).offset(skip).limit(limit).all()
+    return _paginate(
+        db.query(models.Compound),
+        models.Compound.compound_id,
+        skip,
+        limit,
+        after,
+    ).all()
 
 
 # Retention Time CRUD (with get_or_create)
 # CRUD for Retention Times
 def get_retention_times(
-    db: Session, skip: int = 0, limit: int = 100
+    db: Session, skip: int = 0, limit: int = 100, after: Optional[int] = None
 ) -> List[models.RetentionTime]:
     """Retrieve a list of retention times with pagination."""
-    return db.query(models.RetentionTime).offset(skip).limit(limit).all()
+    return _paginate(
+        db.query(models.RetentionTime),
+        models.RetentionTime.retention_time_id,
+        skip,
+        limit,
+        after,
+    ).all()
+
+
+def _upsert_retention_times(db: Session) -> Any:
+    """
+    INSERT into retention_times that returns the existing row if the retention time exists.
+    ON CONFLICT is dialect specific (PostgreSQL and SQLite). The conflict does a no-op update,
+    as DO NOTHING would not return the existing row; the existing comment is kept.
+    """  # noqa: E501
+    dialect = db.get_bind().dialect.name
+    if dialect == "postgresql":
+        statement = postgresql.insert(models.RetentionTime)
+    elif dialect == "sqlite":
+        statement = sqlite.insert(models.RetentionTime)
+    else:
+        raise NotImplementedError(f"Upsert is not supported for {dialect}")
+    return statement.on_conflict_do_update(
+        index_elements=[models.RetentionTime.retention_time],
+        set_={"retention_time": statement.excluded.retention_time},
+    )
 
 
 def get_or_create_retention_time(
     db: Session, retention_time: schemas.RetentionTimeCreate
 ) -> models.RetentionTime:
-    existing_retention_time = (
-        db.query(models.RetentionTime)
-        .filter_by(retention_time=retention_time.retention_time)
-        .first()
-    )
+    """
+    Return the retention time with this value, creating it if needed, in one statement.
+    Safe under concurrent writers thanks to the unique index on the value.
+    The row is locked until the caller commits.
+    """  # noqa: E501
+    return db.scalars(
+        _upsert_retention_times(db)
+        .values(
+            retention_time=retention_time.retention_time,
+            comment=retention_time.comment,
+        )
+        .returning(models.RetentionTime),
+        execution_options={"populate_existing": True},
+    ).one()
 
-    if existing_retention_time:
-        return existing_retention_time
 
-    new_retention_time = models.RetentionTime(
-        retention_time=retention_time.retention_time,
-        comment=retention_time.comment,
+# Measured Compound CRUD
+def _query_measured_compounds(db: Session) -> Query:
+    """
+    Query measured compounds together with their compound, adduct and retention time.
+    The relationships are joined into the same SELECT, so serializing the nested
+    response schema does not trigger one lazy load per row and relationship.
+    """  # noqa: E501
+    return db.query(models.MeasuredCompound).options(
+        joinedload(models.MeasuredCompound.compound),
+        joinedload(models.MeasuredCompound.adduct),
+        joinedload(models.MeasuredCompound.retention_time),
     )
-    db.add(new_retention_time)
-    db.commit()
-    return new_retention_time
 
 
-# Measured Compound CRUD
 def get_measured_compounds(
-    db: Session, skip: int = 0, limit: int = 100
+    db: Session, skip: int = 0, limit: int = 100, after: Optional[int] = None
 ) -> List[models.MeasuredCompound]:
     """Retrieve a list of measured compounds with pagination."""
-    return db.query(models.MeasuredCompound).offset(skip).limit(limit).all()
+    return _paginate(
+        _query_measured_compounds(db),
+        models.MeasuredCompound.measured_compound_id,
+        skip,
+        limit,
+        after,
+    ).all()
 
 
 # Create Measured Compound (with adduct mapping from the database)
-def create_measured_compound_and_retention_time(
+# split into the database steps and the CPU bound computations in between,
+# so async_crud can run the computations in the threadpool
+def get_measured_compound_inputs(
     db: Session, measured_compound: schemas.MeasuredCompoundCreate
-) -> models.MeasuredCompound:
-    # Query the adduct_id from the adducts table using the adduct_name
-    adduct = (
-        db.query(models.Adduct)
-        .filter(models.Adduct.adduct_name == measured_compound.adduct_name)
-        .first()
-    )
+) -> Tuple[RegisteredAdduct, models.Compound]:
+    """Look up the adduct and compound of a new measured compound."""
+    # Look up the adduct (id, ion mode and parsed delta) in the registry
+    adduct = adduct_registry.get(db, measured_compound.adduct_name)
 
     if not adduct:
         raise ValueError(
@@ -130,7 +223,34 @@ def create_measured_compound_and_retention_time(
             f"Compound '{measured_compound.compound_id}'"
             f" not found in the database."
         )
-        # retentiont ime
+    return adduct, compound
+
+
+def compute_measured_compound(
+    adduct: RegisteredAdduct, molecular_formula: str, computed_mass: float
+) -> Tuple[str, float, bytes]:
+    """Return the measured formula, mass and packed isotope envelope of a compound with this adduct."""  # noqa: E501
+    # get the adjusted molecular formula and mass from the compound's formula and mass  # noqa: E501
+    measured_formula, measured_mass = adduct.measured_formula_and_mass(
+        molecular_formula, computed_mass
+    )
+    return (
+        measured_formula,
+        measured_mass,
+        get_isotope_envelope(measured_formula).pack(),
+    )
+
+
+def insert_measured_compound(
+    db: Session,
+    measured_compound: schemas.MeasuredCompoundCreate,
+    adduct: RegisteredAdduct,
+    molecular_formula: str,
+    measured_mass: float,
+    isotope_envelope: bytes,
+) -> models.MeasuredCompound:
+    """Insert a measured compound with its retention time and search row and commit."""  # noqa: E501
+    # retention time
     retention_time_create = schemas.RetentionTimeCreate(
         retention_time=measured_compound.retention_time,
         comment=measured_compound.retention_time_comment,
@@ -139,13 +259,6 @@ def create_measured_compound_and_retention_time(
         db, retention_time=retention_time_create
     )
 
-    # get the adjusted molecula formula
-    molecular_formula = get_measured_formula(
-        compound.molecular_formula, adduct_name=adduct.adduct_name
-    )
-    # Calculate measured mass using the compound's mass and adduct's mass adjustment  # noqa: E501
-    measured_mass = get_monoisotopic_mass(molecular_formula=molecular_formula)
-
     # Create the MeasuredCompound entry
     db_measured_compound = models.MeasuredCompound(
         compound_id=measured_compound.compound_id,
@@ -153,12 +266,269 @@ def create_measured_compound_and_retention_time(
         retention_time_id=retention_time_entry.retention_time_id,
         measured_mass=measured_mass,
         molecular_formula=molecular_formula,
+        isotope_envelope=isotope_envelope,
     )
     db.add(db_measured_compound)
+    db.flush()
+    insert_search_rows(db, [db_measured_compound.measured_compound_id])
     db.commit()
     return db_measured_compound
 
 
+def create_measured_compound_and_retention_time(
+    db: Session, measured_compound: schemas.MeasuredCompoundCreate
+) -> models.MeasuredCompound:
+    adduct, compound = get_measured_compound_inputs(db, measured_compound)
+    molecular_formula, measured_mass, isotope_envelope = (
+        compute_measured_compound(
+            adduct, compound.molecular_formula, compound.computed_mass
+        )
+    )
+    db_measured_compound = insert_measured_compound(
+        db,
+        measured_compound,
+        adduct,
+        molecular_formula,
+        measured_mass,
+        isotope_envelope,
+    )
+    # keep the in-memory mass index in sync with the new row
+    mass_index.add(
+        db_measured_compound.measured_compound_id,
+        measured_mass,
+        compound_id=measured_compound.compound_id,
+        retention_time=measured_compound.retention_time,
+        ion_mode=adduct.ion_mode,
+    )
+    return db_measured_compound
+
+
+# Bulk create Measured Compounds in a single transaction
+def create_measured_compounds_bulk(
+    db: Session,
+    measured_compounds: List[schemas.MeasuredCompoundCreate],
+    measured_formulas: Optional[List[Optional[Tuple[str, float]]]] = None,
+) -> List[schemas.MeasuredCompoundBulkResult]:
+    """
+    Create many measured compounds at once and report the outcome per row.
+    Adducts come from the adduct registry, compounds and existing retention times are preloaded
+    with one query each, missing retention times and all measured compounds are inserted with
+    one executemany each and everything is committed in a single transaction. Lookups and upserts
+    bind at most BULK_PARAMETER_CHUNK_SIZE rows per statement, so batches of any size fit.
+    A row inserted by a concurrent writer since the duplicate check raises an IntegrityError.
+    measured_formulas optionally holds the already computed (formula, mass) per row,
+    rows with None are computed here. The isotope envelopes come from the measured formulas.
+    """  # noqa: E501
+    results = [
+        schemas.MeasuredCompoundBulkResult(index=i, success=False)
+        for i in range(len(measured_compounds))
+    ]
+
+    # look up the referenced adducts and preload the compounds
+    adducts: Dict[str, RegisteredAdduct] = {}
+    for adduct_name in {m.adduct_name for m in measured_compounds}:
+        adduct = adduct_registry.get(db, adduct_name)
+        if adduct:
+            adducts[adduct_name] = adduct
+    compound_ids = {m.compound_id for m in measured_compounds}
+    compounds: Dict[int, models.Compound] = {
+        c.compound_id: c
+        for chunk in _chunked(compound_ids)
+        for c in db.query(models.Compound).filter(
+            models.Compound.compound_id.in_(chunk)
+        )
+    }
+
+    # validate the rows and compute the measured formula, mass and envelope
+    valid: List[
+        Tuple[int, schemas.MeasuredCompoundCreate, str, float, bytes]
+    ] = []
+    for i, measured_compound in enumerate(measured_compounds):
+        adduct = adducts.get(measured_compound.adduct_name)
+        compound = compounds.get(measured_compound.compound_id)
+        if not adduct:
+            results[i].error = (
+                f"Adduct '{measured_compound.adduct_name}'"
+                f" not found in the database."
+            )
+        elif not compound:
+            results[i].error = (
+                f"Compound '{measured_compound.compound_id}'"
+                f" not found in the database."
+            )
+        elif not measured_compound.retention_time > 0:
+            results[i].error = "retention_time must be positive"
+        elif measured_formulas is not None and measured_formulas[i]:
+            molecular_formula, measured_mass = measured_formulas[i]
+        else:
+            try:
+                molecular_formula, measured_mass = (
+                    adduct.measured_formula_and_mass(
+                        compound.molecular_formula, compound.computed_mass
+                    )
+                )
+            except ValueError as e:
+                results[i].error = str(e)
+                continue
+        if results[i].error is None:
+            try:
+                isotope_envelope = get_isotope_envelope(
+                    molecular_formula
+                ).pack()
+            except ValueError as e:
+                results[i].error = str(e)
+                continue
+            valid.append(
+                (
+                    i,
+                    measured_compound,
+                    molecular_formula,
+                    measured_mass,
+                    isotope_envelope,
+                )
+            )
+
+    if not valid:
+        return results
+    valid_by_index = {i: m for i, m, _, _, _ in valid}
+
+    # resolve retention times, inserting the missing ones in one statement
+    retention_comments: Dict[float, Optional[str]] = {}
+    for _, measured_compound, _, _, _ in valid:
+        retention_comments.setdefault(
+            measured_compound.retention_time,
+            measured_compound.retention_time_comment,
+        )
+    retention_time_ids: Dict[float, int] = {
+        rt: rt_id
+        for chunk in _chunked(retention_comments)
+        for rt_id, rt in db.execute(
+            select(
+                models.RetentionTime.retention_time_id,
+                models.RetentionTime.retention_time,
+            ).where(models.RetentionTime.retention_time.in_(chunk))
+        )
+    }
+    missing_retention_times = [
+        {"retention_time": rt, "comment": comment}
+        for rt, comment in retention_comments.items()
+        if rt not in retention_time_ids
+    ]
+    # upsert, in case another writer inserted them since the SELECT
+    for chunk in _chunked(missing_retention_times):
+        retention_time_ids.update(
+            (rt, rt_id)
+            for rt_id, rt in db.execute(
+                _upsert_retention_times(db)
+                .values(chunk)
+                .returning(
+                    models.RetentionTime.retention_time_id,
+                    models.RetentionTime.retention_time,
+                )
+            )
+        )
+
+    # skip rows violating uq_compound_retention_adduct, in the DB or the batch
+    candidate_keys = {
+        (m.compound_id, retention_time_ids[m.retention_time])
+        for _, m, _, _, _ in valid
+    }
+    existing_keys = set()
+    for chunk in _chunked(candidate_keys):
+        existing_keys.update(
+            db.execute(
+                select(
+                    models.MeasuredCompound.compound_id,
+                    models.MeasuredCompound.retention_time_id,
+                    models.MeasuredCompound.adduct_id,
+                ).where(
+                    tuple_(
+                        models.MeasuredCompound.compound_id,
+                        models.MeasuredCompound.retention_time_id,
+                    ).in_(chunk)
+                )
+            ).tuples()
+        )
+    rows = []
+    row_indices = []
+    for (
+        i,
+        measured_compound,
+        molecular_formula,
+        measured_mass,
+        isotope_envelope,
+    ) in valid:
+        key = (
+            measured_compound.compound_id,
+            retention_time_ids[measured_compound.retention_time],
+            adducts[measured_compound.adduct_name].adduct_id,
+        )
+        if key in existing_keys:
+            results[i].error = (
+                "Measured compound with this compound, retention time"
+                " and adduct already exists."
+            )
+            continue
+        existing_keys.add(key)
+        rows.append(
+            {
+                "compound_id": key[0],
+                "retention_time_id": key[1],
+                "adduct_id": key[2],
+                "measured_mass": measured_mass,
+                "molecular_formula": molecular_formula,
+                "isotope_envelope": isotope_envelope,
+            }
+        )
+        row_indices.append(i)
+
+    if rows:
+        measured_compound_ids = db.scalars(
+            insert(models.MeasuredCompound).returning(
+                models.MeasuredCompound.measured_compound_id,
+                sort_by_parameter_order=True,
+            ),
+            rows,
+        ).all()
+        insert_search_rows(db, measured_compound_ids)
+    else:
+        measured_compound_ids = []
+    db.commit()
+
+    for i, measured_compound_id in zip(row_indices, measured_compound_ids):
+        results[i].success = True
+        results[i].measured_compound_id = measured_compound_id
+    indexed = [valid_by_index[i] for i in row_indices]
+    mass_index.add_many(
+        ids=measured_compound_ids,
+        masses=[r["measured_mass"] for r in rows],
+        compound_ids=[r["compound_id"] for r in rows],
+        retention_times=[m.retention_time for m in indexed],
+        ion_modes=[adducts[m.adduct_name].ion_mode for m in indexed],
+    )
+    return results
+
+
+# table to verify that initial migration was done
+# kept here instead of populate_data, so the app checks it without importing pandas  # noqa: E501
+def check_initialization_status(db: Session) -> bool:
+    """Check if the database has been initialized."""
+    status = db.query(models.InitializationStatus).first()
+    return status is not None and status.is_initialized
+
+
+def set_initialization_status(db: Session) -> None:
+    """Set the database as initialized with a timezone-aware timestamp."""
+    status = models.InitializationStatus(
+        is_initialized=True,
+        initialized_at=datetime.now(
+            tz=timezone.utc
+        ),  # Use timezone-aware datetime
+    )
+    db.add(status)
+    db.commit()
+
+
 # Single GETs
 # CRUD to Get a Single Adduct by ID
 def get_adduct_by_id(db: Session, adduct_id: int) -> Optional[models.Adduct]:
@@ -188,7 +558,7 @@ def get_measured_compound_by_id(
 ) -> Optional[models.MeasuredCompound]:
     """Retrieve a measured compound by its ID."""
     return (
-        db.query(models.MeasuredCompound)
+        _query_measured_compounds(db)
         .filter(
             models.MeasuredCompound.measured_compound_id
             == measured_compound_id
@@ -197,6 +567,46 @@ def get_measured_compound_by_id(
     )
 
 
+# CRUD to Get several Measured Compounds by ID
+def get_measured_compounds_by_ids(
+    db: Session, measured_compound_ids: List[int]
+) -> List[models.MeasuredCompound]:
+    """Retrieve measured compounds by their IDs, keeping the order of the IDs."""  # noqa: E501
+    if not measured_compound_ids:
+        return []
+    rows = (
+        _query_measured_compounds(db)
+        .filter(
+            models.MeasuredCompound.measured_compound_id.in_(
+                measured_compound_ids
+            )
+        )
+        .all()
+    )
+    by_id = {row.measured_compound_id: row for row in rows}
+    return [by_id[i] for i in measured_compound_ids if i in by_id]
+
+
+def get_measured_isotope_envelopes(
+    db: Session, measured_compound_ids: List[int]
+) -> Dict[int, Optional[bytes]]:
+    """Return the packed isotope envelopes by measured_compound_id."""
+    if not measured_compound_ids:
+        return {}
+    return dict(
+        db.execute(
+            select(
+                models.MeasuredCompound.measured_compound_id,
+                models.MeasuredCompound.isotope_envelope,
+            ).where(
+                models.MeasuredCompound.measured_compound_id.in_(
+                    measured_compound_ids
+                )
+            )
+        ).all()
+    )
+
+
 # CRUD to Get a Single Retention Time by ID
 def get_retention_time_by_id(
     db: Session, retention_time_id: int
@@ -209,6 +619,169 @@ def get_retention_time_by_id(
     )
 
 
+# Filters shared by the filtered query and the export
+def _retention_time_bounds(
+    retention_time: Optional[float],
+    rt_tol: float,
+    rt_min: Optional[float],
+    rt_max: Optional[float],
+) -> Tuple[Optional[float], Optional[float]]:
+    """
+    Combine retention_time +/- rt_tol and rt_min/rt_max into one (lower, upper) window.
+    Either bound may be None (open). Without a tolerance retention_time matches exactly.
+    """  # noqa: E501
+    for name, value in (
+        ("retention_time", retention_time),
+        ("rt_tol", rt_tol),
+        ("rt_min", rt_min),
+        ("rt_max", rt_max),
+    ):
+        if value is not None and value < 0:
+            raise ValueError(f"{name} must be positive")
+    lower, upper = rt_min, rt_max
+    if retention_time is not None:
+        lower = max(retention_time - rt_tol, lower or 0.0)
+        upper = (
+            retention_time + rt_tol
+            if upper is None
+            else min(retention_time + rt_tol, upper)
+        )
+    if rt_min is not None and rt_max is not None and rt_min > rt_max:
+        raise ValueError("rt_min must not be larger than rt_max")
+    return lower, upper
+
+
+# (retention time, compound type, ion mode) columns the filters apply to
+_JOINED_FILTER_COLUMNS = (
+    models.RetentionTime.retention_time,
+    models.Compound.type,
+    models.Adduct.ion_mode,
+)
+_SEARCH_FILTER_COLUMNS = (
+    models.MeasuredCompoundSearch.retention_time,
+    models.MeasuredCompoundSearch.compound_type,
+    models.MeasuredCompoundSearch.ion_mode,
+)
+
+
+def _filter_measured_compounds(
+    query: Any,
+    retention_time: float = None,
+    compound_type: str = None,
+    ion_mode: str = None,
+    rt_tol: float = 0.0,
+    rt_min: Optional[float] = None,
+    rt_max: Optional[float] = None,
+    columns: Tuple[Any, Any, Any] = _JOINED_FILTER_COLUMNS,
+) -> Any:
+    """
+    Apply the optional filters to a query/select joined with all related tables,
+    or to one on the search table with columns=_SEARCH_FILTER_COLUMNS.
+    The retention time filter is a range condition, so it is served by a range scan on
+    an index of the retention time instead of comparing floats for equality.
+    """  # noqa: E501
+    rt_column, type_column, ion_mode_column = columns
+    lower, upper = _retention_time_bounds(
+        retention_time, rt_tol, rt_min, rt_max
+    )
+    if lower is not None:
+        query = query.where(rt_column >= lower)
+    if upper is not None:
+        query = query.where(rt_column <= upper)
+
+    if compound_type is not None:
+        query = query.where(type_column == compound_type)
+
+    if ion_mode is not None:
+        query = query.where(ion_mode_column == ion_mode)
+    return query
+
+
+def insert_search_rows(
+    db: Session, measured_compound_ids: Optional[List[int]] = None
+) -> None:
+    """
+    Copy measured compounds (all if no ids are given) into the search table with one INSERT ... SELECT.
+    Called before the commit of every create, so the table is never behind measured_compounds.
+    """  # noqa: E501
+    statement = (
+        select(
+            models.MeasuredCompound.measured_compound_id,
+            models.MeasuredCompound.compound_id,
+            models.MeasuredCompound.adduct_id,
+            models.MeasuredCompound.retention_time_id,
+            models.MeasuredCompound.measured_mass,
+            models.RetentionTime.retention_time,
+            models.Compound.type,
+            models.Adduct.ion_mode,
+            models.Compound.compound_name,
+        )
+        .join(models.Compound)
+        .join(models.RetentionTime)
+        .join(models.Adduct)
+    )
+    # the ids are bound in chunks, see BULK_PARAMETER_CHUNK_SIZE
+    chunks: Iterable[Optional[List[int]]] = (
+        [None]
+        if measured_compound_ids is None
+        else _chunked(measured_compound_ids)
+    )
+    for chunk in chunks:
+        db.execute(
+            insert(models.MeasuredCompoundSearch).from_select(
+                [
+                    "measured_compound_id",
+                    "compound_id",
+                    "adduct_id",
+                    "retention_time_id",
+                    "measured_mass",
+                    "retention_time",
+                    "compound_type",
+                    "ion_mode",
+                    "compound_name",
+                ],
+                (
+                    statement
+                    if chunk is None
+                    else statement.where(
+                        models.MeasuredCompound.measured_compound_id.in_(chunk)
+                    )
+                ),
+            )
+        )
+
+
+def select_measured_compound_ids(
+    skip: int = 0,
+    limit: int = 100,
+    retention_time: float = None,
+    compound_type: str = None,
+    ion_mode: str = None,
+    after: Optional[int] = None,
+    rt_tol: float = 0.0,
+    rt_min: Optional[float] = None,
+    rt_max: Optional[float] = None,
+) -> Select:
+    """Select the ids of a page of filtered measured compounds from the search table, without joins."""  # noqa: E501
+    statement = _filter_measured_compounds(
+        select(models.MeasuredCompoundSearch.measured_compound_id),
+        retention_time=retention_time,
+        compound_type=compound_type,
+        ion_mode=ion_mode,
+        rt_tol=rt_tol,
+        rt_min=rt_min,
+        rt_max=rt_max,
+        columns=_SEARCH_FILTER_COLUMNS,
+    )
+    return _paginate(
+        statement,
+        models.MeasuredCompoundSearch.measured_compound_id,
+        skip,
+        limit,
+        after,
+    )
+
+
 # CRUD to query measured components with a filter
 def get_measured_compounds_filtered(
     db: Session,
@@ -217,10 +790,60 @@ def get_measured_compounds_filtered(
     retention_time: float = None,
     compound_type: str = None,
     ion_mode: str = None,
+    after: Optional[int] = None,
+    rt_tol: float = 0.0,
+    rt_min: Optional[float] = None,
+    rt_max: Optional[float] = None,
 ) -> List[models.MeasuredCompound]:
-    # Start the query on MeasuredCompound, and join related tables
-    query = (
-        db.query(models.MeasuredCompound)
+    """
+    Filter and paginate on the search table without joins, then load the page
+    with its relationships by primary key.
+    """
+    measured_compound_ids = db.scalars(
+        select_measured_compound_ids(
+            skip=skip,
+            limit=limit,
+            retention_time=retention_time,
+            compound_type=compound_type,
+            ion_mode=ion_mode,
+            after=after,
+            rt_tol=rt_tol,
+            rt_min=rt_min,
+            rt_max=rt_max,
+        )
+    ).all()
+    return get_measured_compounds_by_ids(db, list(measured_compound_ids))
+
+
+# Flattened measured compounds for the export
+def select_measured_compounds_flat(
+    retention_time: float = None,
+    compound_type: str = None,
+    ion_mode: str = None,
+    rt_tol: float = 0.0,
+    rt_min: Optional[float] = None,
+    rt_max: Optional[float] = None,
+) -> Select:
+    """Select measured compounds joined with their compound, adduct and retention time as flat rows."""  # noqa: E501
+    statement = (
+        select(
+            models.MeasuredCompound.measured_compound_id,
+            models.MeasuredCompound.measured_mass,
+            models.MeasuredCompound.molecular_formula.label(
+                "measured_formula"
+            ),
+            models.Compound.compound_id,
+            models.Compound.compound_name,
+            models.Compound.molecular_formula,
+            models.Compound.type.label("compound_type"),
+            models.Compound.computed_mass,
+            models.Adduct.adduct_id,
+            models.Adduct.adduct_name,
+            models.Adduct.ion_mode,
+            models.RetentionTime.retention_time_id,
+            models.RetentionTime.retention_time,
+            models.RetentionTime.comment.label("retention_time_comment"),
+        )
         .join(
             models.Compound,
             models.MeasuredCompound.compound_id == models.Compound.compound_id,
@@ -234,22 +857,27 @@ def get_measured_compounds_filtered(
             models.Adduct,
             models.MeasuredCompound.adduct_id == models.Adduct.adduct_id,
         )
+        .order_by(models.MeasuredCompound.measured_compound_id)
+    )
+    return _filter_measured_compounds(
+        statement,
+        retention_time=retention_time,
+        compound_type=compound_type,
+        ion_mode=ion_mode,
+        rt_tol=rt_tol,
+        rt_min=rt_min,
+        rt_max=rt_max,
     )
 
-    # Apply filters
-    if retention_time is not None:
-        if retention_time < 0:
-            raise ValueError("retention_time must be positive")
-        query = query.filter(
-            models.RetentionTime.retention_time == retention_time
-        )
-
-    if compound_type is not None:
-        query = query.filter(models.Compound.type == compound_type)
-
-    if ion_mode is not None:
-        query = query.filter(models.Adduct.ion_mode == ion_mode)
 
-    # Return the final query result
-    query = query.offset(skip).limit(limit)
-    return query.all()
+def stream_rows(
+    connection: Connection, statement: Select, batch_size: int = 1000
+) -> Iterator[Sequence[RowMapping]]:
+    """
+    Execute a statement through a server-side cursor and yield the rows in batches.
+    Memory stays flat no matter how many rows the statement returns.
+    """  # noqa: E501
+    result = connection.execution_options(
+        stream_results=True, yield_per=batch_size
+    ).execute(statement)
+    yield from result.mappings().partitions()
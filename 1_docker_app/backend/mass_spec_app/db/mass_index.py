@@ -0,0 +1,466 @@
+# 2024-09 Kai-Michael Kammer
+"""
+In-memory index of measured masses for fast ppm-tolerance lookups.
+The index keeps the measured masses in a sorted NumPy array next to the matching measured_compound_ids,
+so a mass window is found with two binary searches instead of a range scan in the database.
+Compound ids, retention times and ion modes are kept in parallel arrays, so whole peak lists
+can be matched against the library in a few vectorized steps (see match_peaks).
+Ids are not committed in order: a transaction of another worker may commit id 100 after id 101
+was indexed. Missing ids below the highest indexed id are therefore kept as gaps and looked for
+again by sync until they show up or MASS_INDEX_GAP_TIMEOUT passes (ids of rolled back inserts).
+The recompute_masses job rewrites the masses of existing ids, which sync can not pick up by id.
+The finish time of the last completed recompute job is the generation of the index: sync rebuilds
+the index when it changed, so every worker serves the new masses after a recompute. The generation
+is checked at most every MASS_INDEX_GENERATION_INTERVAL seconds, not on every search.
+"""  # noqa: E501
+import threading
+import time
+from datetime import datetime
+from typing import Any, Dict, Iterable, List, NamedTuple, Optional, Tuple
+
+import numpy as np
+from sqlalchemy import Select, func, or_, select
+from sqlalchemy.orm import Session
+
+from mass_spec_app import config, jobs
+from mass_spec_app.db import models
+
+# ion mode code of peaks that match every ion mode
+ANY_ION_MODE = -1
+# ion mode code of peaks with an ion mode that is not in the library
+UNKNOWN_ION_MODE = -2
+# maximum number of missing ids (gaps) sync looks for, the newest are kept
+MAX_GAPS = 10000
+# job that rewrites the masses of existing rows (see scripts/job_tasks.py)
+RECOMPUTE_JOB_KIND = "recompute_masses"
+
+
+def ppm_window(mz: float, ppm: float) -> Tuple[float, float]:
+    """Return the (lower, upper) mass bounds of a ppm window around mz."""
+    if mz <= 0:
+        raise ValueError("mz must be positive")
+    if ppm < 0:
+        raise ValueError("ppm must not be negative")
+    tolerance = mz * ppm * 1e-6
+    return mz - tolerance, mz + tolerance
+
+
+class _Columns(NamedTuple):
+    """Parallel arrays of the index, all sorted by mass."""
+
+    masses: np.ndarray
+    ids: np.ndarray
+    compound_ids: np.ndarray
+    retention_times: np.ndarray
+    ion_modes: np.ndarray  # codes, see MassIndex.ion_mode_names
+
+
+class PeakMatches(NamedTuple):
+    """Flat arrays with one entry per (peak, library entry) match, grouped by peak."""  # noqa: E501
+
+    peak_indices: np.ndarray
+    ids: np.ndarray
+    compound_ids: np.ndarray
+    masses: np.ndarray
+    retention_times: np.ndarray
+    ion_modes: List[Optional[str]]
+    mass_errors_ppm: np.ndarray
+
+    def records(self) -> List[Dict[str, Any]]:
+        """Return the matches as one dict per match (see schemas.PeakMatch)."""
+        columns = {
+            "peak_index": self.peak_indices.tolist(),
+            "measured_compound_id": self.ids.tolist(),
+            "compound_id": self.compound_ids.tolist(),
+            "measured_mass": self.masses.tolist(),
+            "retention_time": self.retention_times.tolist(),
+            "ion_mode": self.ion_modes,
+            "mass_error_ppm": self.mass_errors_ppm.tolist(),
+        }
+        return [dict(zip(columns, row)) for row in zip(*columns.values())]
+
+
+def _skipped_ids(max_id: int, new_ids: np.ndarray) -> np.ndarray:
+    """Return the newest MAX_GAPS ids between max_id and the highest new id that are not new ids."""  # noqa: E501
+    new_max_id = int(new_ids.max())
+    start = max(max_id, new_max_id - MAX_GAPS) + 1
+    return np.setdiff1d(np.arange(start, new_max_id, dtype=np.int64), new_ids)
+
+
+def _empty_columns() -> _Columns:
+    return _Columns(
+        masses=np.empty(0, dtype=np.float64),
+        ids=np.empty(0, dtype=np.int64),
+        compound_ids=np.empty(0, dtype=np.int64),
+        retention_times=np.empty(0, dtype=np.float64),
+        ion_modes=np.empty(0, dtype=np.int16),
+    )
+
+
+class MassIndex:
+    """
+    Sorted array index mapping measured_mass -> measured_compound_id.
+    Reads work on an immutable snapshot of the arrays, writes replace the snapshot under a lock.
+    """  # noqa: E501
+
+    def __init__(self) -> None:
+        self._lock = threading.Lock()
+        # columns sorted by mass, always replaced as a whole
+        self._snapshot = _empty_columns()
+        self._max_id = 0
+        # missing ids below _max_id and the monotonic time sync stops looking for them  # noqa: E501
+        self._gap_ids = np.empty(0, dtype=np.int64)
+        self._gap_deadlines = np.empty(0, dtype=np.float64)
+        # finish time of the last recompute job when the index was built
+        self._generation: Optional[datetime] = None
+        # monotonic time of the last generation check
+        self._generation_checked_at = -np.inf
+        self._rebuild_lock = threading.Lock()
+        # ion modes are stored as small integer codes
+        self.ion_mode_names: List[Optional[str]] = []
+        self._ion_mode_codes: Dict[Optional[str], int] = {}
+
+    def __len__(self) -> int:
+        return len(self._snapshot.ids)
+
+    def _replace(self, columns: _Columns) -> None:
+        """Swap in new (already sorted) arrays as the current snapshot."""
+        self._snapshot = columns
+        self._max_id = int(columns.ids.max()) if len(columns.ids) else 0
+
+    def _update_gaps(self, new_ids: np.ndarray) -> None:
+        """
+        Record the ids skipped by new ids above _max_id as gaps and close the gaps they fill
+        (call with the lock held, before the snapshot is replaced).
+        """  # noqa: E501
+        open_gaps = ~np.isin(self._gap_ids, new_ids)
+        gap_ids = self._gap_ids[open_gaps]
+        gap_deadlines = self._gap_deadlines[open_gaps]
+        if int(new_ids.max()) > self._max_id:
+            skipped = _skipped_ids(self._max_id, new_ids)
+            gap_ids = np.concatenate((gap_ids, skipped))[-MAX_GAPS:]
+            gap_deadlines = np.concatenate(
+                (
+                    gap_deadlines,
+                    np.full(
+                        len(skipped),
+                        time.monotonic() + config.MASS_INDEX_GAP_TIMEOUT,
+                    ),
+                )
+            )[-MAX_GAPS:]
+        self._gap_ids, self._gap_deadlines = gap_ids, gap_deadlines
+
+    def _encode_ion_modes(
+        self, ion_modes: Iterable[Optional[str]]
+    ) -> np.ndarray:
+        """Map ion mode names to codes, registering new names (call with the lock held)."""  # noqa: E501
+        codes = []
+        for ion_mode in ion_modes:
+            if ion_mode not in self._ion_mode_codes:
+                self._ion_mode_codes[ion_mode] = len(self.ion_mode_names)
+                self.ion_mode_names.append(ion_mode)
+            codes.append(self._ion_mode_codes[ion_mode])
+        return np.array(codes, dtype=np.int16)
+
+    @staticmethod
+    def _select_rows() -> Select:
+        return (
+            select(
+                models.MeasuredCompound.measured_compound_id,
+                models.MeasuredCompound.measured_mass,
+                models.MeasuredCompound.compound_id,
+                models.RetentionTime.retention_time,
+                models.Adduct.ion_mode,
+            )
+            .join(
+                models.RetentionTime,
+                models.MeasuredCompound.retention_time_id
+                == models.RetentionTime.retention_time_id,
+            )
+            .join(
+                models.Adduct,
+                models.MeasuredCompound.adduct_id == models.Adduct.adduct_id,
+            )
+        )
+
+    @staticmethod
+    def _current_generation(db: Session) -> Optional[datetime]:
+        return db.scalar(
+            select(func.max(models.Job.finished_at)).where(
+                models.Job.kind == RECOMPUTE_JOB_KIND,
+                models.Job.status == jobs.COMPLETED,
+            )
+        )
+
+    def build(self, db: Session) -> None:
+        """
+        (Re)build the index from all measured compounds in the database.
+        The new arrays are sorted aside and swapped in at once, searches use the old snapshot until then.
+        Rows committed during the build are picked up by the next sync (above the highest id or in a gap).
+        """  # noqa: E501
+        # read first, a recompute finishing during the build triggers another
+        self._generation_checked_at = time.monotonic()
+        generation = self._current_generation(db)
+        rows = db.execute(self._select_rows()).all()
+        ids, masses, compound_ids, retention_times, ion_modes = (
+            zip(*rows) if rows else ((),) * 5
+        )
+        masses = np.fromiter(masses, dtype=np.float64)
+        order = np.argsort(masses, kind="stable")
+        ids = np.fromiter(ids, dtype=np.int64)
+        # only the few distinct ion mode names are encoded under the lock
+        names = list(dict.fromkeys(ion_modes))
+        name_positions = {name: i for i, name in enumerate(names)}
+        name_indices = np.fromiter(
+            (name_positions[ion_mode] for ion_mode in ion_modes),
+            dtype=np.int64,
+            count=len(rows),
+        )[order]
+        gap_ids = (
+            _skipped_ids(0, ids) if len(ids) else np.empty(0, dtype=np.int64)
+        )
+        columns = _Columns(
+            masses=masses[order],
+            ids=ids[order],
+            compound_ids=np.fromiter(compound_ids, dtype=np.int64)[order],
+            retention_times=np.fromiter(retention_times, dtype=np.float64)[
+                order
+            ],
+            ion_modes=np.empty(0, dtype=np.int16),
+        )
+        with self._lock:
+            columns = columns._replace(
+                ion_modes=self._encode_ion_modes(names)[name_indices]
+            )
+            self._replace(columns)
+            self._gap_ids = gap_ids
+            self._gap_deadlines = np.full(
+                len(gap_ids), time.monotonic() + config.MASS_INDEX_GAP_TIMEOUT
+            )
+            self._generation = generation
+
+    def rebuild_due(self, db: Session) -> bool:
+        """
+        Return whether masses were recomputed since the index was built.
+        Checked at most every MASS_INDEX_GENERATION_INTERVAL seconds, False in between.
+        """  # noqa: E501
+        now = time.monotonic()
+        if (
+            now - self._generation_checked_at
+            < config.MASS_INDEX_GENERATION_INTERVAL
+        ):
+            return False
+        self._generation_checked_at = now
+        return self._current_generation(db) != self._generation
+
+    def rebuild(self, db: Session) -> None:
+        """Build the index again unless a concurrent rebuild already picked up the current generation."""  # noqa: E501
+        with self._rebuild_lock:
+            if self._current_generation(db) != self._generation:
+                self.build(db)
+
+    def sync(self, db: Session) -> None:
+        """
+        Pick up measured compounds written by other processes (e.g. other gunicorn workers).
+        The index is rebuilt if masses were recomputed since it was built (see rebuild_due).
+        """  # noqa: E501
+        if self.rebuild_due(db):
+            self.rebuild(db)
+        else:
+            self.sync_new_rows(db)
+
+    def sync_new_rows(self, db: Session) -> None:
+        """
+        Pick up measured compounds inserted since the index was built or synced.
+        Only rows with an id above the highest indexed id or in a gap are fetched, both are cheap
+        primary key lookups.
+        """  # noqa: E501
+        with self._lock:
+            keep = self._gap_deadlines > time.monotonic()
+            self._gap_ids = self._gap_ids[keep]
+            self._gap_deadlines = self._gap_deadlines[keep]
+            gap_ids = self._gap_ids.tolist()
+        ids = models.MeasuredCompound.measured_compound_id
+        condition = ids > self._max_id
+        if gap_ids:
+            condition = or_(condition, ids.in_(gap_ids))
+        rows = db.execute(self._select_rows().where(condition)).all()
+        if rows:
+            with self._lock:
+                self._add_many(*zip(*rows))
+
+    def add(
+        self,
+        measured_compound_id: int,
+        measured_mass: float,
+        compound_id: int = 0,
+        retention_time: float = np.nan,
+        ion_mode: Optional[str] = None,
+    ) -> None:
+        """Insert a single measured compound into the index."""
+        self.add_many(
+            ids=[measured_compound_id],
+            masses=[measured_mass],
+            compound_ids=[compound_id],
+            retention_times=[retention_time],
+            ion_modes=[ion_mode],
+        )
+
+    def add_many(
+        self,
+        ids: Iterable[int],
+        masses: Iterable[float],
+        compound_ids: Optional[Iterable[int]] = None,
+        retention_times: Optional[Iterable[float]] = None,
+        ion_modes: Optional[Iterable[Optional[str]]] = None,
+    ) -> None:
+        """
+        Insert several measured compounds into the index at once.
+        Entries without a retention time never match a retention time window.
+        """  # noqa: E501
+        ids, masses = list(ids), list(masses)
+        with self._lock:
+            self._add_many(
+                ids,
+                masses,
+                [0] * len(ids) if compound_ids is None else compound_ids,
+                (
+                    [np.nan] * len(ids)
+                    if retention_times is None
+                    else retention_times
+                ),
+                [None] * len(ids) if ion_modes is None else ion_modes,
+            )
+
+    def _add_many(
+        self,
+        ids: Iterable[int],
+        masses: Iterable[float],
+        compound_ids: Iterable[int],
+        retention_times: Iterable[float],
+        ion_modes: Iterable[Optional[str]],
+    ) -> None:
+        """Merge new entries into the snapshot (call with the lock held)."""
+        new = _Columns(
+            masses=np.fromiter(masses, dtype=np.float64),
+            ids=np.fromiter(ids, dtype=np.int64),
+            compound_ids=np.fromiter(compound_ids, dtype=np.int64),
+            retention_times=np.fromiter(retention_times, dtype=np.float64),
+            ion_modes=self._encode_ion_modes(ion_modes),
+        )
+        current = self._snapshot
+        # skip ids that are already indexed (e.g. picked up by sync)
+        keep = ~np.isin(new.ids, current.ids)
+        if not keep.any():
+            return
+        self._update_gaps(new.ids[keep])
+        order = np.argsort(new.masses[keep], kind="stable")
+        new = _Columns(*(column[keep][order] for column in new))
+        # merge the sorted new entries into the sorted snapshot
+        positions = np.searchsorted(current.masses, new.masses, side="right")
+        self._replace(
+            _Columns(
+                *(
+                    np.insert(column, positions, new_column)
+                    for column, new_column in zip(current, new)
+                )
+            )
+        )
+
+    def search(self, mz: float, ppm: float) -> List[int]:
+        """Return the ids of all measured compounds within mz +/- ppm, ordered by mass."""  # noqa: E501
+        lower, upper = ppm_window(mz, ppm)
+        masses, ids = self._snapshot.masses, self._snapshot.ids
+        start = np.searchsorted(masses, lower, side="left")
+        stop = np.searchsorted(masses, upper, side="right")
+        return ids[start:stop].tolist()
+
+    def match_peaks(
+        self,
+        mzs: Iterable[float],
+        ppm: float,
+        rts: Optional[Iterable[Optional[float]]] = None,
+        rt_tol: Optional[float] = None,
+        ion_modes: Optional[Iterable[Optional[str]]] = None,
+    ) -> PeakMatches:
+        """
+        Match a whole peak list against the index in one pass.
+        The peaks are sorted by m/z, so the binary searches for their windows walk through the sorted
+        library like a merge, which costs O((n + m) log m) instead of comparing all n x m pairs.
+        A peak matches an entry within mz +/- ppm, within rt +/- rt_tol (if both are given)
+        and with the same ion mode (if given). Matches are grouped by peak and ordered by mass.
+        """  # noqa: E501
+        mzs = np.fromiter(mzs, dtype=np.float64)
+        if len(mzs) and not (mzs > 0).all():
+            raise ValueError("mz must be positive")
+        if ppm < 0:
+            raise ValueError("ppm must not be negative")
+        if rt_tol is not None and rt_tol < 0:
+            raise ValueError("rt_tol must not be negative")
+        columns = self._snapshot
+
+        # window bounds of every peak, searched in m/z order
+        tolerance = mzs * ppm * 1e-6
+        order = np.argsort(mzs, kind="stable")
+        starts = np.empty(len(mzs), dtype=np.int64)
+        stops = np.empty(len(mzs), dtype=np.int64)
+        starts[order] = np.searchsorted(
+            columns.masses, (mzs - tolerance)[order], side="left"
+        )
+        stops[order] = np.searchsorted(
+            columns.masses, (mzs + tolerance)[order], side="right"
+        )
+
+        # expand the windows into one (peak, library position) pair per candidate  # noqa: E501
+        counts = stops - starts
+        peak_indices = np.repeat(np.arange(len(mzs)), counts)
+        offsets = np.arange(len(peak_indices)) - np.repeat(
+            np.cumsum(counts) - counts, counts
+        )
+        positions = np.repeat(starts, counts) + offsets
+
+        keep = np.ones(len(positions), dtype=bool)
+        if rts is not None and rt_tol is not None:
+            peak_rts = np.array(
+                [np.nan if rt is None else rt for rt in rts], dtype=np.float64
+            )[peak_indices]
+            # peaks without a retention time match every retention time
+            keep &= np.isnan(peak_rts) | (
+                np.abs(columns.retention_times[positions] - peak_rts) <= rt_tol
+            )
+        if ion_modes is not None:
+            peak_codes = np.array(
+                [
+                    (
+                        ANY_ION_MODE
+                        if ion_mode is None
+                        else self._ion_mode_codes.get(
+                            ion_mode, UNKNOWN_ION_MODE
+                        )
+                    )
+                    for ion_mode in ion_modes
+                ],
+                dtype=np.int16,
+            )[peak_indices]
+            keep &= (peak_codes == ANY_ION_MODE) | (
+                columns.ion_modes[positions] == peak_codes
+            )
+
+        peak_indices, positions = peak_indices[keep], positions[keep]
+        masses = columns.masses[positions]
+        peak_mzs = mzs[peak_indices]
+        return PeakMatches(
+            peak_indices=peak_indices,
+            ids=columns.ids[positions],
+            compound_ids=columns.compound_ids[positions],
+            masses=masses,
+            retention_times=columns.retention_times[positions],
+            ion_modes=np.array(self.ion_mode_names, dtype=object)[
+                columns.ion_modes[positions]
+            ].tolist(),
+            mass_errors_ppm=(peak_mzs - masses) / masses * 1e6,
+        )
+
+
+# one index per process, built in the app lifespan
+mass_index = MassIndex()
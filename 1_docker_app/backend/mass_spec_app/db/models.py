@@ -5,17 +5,22 @@ Compound, MeasuredCompound, RetentionTime, and Adduct models.
 These models represent the structure of the application's database and
 include relationships between tables.
 """  # noqa: E501
-from typing import List, Optional
+from datetime import datetime
+from typing import Any, Dict, List, Optional
 
 from sqlalchemy import (
+    JSON,
     Boolean,
     CheckConstraint,
     Column,
     DateTime,
     Float,
     ForeignKey,
+    Index,
     Integer,
+    LargeBinary,
     String,
+    Text,
     UniqueConstraint,
 )
 from sqlalchemy.orm import Mapped, mapped_column, relationship
@@ -49,6 +54,8 @@ class Compound(Base):
         String, nullable=True
     )  # Allow NULL values in 'type'
     computed_mass: Mapped[float] = mapped_column(Float)
+    # packed first isotope peaks, see chem_utils.IsotopeEnvelope
+    isotope_envelope: Mapped[Optional[bytes]] = mapped_column(LargeBinary)
 
     # One-to-Many relationship with MeasuredCompound (Optional for reverse relationship)  # noqa: E501
     measured_compounds: Mapped[List["MeasuredCompound"]] = relationship(
@@ -78,7 +85,10 @@ class RetentionTime(Base):
     retention_time_id: Mapped[int] = mapped_column(
         Integer, primary_key=True, index=True
     )
-    retention_time: Mapped[float] = mapped_column(Float)
+    # unique, so concurrent writers can upsert; range filters use the index too
+    retention_time: Mapped[float] = mapped_column(
+        Float, index=True, unique=True
+    )
     comment: Mapped[Optional[str]] = mapped_column(String, nullable=True)
 
     # One-to-Many relationship with MeasuredCompound
@@ -105,11 +115,14 @@ class MeasuredCompound(Base):
     adduct_id: Mapped[int] = mapped_column(
         Integer, ForeignKey("adducts.adduct_id")
     )
+    # index for joining from a retention time window to the measured compounds
     retention_time_id: Mapped[int] = mapped_column(
-        Integer, ForeignKey("retention_times.retention_time_id")
+        Integer, ForeignKey("retention_times.retention_time_id"), index=True
     )
     measured_mass: Mapped[float] = mapped_column(Float)
     molecular_formula: Mapped[str] = mapped_column(String)
+    # packed isotope peaks of the measured formula, offsets from measured_mass
+    isotope_envelope: Mapped[Optional[bytes]] = mapped_column(LargeBinary)
 
     # Many-to-One relationships
     compound: Mapped["Compound"] = relationship(
@@ -130,3 +143,80 @@ class MeasuredCompound(Base):
             name="uq_compound_retention_adduct",
         ),
     )
+
+
+# denormalized copy of the filtered columns of every measured compound, so the
+# filtered reads run without joins; written in the transaction of every create
+# (see crud.insert_search_rows)
+class MeasuredCompoundSearch(Base):
+    __tablename__ = "measured_compound_search"
+
+    measured_compound_id: Mapped[int] = mapped_column(
+        Integer,
+        ForeignKey("measured_compounds.measured_compound_id"),
+        primary_key=True,
+    )
+    compound_id: Mapped[int] = mapped_column(Integer)
+    adduct_id: Mapped[int] = mapped_column(Integer)
+    retention_time_id: Mapped[int] = mapped_column(Integer)
+    measured_mass: Mapped[float] = mapped_column(Float)
+    retention_time: Mapped[float] = mapped_column(Float)
+    compound_type: Mapped[Optional[str]] = mapped_column(String)
+    ion_mode: Mapped[str] = mapped_column(String)
+    compound_name: Mapped[str] = mapped_column(String)
+
+    # one index per filter combination, pages are ordered by id
+    __table_args__ = (
+        # compound type, with or without ion mode
+        Index(
+            "ix_measured_compound_search_type_ion_mode_id",
+            "compound_type",
+            "ion_mode",
+            "measured_compound_id",
+        ),
+        # ion mode alone
+        Index(
+            "ix_measured_compound_search_ion_mode_id",
+            "ion_mode",
+            "measured_compound_id",
+        ),
+        # retention time windows, type and ion mode are checked in the index
+        Index(
+            "ix_measured_compound_search_rt_type_ion_mode",
+            "retention_time",
+            "compound_type",
+            "ion_mode",
+        ),
+    )
+
+
+# long-running operations, executed by the job runner (see jobs.py)
+class Job(Base):
+    __tablename__ = "jobs"
+
+    job_id: Mapped[str] = mapped_column(String(32), primary_key=True)
+    kind: Mapped[str] = mapped_column(String)
+    # queued, running, completed, failed or cancelled
+    status: Mapped[str] = mapped_column(String, default="queued")
+    params: Mapped[Dict[str, Any]] = mapped_column(JSON, default=dict)
+    progress: Mapped[Dict[str, Any]] = mapped_column(JSON, default=dict)
+    result: Mapped[Optional[Dict[str, Any]]] = mapped_column(JSON)
+    error: Mapped[Optional[str]] = mapped_column(Text)
+    cancel_requested: Mapped[bool] = mapped_column(Boolean, default=False)
+    created_at: Mapped[datetime] = mapped_column(DateTime(timezone=True))
+    started_at: Mapped[Optional[datetime]] = mapped_column(
+        DateTime(timezone=True)
+    )
+    finished_at: Mapped[Optional[datetime]] = mapped_column(
+        DateTime(timezone=True)
+    )
+    # the worker running the job and its last heartbeat (see jobs.py)
+    worker_id: Mapped[Optional[str]] = mapped_column(String)
+    heartbeat_at: Mapped[Optional[datetime]] = mapped_column(
+        DateTime(timezone=True)
+    )
+
+    # the runners claim the oldest queued job
+    __table_args__ = (
+        Index("ix_jobs_status_created_at", "status", "created_at"),
+    )
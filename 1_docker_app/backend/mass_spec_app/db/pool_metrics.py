@@ -0,0 +1,132 @@
+# 2024-09 Kai-Michael Kammer
+"""
+Connection pool classes that measure how long a request waits for a database connection.
+Checkout latency and timeouts are recorded in the pool's _do_get, connection errors through the
+handle_error engine event; together with the pool counters they are exposed on /admin/pool-metrics/.
+"""  # noqa: E501
+import threading
+import time
+from typing import Any, Dict
+
+from sqlalchemy import event, exc
+from sqlalchemy.engine import Engine, ExceptionContext
+from sqlalchemy.pool import (
+    AsyncAdaptedQueuePool,
+    ConnectionPoolEntry,
+    QueuePool,
+)
+
+
+class PoolMetrics:
+    """Thread-safe counters of checkouts, checkout latency and connection errors."""  # noqa: E501
+
+    def __init__(self) -> None:
+        self._lock = threading.Lock()
+        self.checkouts = 0
+        self.checkout_seconds_total = 0.0
+        self.checkout_seconds_max = 0.0
+        self.checkout_timeouts = 0
+        self.connection_errors = 0
+        self.disconnects = 0
+
+    def record_checkout(self, seconds: float) -> None:
+        with self._lock:
+            self.checkouts += 1
+            self.checkout_seconds_total += seconds
+            self.checkout_seconds_max = max(self.checkout_seconds_max, seconds)
+
+    def record_timeout(self) -> None:
+        with self._lock:
+            self.checkout_timeouts += 1
+
+    def record_error(self, is_disconnect: bool) -> None:
+        with self._lock:
+            self.connection_errors += 1
+            if is_disconnect:
+                self.disconnects += 1
+
+    def stats(self) -> Dict[str, float]:
+        """Return the counters and the mean checkout latency."""
+        with self._lock:
+            return {
+                "checkouts": self.checkouts,
+                "checkout_ms_mean": (
+                    1000 * self.checkout_seconds_total / self.checkouts
+                    if self.checkouts
+                    else 0.0
+                ),
+                "checkout_ms_max": 1000 * self.checkout_seconds_max,
+                "checkout_timeouts": self.checkout_timeouts,
+                "connection_errors": self.connection_errors,
+                "disconnects": self.disconnects,
+            }
+
+
+class _InstrumentedPoolMixin:
+    """Times every connection checkout of a pool (waiting plus opening a new connection)."""  # noqa: E501
+
+    def __init__(self, *args: Any, **kwargs: Any) -> None:
+        super().__init__(*args, **kwargs)
+        self.metrics = PoolMetrics()
+
+    def recreate(self) -> Any:
+        # engine.dispose() recreates the pool, the counters carry over
+        pool = super().recreate()
+        pool.metrics = self.metrics
+        return pool
+
+    def _do_get(self) -> ConnectionPoolEntry:
+        start = time.perf_counter()
+        try:
+            connection = super()._do_get()
+        except exc.TimeoutError:
+            self.metrics.record_timeout()
+            raise
+        self.metrics.record_checkout(time.perf_counter() - start)
+        return connection
+
+
+class InstrumentedQueuePool(_InstrumentedPoolMixin, QueuePool):
+    """QueuePool recording checkout latency and timeouts."""
+
+
+class InstrumentedAsyncAdaptedQueuePool(
+    _InstrumentedPoolMixin, AsyncAdaptedQueuePool
+):
+    """AsyncAdaptedQueuePool recording checkout latency and timeouts."""
+
+
+def _handle_error(context: ExceptionContext) -> None:
+    """Count errors of the database connection itself, not failing statements."""  # noqa: E501
+    dbapi = context.dialect.loaded_dbapi
+    if context.is_disconnect or isinstance(
+        context.original_exception, dbapi.OperationalError
+    ):
+        metrics = getattr(context.engine.pool, "metrics", None)
+        if metrics is not None:
+            metrics.record_error(context.is_disconnect)
+
+
+def instrument_engine(engine: Engine) -> None:
+    """Count connection errors of an engine using one of the instrumented pools."""  # noqa: E501
+    event.listen(engine, "handle_error", _handle_error)
+
+
+def get_pool_metrics(engine: Engine) -> Dict[str, Any]:
+    """Return the current pool usage and the recorded metrics of an engine."""
+    pool = engine.pool
+    status: Dict[str, Any] = {"pool": type(pool).__name__}
+    if isinstance(pool, QueuePool):
+        status.update(
+            {
+                "size": pool.size(),
+                "checked_in": pool.checkedin(),
+                "checked_out": pool.checkedout(),
+                "overflow": max(pool.overflow(), 0),
+                "max_overflow": pool._max_overflow,
+            }
+        )
+    metrics = getattr(pool, "metrics", None)
+    if metrics is not None:
+        status.update(metrics.stats())
+    return status
@@ -0,0 +1,43 @@
+# 2024-09 Kai-Michael Kammer
+"""
+Counts the SQL statements an engine executes, using SQLAlchemy engine events.
+Used in tests to assert a fixed number of queries per endpoint (e.g. to catch N+1 lazy loads).
+"""  # noqa: E501
+from typing import Any, List
+
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+
+class QueryCounter:
+    """
+    Context manager recording every statement executed on an engine.
+
+    with QueryCounter(engine) as counter:
+        ...
+    assert counter.count == 1
+    """
+
+    def __init__(self, engine: Engine) -> None:
+        self.engine = engine
+        self.statements: List[str] = []
+
+    @property
+    def count(self) -> int:
+        return len(self.statements)
+
+    def _before_cursor_execute(
+        self, conn: Any, cursor: Any, statement: str, *args: Any
+    ) -> None:
+        self.statements.append(statement)
+
+    def __enter__(self) -> "QueryCounter":
+        event.listen(
+            self.engine, "before_cursor_execute", self._before_cursor_execute
+        )
+        return self
+
+    def __exit__(self, *exc_info: Any) -> None:
+        event.remove(
+            self.engine, "before_cursor_execute", self._before_cursor_execute
+        )
@@ -2,17 +2,67 @@
 """
 Sets up the database connection using SQLAlchemy's engine and session maker.
 Handles the lifecycle of database sessions for executing transactions within the API.
+The API routes use the async engine/session, scripts like populate_data use the sync ones.
+Both engines use instrumented pools sized and tuned through config.py (see pool_metrics.py),
+their statement durations and pool counters are exported on /metrics (see metrics.py).
+Statements of profiled requests are recorded as well (see profiling.py).
 """  # noqa: E501
-from typing import Generator
+from typing import AsyncGenerator, Generator
 
 from sqlalchemy import create_engine
+from sqlalchemy.ext.asyncio import (
+    AsyncSession,
+    async_sessionmaker,
+    create_async_engine,
+)
 from sqlalchemy.ext.declarative import DeclarativeMeta
 from sqlalchemy.orm import Session, declarative_base, sessionmaker
 
+from mass_spec_app import config
 from mass_spec_app.config import DATABASE_URL
+from mass_spec_app.db.pool_metrics import (
+    InstrumentedAsyncAdaptedQueuePool,
+    InstrumentedQueuePool,
+    instrument_engine,
+)
+from mass_spec_app.metrics import (
+    PoolCollector,
+    instrument_queries,
+    register_collector,
+)
+from mass_spec_app.profiling import capture_statements
 
-engine = create_engine(DATABASE_URL)
+# shared by the sync and the async engine, each process gets its own pools
+POOL_OPTIONS = {
+    "pool_size": config.DB_POOL_SIZE,
+    "max_overflow": config.DB_MAX_OVERFLOW,
+    "pool_timeout": config.DB_POOL_TIMEOUT,
+    "pool_recycle": config.DB_POOL_RECYCLE,
+    "pool_pre_ping": config.DB_POOL_PRE_PING,
+    "connect_args": {"connect_timeout": config.DB_CONNECT_TIMEOUT},
+}
+
+engine = create_engine(
+    DATABASE_URL, poolclass=InstrumentedQueuePool, **POOL_OPTIONS
+)
+instrument_engine(engine)
+instrument_queries(engine, "sync")
+capture_statements(engine)
 SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
+# psycopg 3 supports asyncio natively, so the same URL works for the async engine  # noqa: E501
+async_engine = create_async_engine(
+    DATABASE_URL, poolclass=InstrumentedAsyncAdaptedQueuePool, **POOL_OPTIONS
+)
+instrument_engine(async_engine.sync_engine)
+instrument_queries(async_engine.sync_engine, "async")
+capture_statements(async_engine.sync_engine)
+register_collector(
+    PoolCollector({"sync": engine, "async": async_engine.sync_engine})
+)
+# objects stay loaded after commit, as lazy loading is not possible in async code  # noqa: E501
+AsyncSessionLocal = async_sessionmaker(
+    bind=async_engine, autoflush=False, expire_on_commit=False
+)
 Base: DeclarativeMeta = declarative_base()
 
 
@@ -22,3 +72,8 @@ def get_db() -> Generator[Session, None, None]:
         yield db
     finally:
         db.close()
+
+
+async def get_async_db() -> AsyncGenerator[AsyncSession, None]:
+    async with AsyncSessionLocal() as db:
+        yield db
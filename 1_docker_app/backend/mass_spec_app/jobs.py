@@ -0,0 +1,395 @@
+# 2024-09 Kai-Michael Kammer
+"""
+Lightweight job runner for long operations (library imports, mass recomputation, large exports),
+so they neither hold an HTTP connection nor block a request. Jobs are rows of the jobs table:
+submit inserts a queued job and returns at once, every worker runs JOB_CONCURRENCY runner threads
+that claim the oldest queued job (SELECT ... FOR UPDATE SKIP LOCKED, so workers never claim the same
+job) and store its progress, result or error. No outside service is needed.
+JOB_CONCURRENCY limits the running jobs of all workers together: claims are serialized by an
+advisory lock and a runner only claims a job while fewer jobs are running.
+Runners are woken up by submits of their own worker and poll every JOB_POLL_INTERVAL seconds for
+jobs submitted to other workers. Handlers receive a JobContext to report progress; reporting also
+checks for cancellation, which raises JobCancelled inside the handler.
+Every worker writes a heartbeat for its running jobs each JOB_HEARTBEAT_INTERVAL seconds. Running
+jobs without a heartbeat for JOB_HEARTBEAT_TIMEOUT seconds were orphaned by a dead worker: the next
+heartbeat (or start) of any worker fails them, or cancels them if that was requested. The chunks
+they committed stay, resubmit them. The heartbeat also deletes the files in JOB_DIR older than
+JOB_FILE_RETENTION seconds (export results, uploads left behind by a dead worker).
+"""  # noqa: E501
+import logging
+import os
+import socket
+import threading
+import time
+import uuid
+from datetime import datetime, timedelta, timezone
+from typing import Any, Callable, Dict, List, Optional
+
+from sqlalchemy import and_, func, or_, select, update
+from sqlalchemy.orm import Session, sessionmaker
+
+from mass_spec_app import config
+from mass_spec_app.db import models
+
+# key of the postgres advisory lock serializing the claims of all workers
+CLAIM_LOCK_KEY = 0x6A6F6273
+QUEUED, RUNNING, COMPLETED, FAILED, CANCELLED = (
+    "queued",
+    "running",
+    "completed",
+    "failed",
+    "cancelled",
+)
+
+
+class JobCancelled(Exception):
+    pass
+
+
+class JobContext:
+    """Passed to the handlers to report progress and notice cancellation."""
+
+    # seconds between progress writes, reports in between are skipped
+    REPORT_INTERVAL = 0.5
+
+    def __init__(self, session_factory: sessionmaker, job_id: str) -> None:
+        self.session_factory = session_factory
+        self.job_id = job_id
+        self._reported = 0.0
+
+    def report(self, force: bool = False, **progress: Any) -> None:
+        """Store the progress of the job, raise JobCancelled if it was cancelled."""  # noqa: E501
+        now = time.monotonic()
+        if not force and now - self._reported < self.REPORT_INTERVAL:
+            return
+        self._reported = now
+        # a separate transaction, the handler's own stays untouched
+        with self.session_factory() as db:
+            cancel_requested = db.execute(
+                update(models.Job)
+                .where(models.Job.job_id == self.job_id)
+                .values(progress=progress)
+                .returning(models.Job.cancel_requested)
+            ).scalar_one()
+            db.commit()
+        if cancel_requested:
+            raise JobCancelled()
+
+
+# kind -> handler(db, params, context) returning the result of the job
+Handler = Callable[[Session, Dict[str, Any], JobContext], Dict[str, Any]]
+HANDLERS: Dict[str, Handler] = {}
+
+
+def register(kind: str) -> Callable[[Handler], Handler]:
+    """Register the handler of a job kind."""
+
+    def decorator(handler: Handler) -> Handler:
+        HANDLERS[kind] = handler
+        return handler
+
+    return decorator
+
+
+def _now() -> datetime:
+    return datetime.now(tz=timezone.utc)
+
+
+def submit(db: Session, kind: str, params: Dict[str, Any]) -> models.Job:
+    """Queue a job, the runners pick it up (see JobRunner.notify)."""
+    if kind not in HANDLERS:
+        raise ValueError(f"Unknown job kind {kind}")
+    job = models.Job(
+        job_id=uuid.uuid4().hex,
+        kind=kind,
+        status=QUEUED,
+        params=params,
+        progress={},
+        cancel_requested=False,
+        created_at=_now(),
+    )
+    db.add(job)
+    db.commit()
+    return job
+
+
+def get_job(db: Session, job_id: str) -> Optional[models.Job]:
+    return db.get(models.Job, job_id)
+
+
+def get_jobs(
+    db: Session,
+    status: Optional[str] = None,
+    skip: int = 0,
+    limit: int = 100,
+) -> List[models.Job]:
+    """Return the jobs, newest first."""
+    statement = select(models.Job).order_by(models.Job.created_at.desc())
+    if status:
+        statement = statement.where(models.Job.status == status)
+    return list(db.scalars(statement.offset(skip).limit(limit)))
+
+
+def cancel(db: Session, job_id: str) -> Optional[models.Job]:
+    """
+    Cancel a job. Queued jobs are cancelled at once, running jobs stop at their next report.
+    Finished jobs are left unchanged.
+    """  # noqa: E501
+    db.execute(
+        update(models.Job)
+        .where(models.Job.job_id == job_id, models.Job.status == QUEUED)
+        .values(status=CANCELLED, cancel_requested=True, finished_at=_now())
+    )
+    db.execute(
+        update(models.Job)
+        .where(models.Job.job_id == job_id, models.Job.status == RUNNING)
+        .values(cancel_requested=True)
+    )
+    db.commit()
+    job = db.get(models.Job, job_id)
+    if job is not None:
+        db.refresh(job)
+    return job
+
+
+def recover_orphans(
+    db: Session, timeout: float = config.JOB_HEARTBEAT_TIMEOUT
+) -> int:
+    """
+    Finish the running jobs without a heartbeat for timeout seconds, their worker died.
+    They are cancelled if that was requested and failed otherwise. Returns their number.
+    """  # noqa: E501
+    orphaned = and_(
+        models.Job.status == RUNNING,
+        or_(
+            models.Job.heartbeat_at.is_(None),
+            models.Job.heartbeat_at < _now() - timedelta(seconds=timeout),
+        ),
+    )
+    cancelled = db.execute(
+        update(models.Job)
+        .where(orphaned, models.Job.cancel_requested)
+        .values(status=CANCELLED, finished_at=_now())
+    ).rowcount
+    failed = db.execute(
+        update(models.Job)
+        .where(orphaned)
+        .values(
+            status=FAILED,
+            error="The worker running the job stopped",
+            finished_at=_now(),
+        )
+    ).rowcount
+    db.commit()
+    for count, status in ((cancelled, CANCELLED), (failed, FAILED)):
+        if count:
+            logging.warning(f"{count} orphaned jobs {status}")
+    return cancelled + failed
+
+
+def remove_expired_files(job_dir: str, retention: float) -> int:
+    """
+    Delete the files in job_dir not modified for retention seconds.
+    Returns their number, the results of their jobs can not be downloaded anymore.
+    """  # noqa: E501
+    if not os.path.isdir(job_dir):
+        return 0
+    expired = time.time() - retention
+    removed = 0
+    with os.scandir(job_dir) as entries:
+        for entry in entries:
+            try:
+                if entry.is_file() and entry.stat().st_mtime < expired:
+                    os.remove(entry.path)
+                    removed += 1
+            except FileNotFoundError:
+                # removed by another worker
+                pass
+    if removed:
+        logging.info(f"{removed} expired job files removed")
+    return removed
+
+
+class JobRunner:
+    def __init__(
+        self,
+        concurrency: int = config.JOB_CONCURRENCY,
+        poll_interval: float = config.JOB_POLL_INTERVAL,
+        heartbeat_interval: float = config.JOB_HEARTBEAT_INTERVAL,
+        heartbeat_timeout: float = config.JOB_HEARTBEAT_TIMEOUT,
+    ) -> None:
+        self.concurrency = concurrency
+        self.poll_interval = poll_interval
+        self.heartbeat_interval = heartbeat_interval
+        self.heartbeat_timeout = heartbeat_timeout
+        self.session_factory: Optional[sessionmaker] = None
+        self.worker_id: Optional[str] = None
+        self._threads: List[threading.Thread] = []
+        self._wakeup = threading.Condition()
+        self._stopping = False
+        self._stopped = threading.Event()
+
+    def start(self, session_factory: sessionmaker) -> None:
+        self.session_factory = session_factory
+        # set here, gunicorn may fork the workers after the import
+        self.worker_id = (
+            f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:8]}"
+        )
+        self._stopping = False
+        self._stopped.clear()
+        self._recover_orphans()
+        self._remove_expired_files()
+        self._threads = [
+            threading.Thread(
+                target=self._run, name=f"job-runner-{i}", daemon=True
+            )
+            for i in range(self.concurrency)
+        ]
+        self._threads.append(
+            threading.Thread(
+                target=self._heartbeat, name="job-heartbeat", daemon=True
+            )
+        )
+        for thread in self._threads:
+            thread.start()
+
+    def stop(self, timeout: Optional[float] = None) -> None:
+        """Stop the runners once their current job is done."""
+        with self._wakeup:
+            self._stopping = True
+            self._wakeup.notify_all()
+        self._stopped.set()
+        for thread in self._threads:
+            thread.join(timeout)
+        self._threads = []
+
+    def notify(self) -> None:
+        """Wake up an idle runner of this worker after a submit."""
+        with self._wakeup:
+            self._wakeup.notify()
+
+    def _run(self) -> None:
+        while not self._stopping:
+            try:
+                job_id = self._claim()
+            except Exception:
+                logging.exception("Claiming a job failed")
+                job_id = None
+            if job_id is None:
+                with self._wakeup:
+                    if not self._stopping:
+                        self._wakeup.wait(self.poll_interval)
+                continue
+            try:
+                self._execute(job_id)
+            except Exception as e:
+                # the runner keeps going, the job must not stay "running"
+                logging.exception(f"Running job {job_id} failed")
+                try:
+                    self._finish(
+                        job_id,
+                        {
+                            "status": FAILED,
+                            "error": f"{type(e).__name__}: {e}",
+                        },
+                    )
+                except Exception:
+                    logging.exception(f"Finishing job {job_id} failed")
+
+    def _heartbeat(self) -> None:
+        """Write the heartbeats of this worker's jobs and finish orphaned ones."""  # noqa: E501
+        while not self._stopped.wait(self.heartbeat_interval):
+            try:
+                with self.session_factory() as db:
+                    db.execute(
+                        update(models.Job)
+                        .where(
+                            models.Job.worker_id == self.worker_id,
+                            models.Job.status == RUNNING,
+                        )
+                        .values(heartbeat_at=_now())
+                    )
+                    db.commit()
+            except Exception:
+                logging.exception("Writing the job heartbeats failed")
+            self._recover_orphans()
+            self._remove_expired_files()
+
+    def _recover_orphans(self) -> None:
+        try:
+            with self.session_factory() as db:
+                recover_orphans(db, self.heartbeat_timeout)
+        except Exception:
+            logging.exception("Recovering orphaned jobs failed")
+
+    def _remove_expired_files(self) -> None:
+        try:
+            remove_expired_files(config.JOB_DIR, config.JOB_FILE_RETENTION)
+        except Exception:
+            logging.exception("Removing expired job files failed")
+
+    def _claim(self) -> Optional[str]:
+        """Mark the oldest queued job as running and return its id."""
+        with self.session_factory() as db:
+            # held until the commit, so the running jobs stay counted right
+            db.execute(select(func.pg_advisory_xact_lock(CLAIM_LOCK_KEY)))
+            running = db.scalar(
+                select(func.count())
+                .select_from(models.Job)
+                .where(models.Job.status == RUNNING)
+            )
+            if running >= self.concurrency:
+                return None
+            job = db.scalars(
+                select(models.Job)
+                .where(models.Job.status == QUEUED)
+                .order_by(models.Job.created_at)
+                .limit(1)
+                .with_for_update(skip_locked=True)
+            ).first()
+            if job is None:
+                return None
+            job.status = RUNNING
+            job.started_at = job.heartbeat_at = _now()
+            job.worker_id = self.worker_id
+            db.commit()
+            return job.job_id
+
+    def _execute(self, job_id: str) -> None:
+        context = JobContext(self.session_factory, job_id)
+        values: Dict[str, Any]
+        with self.session_factory() as db:
+            job = db.get(models.Job, job_id)
+            # read before the handler runs: its commits expire the job, and
+            # reloading it fails once a statement aborted the transaction
+            kind, params = job.kind, dict(job.params)
+            try:
+                result = HANDLERS[kind](db, params, context)
+            except JobCancelled:
+                db.rollback()
+                values = {"status": CANCELLED}
+            except Exception as e:
+                db.rollback()
+                logging.exception(f"Job {job_id} ({kind}) failed")
+                values = {
+                    "status": FAILED,
+                    "error": f"{type(e).__name__}: {e}",
+                }
+            else:
+                # work the handler left uncommitted is discarded
+                db.rollback()
+                values = {"status": COMPLETED, "result": result}
+        self._finish(job_id, values)
+
+    def _finish(self, job_id: str, values: Dict[str, Any]) -> None:
+        with self.session_factory() as db:
+            db.execute(
+                update(models.Job)
+                .where(models.Job.job_id == job_id)
+                .values(finished_at=_now(), **values)
+            )
+            db.commit()
+
+
+# one runner per process, started by the app's lifespan
+job_runner = JobRunner()
@@ -0,0 +1,202 @@
+# 2024-09 Kai-Michael Kammer
+"""
+Prometheus metrics of the app, served on /metrics in the text exposition format.
+Request durations and in-flight requests are recorded by RequestMetricsMiddleware, SQL statement
+durations by engine events (instrument_queries). Pool and formula cache counters are kept anyway,
+so they are only read when scraped (collectors), which adds no cost to requests.
+With several gunicorn workers set PROMETHEUS_MULTIPROC_DIR to an empty directory, so histograms
+and gauges are aggregated over all workers. The collected counters are those of the scraped worker,
+so they get a pid label: every worker is its own series and scrapes answered by another worker do
+not look like counter resets. Aggregate them with e.g. sum without (pid) (rate(...)).
+"""  # noqa: E501
+import os
+import time
+from typing import Any, Dict, Iterator, List, Tuple
+
+from prometheus_client import (
+    CONTENT_TYPE_LATEST,
+    REGISTRY,
+    CollectorRegistry,
+    Gauge,
+    Histogram,
+    generate_latest,
+    multiprocess,
+)
+from prometheus_client.core import CounterMetricFamily, GaugeMetricFamily
+from prometheus_client.registry import Collector
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+from mass_spec_app import config
+from mass_spec_app.db.pool_metrics import get_pool_metrics
+from mass_spec_app.scripts import chem_utils as cu
+
+REQUEST_DURATION = Histogram(
+    "http_request_duration_seconds",
+    "Duration of HTTP requests by route template",
+    ["method", "route", "status"],
+    buckets=(0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10),
+)
+REQUESTS_IN_PROGRESS = Gauge(
+    "http_requests_in_progress",
+    "HTTP requests being served by route template",
+    ["method", "route"],
+    multiprocess_mode="livesum",
+)
+STATEMENT_DURATION = Histogram(
+    "db_statement_duration_seconds",
+    "Duration of SQL statements by engine and statement type",
+    ["engine", "statement"],
+    buckets=(0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.5, 1, 5),
+)
+# statement types with their own label, everything else is OTHER
+STATEMENT_TYPES = ("SELECT", "INSERT", "UPDATE", "DELETE", "WITH")
+
+# collectors of counters kept in the process (pools, caches)
+_process_collectors: List[Collector] = []
+
+
+def register_collector(collector: Collector) -> None:
+    """Register a collector that reads counters of the current process."""
+    _process_collectors.append(collector)
+    if not config.PROMETHEUS_MULTIPROC_DIR:
+        REGISTRY.register(collector)
+
+
+def render_metrics() -> Tuple[bytes, str]:
+    """Return the metrics in the text exposition format and its content type."""  # noqa: E501
+    if not config.PROMETHEUS_MULTIPROC_DIR:
+        return generate_latest(REGISTRY), CONTENT_TYPE_LATEST
+    registry = CollectorRegistry()
+    multiprocess.MultiProcessCollector(
+        registry, path=config.PROMETHEUS_MULTIPROC_DIR
+    )
+    for collector in _process_collectors:
+        registry.register(collector)
+    return generate_latest(registry), CONTENT_TYPE_LATEST
+
+
+def _worker_labels() -> Tuple[List[str], List[str]]:
+    """Return the label names and values that tell the workers' collected counters apart."""  # noqa: E501
+    if not config.PROMETHEUS_MULTIPROC_DIR:
+        return [], []
+    return ["pid"], [str(os.getpid())]
+
+
+def _statement_type(statement: str) -> str:
+    words = statement.lstrip().split(None, 1)
+    keyword = words[0].upper() if words else ""
+    return keyword if keyword in STATEMENT_TYPES else "OTHER"
+
+
+def instrument_queries(engine: Engine, name: str) -> None:
+    """Record the duration of every SQL statement executed by the engine."""
+    observers: Dict[str, Any] = {
+        statement_type: STATEMENT_DURATION.labels(name, statement_type)
+        for statement_type in STATEMENT_TYPES + ("OTHER",)
+    }
+
+    def before_cursor_execute(
+        conn: Any,
+        cursor: Any,
+        statement: str,
+        parameters: Any,
+        context: Any,
+        *args: Any,
+    ) -> None:
+        context._metrics_started = time.perf_counter()
+
+    def after_cursor_execute(
+        conn: Any,
+        cursor: Any,
+        statement: str,
+        parameters: Any,
+        context: Any,
+        *args: Any,
+    ) -> None:
+        started = getattr(context, "_metrics_started", None)
+        if started is not None:
+            observers[_statement_type(statement)].observe(
+                time.perf_counter() - started
+            )
+
+    event.listen(engine, "before_cursor_execute", before_cursor_execute)
+    event.listen(engine, "after_cursor_execute", after_cursor_execute)
+
+
+class PoolCollector(Collector):
+    """Exports the counters of the instrumented pools (see pool_metrics.py)."""
+
+    def __init__(self, engines: Dict[str, Engine]) -> None:
+        self.engines = engines
+
+    def collect(self) -> Iterator[Any]:
+        gauges = {
+            "checked_out": "Connections in use",
+            "checked_in": "Idle connections in the pool",
+            "overflow": "Connections opened above the pool size",
+        }
+        counters = {
+            "checkouts": "Connection checkouts",
+            "checkout_seconds_total": "Seconds spent waiting for connections",
+            "checkout_timeouts": "Checkouts that timed out",
+            "connection_errors": "Errors raised by connections",
+            "disconnects": "Errors that invalidated a connection",
+        }
+        label_names, label_values = _worker_labels()
+        families = {
+            key: GaugeMetricFamily(
+                f"db_pool_{key}", help, labels=label_names + ["engine"]
+            )
+            for key, help in gauges.items()
+        }
+        families.update(
+            {
+                key: CounterMetricFamily(
+                    f"db_pool_{key.removesuffix('_total')}",
+                    help,
+                    labels=label_names + ["engine"],
+                )
+                for key, help in counters.items()
+            }
+        )
+        for name, engine in self.engines.items():
+            status = get_pool_metrics(engine)
+            for key, family in families.items():
+                if key in status:
+                    family.add_metric(label_values + [name], status[key])
+        yield from families.values()
+
+
+class FormulaCacheCollector(Collector):
+    """Exports the call, hit and compute time counters of the chem_utils caches."""  # noqa: E501
+
+    def collect(self) -> Iterator[Any]:
+        counters = {
+            "hits": "Lookups answered from the cache",
+            "misses": "Lookups that computed the value",
+            "evictions": "Entries evicted from the cache",
+            "errors": "Computations that raised an error",
+            "compute_seconds": "Seconds spent computing values on a miss",
+        }
+        label_names, label_values = _worker_labels()
+        families = {
+            key: CounterMetricFamily(
+                f"chem_cache_{key}", help, labels=label_names + ["cache"]
+            )
+            for key, help in counters.items()
+        }
+        size = GaugeMetricFamily(
+            "chem_cache_size",
+            "Entries in the cache",
+            labels=label_names + ["cache"],
+        )
+        for name, stats in cu.get_cache_stats().items():
+            for key, family in families.items():
+                family.add_metric(label_values + [name], stats[key])
+            size.add_metric(label_values + [name], stats["size"])
+        yield from families.values()
+        yield size
+
+
+register_collector(FormulaCacheCollector())
@@ -0,0 +1,192 @@
+# 2024-09 Kai-Michael Kammer
+"""
+Storage and SQL capture for the opt-in per-request profiling (see api/request_profiler.py).
+While a request is profiled, the SQL statements it issues are collected through engine events
+into a context variable, which is None for all other requests, so they only pay for one lookup.
+Functions run in the threadpool (sync routes, run_in_threadpool) are wrapped with profiled: the
+threadpool copies the context variables of the request, so the wrapper finds the request's list
+of thread profilers and profiles the call in its own thread.
+Profiles are written to PROFILE_DIR (shared by the gunicorn workers): a JSON summary with the
+statements and the slowest functions, and the raw cProfile stats for pstats or snakeviz.
+"""  # noqa: E501
+import cProfile
+import functools
+import json
+import os
+import pstats
+import re
+import time
+from contextvars import ContextVar
+from typing import Any, Callable, Dict, List, Optional, TypeVar, Union
+
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+from mass_spec_app import config
+
+# statements of the request being profiled, None if it is not profiled
+captured_statements: ContextVar[Optional[List[Dict[str, Any]]]] = ContextVar(
+    "captured_statements", default=None
+)
+# profilers of the threadpool calls of the request being profiled, None if it is not profiled  # noqa: E501
+thread_profilers: ContextVar[Optional[List[cProfile.Profile]]] = ContextVar(
+    "thread_profilers", default=None
+)
+PROFILE_ID_PATTERN = re.compile(r"[0-9a-f]{32}")
+# functions listed in the summary, by cumulative time
+TOP_FUNCTIONS = 40
+
+
+def capture_statements(engine: Engine) -> None:
+    """Record the statements and durations of profiled requests on this engine."""  # noqa: E501
+
+    def before_cursor_execute(
+        conn: Any,
+        cursor: Any,
+        statement: str,
+        parameters: Any,
+        context: Any,
+        *args: Any,
+    ) -> None:
+        if captured_statements.get() is not None:
+            context._profile_started = time.perf_counter()
+
+    def after_cursor_execute(
+        conn: Any,
+        cursor: Any,
+        statement: str,
+        parameters: Any,
+        context: Any,
+        *args: Any,
+    ) -> None:
+        statements = captured_statements.get()
+        started = getattr(context, "_profile_started", None)
+        if statements is not None and started is not None:
+            statements.append(
+                {
+                    "statement": statement,
+                    "parameters": repr(parameters)[:500],
+                    "duration_ms": (time.perf_counter() - started) * 1e3,
+                }
+            )
+
+    event.listen(engine, "before_cursor_execute", before_cursor_execute)
+    event.listen(engine, "after_cursor_execute", after_cursor_execute)
+
+
+T = TypeVar("T")
+
+
+def profiled(func: Callable[..., T]) -> Callable[..., T]:
+    """Wrap a function run in the threadpool, so it is profiled when its request is."""  # noqa: E501
+
+    @functools.wraps(func)
+    def wrapper(*args: Any, **kwargs: Any) -> T:
+        profilers = thread_profilers.get()
+        if profilers is None:
+            return func(*args, **kwargs)
+        profiler = cProfile.Profile()
+        try:
+            profiler.enable()
+        except ValueError:
+            # Python 3.12+ (sys.monitoring): the request's profiler already
+            # records every thread and no second one can be enabled
+            return func(*args, **kwargs)
+        try:
+            return func(*args, **kwargs)
+        finally:
+            profiler.disable()
+            profilers.append(profiler)
+
+    return wrapper
+
+
+def top_functions(stats: pstats.Stats) -> List[Dict[str, Any]]:
+    """Return the functions with the highest cumulative time."""
+    rows = sorted(
+        stats.stats.items(),  # type: ignore[attr-defined]
+        key=lambda item: item[1][3],
+        reverse=True,
+    )
+    return [
+        {
+            "function": f"{filename}:{line}({name})",
+            "calls": calls,
+            "total_ms": total * 1e3,
+            "cumulative_ms": cumulative * 1e3,
+        }
+        for (filename, line, name), (_, calls, total, cumulative, _) in rows[
+            :TOP_FUNCTIONS
+        ]
+    ]
+
+
+class ProfileStore:
+    """Directory of the most recent profiles, each as <id>.json and <id>.prof."""  # noqa: E501
+
+    def __init__(self, directory: str, keep: int) -> None:
+        self.directory = directory
+        self.keep = keep
+
+    def _path(self, profile_id: str, suffix: str) -> Optional[str]:
+        # ids are generated by us, anything else could escape the directory
+        if not PROFILE_ID_PATTERN.fullmatch(profile_id):
+            return None
+        return os.path.join(self.directory, f"{profile_id}{suffix}")
+
+    def save(
+        self,
+        profile_id: str,
+        summary: Dict[str, Any],
+        profiler: Union[cProfile.Profile, pstats.Stats],
+    ) -> None:
+        stats = (
+            profiler
+            if isinstance(profiler, pstats.Stats)
+            else pstats.Stats(profiler)
+        )
+        os.makedirs(self.directory, exist_ok=True)
+        stats.dump_stats(self._path(profile_id, ".prof"))
+        with open(self._path(profile_id, ".json"), "w") as f:
+            json.dump(
+                {**summary, "functions": top_functions(stats)}, f, indent=1
+            )
+        self._prune()
+
+    def _prune(self) -> None:
+        """Remove the oldest profiles beyond keep."""
+        for profile_id in self.ids()[self.keep :]:  # noqa: E203
+            for suffix in (".json", ".prof"):
+                try:
+                    os.remove(self._path(profile_id, suffix))
+                except FileNotFoundError:
+                    pass
+
+    def ids(self) -> List[str]:
+        """Return the ids of the stored profiles, newest first."""
+        try:
+            names = os.listdir(self.directory)
+        except FileNotFoundError:
+            return []
+        paths = [
+            os.path.join(self.directory, name)
+            for name in names
+            if name.endswith(".json")
+        ]
+        paths.sort(key=os.path.getmtime, reverse=True)
+        return [os.path.basename(path)[: -len(".json")] for path in paths]
+
+    def get(self, profile_id: str) -> Optional[Dict[str, Any]]:
+        path = self._path(profile_id, ".json")
+        if path is None or not os.path.exists(path):
+            return None
+        with open(path) as f:
+            return json.load(f)
+
+    def stats_path(self, profile_id: str) -> Optional[str]:
+        """Return the path of the raw cProfile stats, None if unknown."""
+        path = self._path(profile_id, ".prof")
+        return path if path is not None and os.path.exists(path) else None
+
+
+profile_store = ProfileStore(config.PROFILE_DIR, config.PROFILE_KEEP)
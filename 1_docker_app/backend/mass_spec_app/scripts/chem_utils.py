@@ -3,41 +3,190 @@
 Utility functions for handling chemical data parsing and calculations,
 such as molecular mass computation.
 Includes functions for parsing molecular formulas and converting isotope notation.
+Results are memoized in bounded LRU caches, as libraries repeat the same formulas many times.
+Adducts are parsed once into an AdductDelta (elemental and mass change), so measured formulas and
+masses are plain arithmetic on the elements and mass of the compound.
+Isotope envelopes (the first isotope peaks M, M+1, M+2, ...) are computed from the same atom counts
+by convolving the isotope distributions of the elements, truncated to ISOTOPE_PEAKS nominal masses.
 """  # noqa: E501
 import re
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Callable, Dict, Hashable, NamedTuple, Tuple, TypeVar
 
-from molmass import Formula
+import numpy as np
+from molmass import Formula, from_elements
+from molmass.elements import ELEMENTS
 
+from mass_spec_app import config
 
-def convert_isotope_notation(molecular_formula: str) -> str:
+T = TypeVar("T")
+
+# This regex pattern captures elements with isotope notation, such as [13]C3 or [15]N3  # noqa: E501
+ISOTOPE_PATTERN = re.compile(r"(\[([0-9]+)\])([A-Z][a-z]*)(\d*)")
+# This regex pattern matches adducts like M+Na, M-H, M+NH4, M+2H or M+H-H2O
+ADDUCT_PATTERN = re.compile(r"M((?:[+-]\d*(?:[A-Z][a-z]?\d*)+)+)")
+# A single term of an adduct like +Na, -H2O or +2H
+ADDUCT_TERM_PATTERN = re.compile(r"([+-])(\d*)((?:[A-Z][a-z]?\d*)+)")
+
+# atom counts by element symbol and isotope mass number (0: natural), like molmass  # noqa: E501
+Elements = Dict[str, Dict[int, int]]
+# packed isotope envelopes: offsets then abundances as little-endian float32
+ENVELOPE_DTYPE = np.dtype("<f4")
+# mass difference of 13C and 12C, the offset of isotope peaks that do not occur  # noqa: E501
+ISOTOPE_SPACING = 1.0033548
+
+
+class AdductDelta(NamedTuple):
+    """Parsed adduct: its terms, the signed change of atoms and the exact mass change."""  # noqa: E501
+
+    adduct_name: str
+    terms: Tuple[Tuple[str, int, str], ...]  # (operation, multiplier, formula)
+    elements: Elements
+    mass: float
+
+
+class IsotopeEnvelope(NamedTuple):
     """
-    Converts C18[2]H14 to C18[2H14] which can then be parsed by the molmass package
+    The first isotope peaks (M, M+1, M+2, ...) of a formula, one per nominal mass.
+    offsets are the mass differences to the monoisotopic peak (so they also apply to a measured
+    mass), abundances are relative to the most abundant of these peaks.
     """  # noqa: E501
-    # This regex pattern captures elements with isotope notation, such as [13]C3 or [15]N3  # noqa: E501
-    pattern = re.compile(r"(\[([0-9]+)\])([A-Z][a-z]*)(\d*)")
 
-    # The replacer will adjust the position of the isotope and its related element  # noqa: E501
-    def replacer(match) -> str:
-        element = match.group(3)  # Element symbol (e.g., 'C', 'H', 'N')
-        count = match.group(4)  # Element count (optional, like '3' in 'C3')
-        isotope = match.group(2)  # Isotope number (e.g., '13' or '15')
+    offsets: Tuple[float, ...]
+    abundances: Tuple[float, ...]
 
-        # Place the isotope number followed by the element and its count
-        if count:
-            return f"[{isotope}{element}{count}]"
-        else:
-            return f"[{isotope}{element}]"
+    def pack(self) -> bytes:
+        """Pack the envelope for the database, 8 bytes per peak."""
+        return np.array(
+            [self.offsets, self.abundances], dtype=ENVELOPE_DTYPE
+        ).tobytes()
 
-    # Apply the transformation to the entire formula string
-    return pattern.sub(replacer, molecular_formula)
+    @classmethod
+    def unpack(cls, data: bytes) -> "IsotopeEnvelope":
+        offsets, abundances = np.frombuffer(
+            data, dtype=ENVELOPE_DTYPE
+        ).reshape(2, -1)
+        return cls(tuple(offsets.tolist()), tuple(abundances.tolist()))
 
 
-def get_monoisotopic_mass(molecular_formula: str) -> float:
+class LRUCache:
     """
-    Compute the mono-isotopic mass and molecular formula using molmass.
-    The molecular formula should be in the format C10[2H]6H4O3Cl1 or C10[2H6]H4O3Cl1.
-    The format C10[2]H6H4O3Cl1 is automatically converted
+    Bounded, thread-safe least-recently-used cache.
+    Counts hits, misses and evictions so the size can be tuned in production,
+    and the number, errors and total time of the computations on a miss.
+    """
+
+    def __init__(self, maxsize: int) -> None:
+        self.maxsize = maxsize
+        self._data: OrderedDict[Hashable, Any] = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.errors = 0
+        self.compute_seconds = 0.0
+
+    def get_or_compute(self, key: Hashable, compute: Callable[[], T]) -> T:
+        """Return the cached value for key, computing and storing it on a miss."""  # noqa: E501
+        with self._lock:
+            if key in self._data:
+                self._data.move_to_end(key)
+                self.hits += 1
+                return self._data[key]
+            self.misses += 1
+        # compute outside the lock, errors are raised and not cached
+        started = time.perf_counter()
+        try:
+            value = compute()
+        except Exception:
+            with self._lock:
+                self.errors += 1
+            raise
+        elapsed = time.perf_counter() - started
+        with self._lock:
+            self.compute_seconds += elapsed
+            self._data[key] = value
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+                self.evictions += 1
+        return value
+
+    def clear(self) -> None:
+        """Remove all entries and reset the counters."""
+        with self._lock:
+            self._data.clear()
+            self.hits = self.misses = self.evictions = self.errors = 0
+            self.compute_seconds = 0.0
+
+    def stats(self) -> Dict[str, float]:
+        """Return the counters, compute time, current size and hit rate of the cache."""  # noqa: E501
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "errors": self.errors,
+                "compute_seconds": self.compute_seconds,
+                "size": len(self._data),
+                "maxsize": self.maxsize,
+                "hit_rate": self.hits / lookups if lookups else 0.0,
+            }
+
+
+# Caches for normalized formulas, monoisotopic masses and adduct formulas
+_caches: Dict[str, LRUCache] = {
+    "normalized_formula": LRUCache(config.FORMULA_CACHE_SIZE),
+    "monoisotopic_mass": LRUCache(config.FORMULA_CACHE_SIZE),
+    "measured_formula": LRUCache(config.FORMULA_CACHE_SIZE),
+    "elements": LRUCache(config.FORMULA_CACHE_SIZE),
+    "isotope_envelope": LRUCache(config.FORMULA_CACHE_SIZE),
+    "element_distribution": LRUCache(config.FORMULA_CACHE_SIZE),
+    # adduct names come from clients too, the registered ones are kept in the adduct registry  # noqa: E501
+    "adduct_delta": LRUCache(config.FORMULA_CACHE_SIZE),
+}
+
+
+def get_cache_stats() -> Dict[str, Dict[str, float]]:
+    """Return hit/miss/eviction counters of all formula caches."""
+    return {name: cache.stats() for name, cache in _caches.items()}
+
+
+def clear_caches() -> None:
+    """Empty all formula caches and reset their counters."""
+    for cache in _caches.values():
+        cache.clear()
+
+
+def _replace_isotope(match: re.Match) -> str:
+    """Adjust the position of the isotope and its related element."""
+    element = match.group(3)  # Element symbol (e.g., 'C', 'H', 'N')
+    count = match.group(4)  # Element count (optional, like '3' in 'C3')
+    isotope = match.group(2)  # Isotope number (e.g., '13' or '15')
+
+    # Place the isotope number followed by the element and its count
+    if count:
+        return f"[{isotope}{element}{count}]"
+    else:
+        return f"[{isotope}{element}]"
+
+
+def convert_isotope_notation(molecular_formula: str) -> str:
+    """
+    Converts C18[2]H14 to C18[2H14] which can then be parsed by the molmass package
     """  # noqa: E501
+    # Apply the transformation to the entire formula string
+    return _caches["normalized_formula"].get_or_compute(
+        molecular_formula,
+        lambda: ISOTOPE_PATTERN.sub(_replace_isotope, molecular_formula),
+    )
+
+
+def _compute_monoisotopic_mass(molecular_formula: str) -> float:
+    formatted_formula = molecular_formula
     try:
         # Convert the formula for isotopic elements
         formatted_formula = convert_isotope_notation(molecular_formula)
@@ -58,42 +207,218 @@ def get_monoisotopic_mass(molecular_formula: str) -> float:
         )
 
 
-def get_measured_formula(molecular_formula: str, adduct_name: str) -> str:
+def get_monoisotopic_mass(molecular_formula: str) -> float:
     """
-    Compute the measured molecular formula by adding the adduct.
+    Compute the mono-isotopic mass and molecular formula using molmass.
     The molecular formula should be in the format C10[2H]6H4O3Cl1 or C10[2H6]H4O3Cl1.
+    The format C10[2]H6H4O3Cl1 is automatically converted
     """  # noqa: E501
-    # Define the regular expression pattern to match adducts like M+Na, M-H, M+H, etc.  # noqa: E501
-    pattern_adduct = r"M([+-])([A-Z][a-z]?)"
-    valid_adducts = ("Na", "H")
-
-    match_adduct = re.match(pattern_adduct, adduct_name)
-    if match_adduct:
-        adduct_operation = match_adduct.group(1)  # '+' or '-'
-        adduct_element = match_adduct.group(2)  # e.g., 'Na', 'H'
-        if adduct_element not in valid_adducts:
-            raise ValueError(f"Invalid adduct element: {adduct_element}")
-        try:
-            formatted_formula = convert_isotope_notation(molecular_formula)
-            # Use Molmass to parse the molecular formula
-            mm_formula = Formula(formatted_formula)
-            mm_adduct = Formula(adduct_element)
-            # Modify the formula based on the operation
-            if adduct_operation == "+":
-                mm_formula += mm_adduct
-            elif adduct_operation == "-":
-                mm_formula -= mm_adduct
-            else:
-                raise ValueError(
-                    "Invalid operation. Use '+' to add or '-' to remove an atom."  # noqa: E501
-                )
+    return _caches["monoisotopic_mass"].get_or_compute(
+        molecular_formula,
+        lambda: _compute_monoisotopic_mass(molecular_formula),
+    )
+
 
-            # Return the updated molecular formula
-            return str(mm_formula.formula)
+def get_elements(molecular_formula: str) -> Elements:
+    """
+    Return the atom counts of a molecular formula (shared, do not modify).
+    The molecular formula should be in the format C10[2H]6H4O3Cl1 or C10[2H6]H4O3Cl1.
+    """  # noqa: E501
+
+    def compute() -> Elements:
+        formatted_formula = convert_isotope_notation(molecular_formula)
+        try:
+            return Formula(formatted_formula)._elements
         except Exception as e:
             raise ValueError(
-                f"Error performing {adduct_operation} "
-                f"operation on {adduct_element}: {e}"
+                f"Error parsing {molecular_formula}/{formatted_formula}: {e}"
             )
-    else:
+
+    return _caches["elements"].get_or_compute(molecular_formula, compute)
+
+
+def _parse_adduct(adduct_name: str) -> AdductDelta:
+    match_adduct = ADDUCT_PATTERN.fullmatch(adduct_name)
+    if not match_adduct:
         raise ValueError(f"Invalid adduct name: {adduct_name}")
+    terms = []
+    elements: Elements = {}
+    mass = 0.0
+    for operation, multiplier, formula in ADDUCT_TERM_PATTERN.findall(
+        match_adduct.group(1)
+    ):
+        multiplier = int(multiplier or 1)
+        sign = 1 if operation == "+" else -1
+        try:
+            mm_formula = Formula(formula)
+            term_elements = mm_formula._elements
+            term_mass = mm_formula.isotope.mass
+        except Exception:
+            raise ValueError(f"Invalid adduct element: {formula}")
+        for symbol, isotopes in term_elements.items():
+            element = elements.setdefault(symbol, {})
+            for massnumber, count in isotopes.items():
+                element[massnumber] = (
+                    element.get(massnumber, 0) + sign * multiplier * count
+                )
+        mass += sign * multiplier * term_mass
+        terms.append((operation, multiplier, formula))
+    return AdductDelta(
+        adduct_name=adduct_name,
+        terms=tuple(terms),
+        elements=elements,
+        mass=mass,
+    )
+
+
+def parse_adduct(adduct_name: str) -> AdductDelta:
+    """
+    Parse an adduct name like M+H, M-H, M+NH4, M+2H or M+H-H2O into its elemental and mass change.
+    The mass change is the monoisotopic mass of the added minus the removed atoms,
+    the charge is not taken into account (like the measured formula).
+    """  # noqa: E501
+    return _caches["adduct_delta"].get_or_compute(
+        adduct_name, lambda: _parse_adduct(adduct_name)
+    )
+
+
+def apply_adduct(elements: Elements, delta: AdductDelta) -> Elements:
+    """Add/remove the atoms of an adduct, like molmass' Formula + and -."""
+    result = {symbol: dict(isotopes) for symbol, isotopes in elements.items()}
+    for symbol, isotopes in delta.elements.items():
+        element = result.setdefault(symbol, {})
+        for massnumber, count in isotopes.items():
+            element[massnumber] = element.get(massnumber, 0) + count
+            if element[massnumber] < 0:
+                isotope = f"{massnumber}{symbol}" if massnumber else symbol
+                raise ValueError(
+                    f"Error performing {delta.adduct_name}:"
+                    f" negative number of element {isotope}"
+                )
+            if element[massnumber] == 0:
+                del element[massnumber]
+        if not element:
+            del result[symbol]
+    return result
+
+
+def measured_formula_and_mass(
+    molecular_formula: str, compound_mass: float, delta: AdductDelta
+) -> Tuple[str, float]:
+    """
+    Compute the measured formula and mass of a compound with an already parsed adduct.
+    Only the compound formula is parsed (and cached), the rest is arithmetic.
+    """  # noqa: E501
+    measured_elements = apply_adduct(get_elements(molecular_formula), delta)
+    return from_elements(measured_elements), compound_mass + delta.mass
+
+
+def _compute_measured_formula(molecular_formula: str, adduct_name: str) -> str:
+    delta = parse_adduct(adduct_name)
+    return from_elements(apply_adduct(get_elements(molecular_formula), delta))
+
+
+def get_measured_formula(molecular_formula: str, adduct_name: str) -> str:
+    """
+    Compute the measured molecular formula by adding the adduct.
+    The molecular formula should be in the format C10[2H]6H4O3Cl1 or C10[2H6]H4O3Cl1.
+    """  # noqa: E501
+    return _caches["measured_formula"].get_or_compute(
+        (molecular_formula, adduct_name),
+        lambda: _compute_measured_formula(molecular_formula, adduct_name),
+    )
+
+
+# isotope distribution by nominal mass offset: (probabilities, probability-weighted masses)  # noqa: E501
+Distribution = Tuple[np.ndarray, np.ndarray]
+
+
+def _combine(a: Distribution, b: Distribution, peaks: int) -> Distribution:
+    """Distribution of the atoms of a and b together, truncated to peaks."""
+    (pa, wa), (pb, wb) = a, b
+    return (
+        np.convolve(pa, pb)[:peaks],
+        (np.convolve(wa, pb) + np.convolve(pa, wb))[:peaks],
+    )
+
+
+def _element_distribution(symbol: str, count: int, peaks: int) -> Distribution:
+    """
+    Distribution of count atoms of a natural element, by exponentiation by squaring.
+    Offsets are counted from the most abundant isotope (like the monoisotopic mass),
+    lighter isotopes (e.g. 54Fe) would be below the M peak and are left out.
+    """  # noqa: E501
+
+    def compute() -> Distribution:
+        isotopes = ELEMENTS[symbol].isotopes.values()
+        if not isotopes:
+            raise ValueError(f"Element {symbol} has no isotopes")
+        most_abundant = max(isotopes, key=lambda iso: iso.abundance)
+        base = (np.zeros(peaks), np.zeros(peaks))
+        for isotope in isotopes:
+            offset = isotope.massnumber - most_abundant.massnumber
+            if 0 <= offset < peaks:
+                base[0][offset] += isotope.abundance
+                base[1][offset] += isotope.abundance * isotope.mass
+        result = (np.eye(1, peaks).ravel(), np.zeros(peaks))
+        remaining = count
+        while remaining:
+            if remaining & 1:
+                result = _combine(result, base, peaks)
+            remaining >>= 1
+            if remaining:
+                base = _combine(base, base, peaks)
+        return result
+
+    return _caches["element_distribution"].get_or_compute(
+        (symbol, count, peaks), compute
+    )
+
+
+def isotope_envelope(
+    elements: Elements, peaks: int = config.ISOTOPE_PEAKS
+) -> IsotopeEnvelope:
+    """Compute the isotope envelope of atom counts (see get_elements)."""
+    distribution = (np.eye(1, peaks).ravel(), np.zeros(peaks))
+    for symbol, isotopes in elements.items():
+        for massnumber, count in isotopes.items():
+            if massnumber == 0:
+                distribution = _combine(
+                    distribution,
+                    _element_distribution(symbol, count, peaks),
+                    peaks,
+                )
+                continue
+            # specific isotopes (labels) only shift the mass
+            try:
+                isotope = ELEMENTS[symbol].isotopes[massnumber]
+            except KeyError:
+                raise ValueError(f"Unknown isotope {massnumber}{symbol}")
+            probabilities, weighted_masses = distribution
+            distribution = (
+                probabilities,
+                weighted_masses + probabilities * count * isotope.mass,
+            )
+    probabilities, weighted_masses = distribution
+    occurs = probabilities > 0
+    masses = np.divide(
+        weighted_masses, probabilities, out=np.zeros(peaks), where=occurs
+    )
+    offsets = np.where(
+        occurs, masses - masses[0], np.arange(peaks) * ISOTOPE_SPACING
+    )
+    return IsotopeEnvelope(
+        tuple(offsets.tolist()),
+        tuple((probabilities / probabilities.max()).tolist()),
+    )
+
+
+def get_isotope_envelope(molecular_formula: str) -> IsotopeEnvelope:
+    """
+    Compute the isotope envelope of a compound or measured formula.
+    The molecular formula should be in the format C10[2H]6H4O3Cl1 or C10[2H6]H4O3Cl1.
+    """  # noqa: E501
+    return _caches["isotope_envelope"].get_or_compute(
+        molecular_formula,
+        lambda: isotope_envelope(get_elements(molecular_formula)),
+    )
@@ -0,0 +1,245 @@
+# 2024-09 Kai-Michael Kammer
+"""
+Handlers of the job kinds (see jobs.py): importing uploaded files, recomputing all masses and
+exporting measured compounds to a file. They run in the job runner threads, commit their work
+in chunks and report their progress after every chunk, which is also where they get cancelled.
+Caches of the worker running the job are invalidated, other workers catch up through the
+response cache TTL. New rows reach the mass index of every worker through mass_index.sync, and
+after recompute_masses completed, sync rebuilds the index of every worker (see db/mass_index.py).
+"""  # noqa: E501
+import math
+import os
+from dataclasses import asdict
+from typing import Any, Dict, Optional
+
+from sqlalchemy import select, update
+from sqlalchemy.orm import Session
+
+from mass_spec_app import config, jobs
+from mass_spec_app.api import export
+from mass_spec_app.api.response_cache import response_cache
+from mass_spec_app.db import crud, models
+from mass_spec_app.db.adduct_registry import adduct_registry
+from mass_spec_app.db.mass_index import RECOMPUTE_JOB_KIND
+from mass_spec_app.scripts import chem_utils as cu
+from mass_spec_app.scripts import file_import, mass_engine
+
+COMPOUNDS = models.Compound.__tablename__
+MEASURED_COMPOUNDS = models.MeasuredCompound.__tablename__
+RETENTION_TIMES = models.RetentionTime.__tablename__
+
+
+def _run_import(
+    db: Session, kind: str, params: Dict[str, Any], context: jobs.JobContext
+) -> Dict[str, Any]:
+    tables = (
+        (COMPOUNDS,)
+        if kind == "compounds"
+        else (MEASURED_COMPOUNDS, RETENTION_TIMES)
+    )
+
+    def on_chunk(progress: file_import.ImportProgress) -> None:
+        response_cache.invalidate(*tables)
+        context.report(**asdict(progress))
+
+    try:
+        progress = file_import.run_import(
+            db, kind, params["path"], params["file_format"], on_chunk
+        )
+    finally:
+        # the upload is removed once the job is done, cancelled or failed
+        os.remove(params["path"])
+    context.report(force=True, **asdict(progress))
+    return asdict(progress)
+
+
+@jobs.register("import_compounds")
+def import_compounds(
+    db: Session, params: Dict[str, Any], context: jobs.JobContext
+) -> Dict[str, Any]:
+    """Import an uploaded compound file."""
+    return _run_import(db, "compounds", params, context)
+
+
+@jobs.register("import_measured_compounds")
+def import_measured_compounds(
+    db: Session, params: Dict[str, Any], context: jobs.JobContext
+) -> Dict[str, Any]:
+    """Import an uploaded measured compound file."""
+    return _run_import(db, "measured_compounds", params, context)
+
+
+def _changed(old: Optional[float], new: float) -> bool:
+    return old is None or not math.isclose(old, new, rel_tol=1e-12)
+
+
+def _envelope(molecular_formula: str) -> Optional[bytes]:
+    try:
+        return cu.get_isotope_envelope(molecular_formula).pack()
+    except ValueError:
+        return None
+
+
+@jobs.register(RECOMPUTE_JOB_KIND)
+def recompute_masses(
+    db: Session, params: Dict[str, Any], context: jobs.JobContext
+) -> Dict[str, Any]:
+    """
+    Recompute the masses and isotope envelopes of all compounds and the measured formulas,
+    masses and isotope envelopes of all measured compounds, e.g. after the isotope data or
+    the adduct parsing changed, or to fill the envelopes of rows created before they existed.
+    Rows are read in keyset-paginated chunks and only changed rows are written.
+    """  # noqa: E501
+    chunk_size = int(params.get("chunk_size", config.POPULATE_CHUNK_SIZE))
+    progress = {"compounds": 0, "measured_compounds": 0, "changed": 0}
+
+    last_id = -1
+    while True:
+        rows = db.execute(
+            select(
+                models.Compound.compound_id,
+                models.Compound.molecular_formula,
+                models.Compound.computed_mass,
+                models.Compound.isotope_envelope,
+            )
+            .where(models.Compound.compound_id > last_id)
+            .order_by(models.Compound.compound_id)
+            .limit(chunk_size)
+        ).all()
+        if not rows:
+            break
+        last_id = rows[-1].compound_id
+        masses = mass_engine.batch_monoisotopic_mass(
+            cu.convert_isotope_notation(row.molecular_formula) for row in rows
+        )
+        changed = []
+        for row, mass in zip(rows, masses):
+            envelope = _envelope(row.molecular_formula)
+            # rows that can not be computed anymore keep their values
+            if math.isnan(mass) or envelope is None:
+                continue
+            if (
+                _changed(row.computed_mass, mass)
+                or envelope != row.isotope_envelope
+            ):
+                changed.append(
+                    {
+                        "compound_id": row.compound_id,
+                        "computed_mass": float(mass),
+                        "isotope_envelope": envelope,
+                    }
+                )
+        if changed:
+            db.execute(update(models.Compound), changed)
+        db.commit()
+        progress["compounds"] += len(rows)
+        progress["changed"] += len(changed)
+        context.report(**progress)
+    response_cache.invalidate(COMPOUNDS)
+
+    adduct_registry.load(db)
+    last_id = -1
+    while True:
+        rows = db.execute(
+            select(
+                models.MeasuredCompound.measured_compound_id,
+                models.MeasuredCompound.molecular_formula.label(
+                    "measured_formula"
+                ),
+                models.MeasuredCompound.measured_mass,
+                models.MeasuredCompound.isotope_envelope,
+                models.Compound.molecular_formula,
+                models.Compound.computed_mass,
+                models.Adduct.adduct_name,
+            )
+            .join(models.Compound)
+            .join(models.Adduct)
+            .where(models.MeasuredCompound.measured_compound_id > last_id)
+            .order_by(models.MeasuredCompound.measured_compound_id)
+            .limit(chunk_size)
+        ).all()
+        if not rows:
+            break
+        last_id = rows[-1].measured_compound_id
+        changed = []
+        for row in rows:
+            adduct = adduct_registry.get(db, row.adduct_name)
+            if adduct is None:
+                continue
+            try:
+                formula, mass = adduct.measured_formula_and_mass(
+                    row.molecular_formula, row.computed_mass
+                )
+                envelope = cu.get_isotope_envelope(formula).pack()
+            except ValueError:
+                # rows that can not be computed anymore keep their values
+                continue
+            if (
+                formula != row.measured_formula
+                or _changed(row.measured_mass, mass)
+                or envelope != row.isotope_envelope
+            ):
+                changed.append(
+                    {
+                        "measured_compound_id": row.measured_compound_id,
+                        "molecular_formula": formula,
+                        "measured_mass": mass,
+                        "isotope_envelope": envelope,
+                    }
+                )
+        if changed:
+            db.execute(update(models.MeasuredCompound), changed)
+            # the search table holds a copy of the measured mass
+            db.execute(
+                update(models.MeasuredCompoundSearch),
+                [
+                    {
+                        "measured_compound_id": row["measured_compound_id"],
+                        "measured_mass": row["measured_mass"],
+                    }
+                    for row in changed
+                ],
+            )
+        db.commit()
+        progress["measured_compounds"] += len(rows)
+        progress["changed"] += len(changed)
+        context.report(**progress)
+    response_cache.invalidate(MEASURED_COMPOUNDS)
+    # the mass index of every worker is rebuilt once the job completed
+    context.report(force=True, **progress)
+    return progress
+
+
+@jobs.register("export_measured_compounds")
+def export_measured_compounds(
+    db: Session, params: Dict[str, Any], context: jobs.JobContext
+) -> Dict[str, Any]:
+    """
+    Export the (filtered) measured compounds to a file in JOB_DIR, downloaded through the job result.
+    The file is deleted JOB_FILE_RETENTION seconds after the export (see jobs.remove_expired_files).
+    Rows are streamed through a server-side cursor like the export endpoint.
+    """  # noqa: E501
+    export_format = params.get("format", "ndjson")
+    statement = crud.select_measured_compounds_flat(
+        **params.get("filters", {})
+    )
+    columns = list(statement.selected_columns.keys())
+    os.makedirs(config.JOB_DIR, exist_ok=True)
+    path = os.path.join(config.JOB_DIR, f"{context.job_id}.{export_format}")
+
+    rows = 0
+    try:
+        with open(path, "w", newline="") as f:
+            f.write(export.format_header(export_format, columns))
+            result = db.execute(
+                statement.execution_options(yield_per=config.EXPORT_BATCH_SIZE)
+            )
+            for batch in result.mappings().partitions():
+                f.write(export.format_batch(export_format, batch, columns))
+                rows += len(batch)
+                context.report(rows=rows)
+    except BaseException:
+        os.remove(path)
+        raise
+    context.report(force=True, rows=rows)
+    return {"path": path, "format": export_format, "rows": rows}
@@ -0,0 +1,258 @@
+# 2024-09 Kai-Michael Kammer
+"""
+Lightweight monoisotopic mass engine for computing many formulas at once.
+Formulas are tokenized with a single regex into (isotope column, count) pairs and the masses
+are summed with NumPy against an array of element and isotope masses taken from molmass.
+molmass (see chem_utils) stays the reference implementation; formulas this engine can not
+parse are handed to it as a fallback.
+Observed isotope patterns are scored against the stored isotope envelopes (see
+chem_utils.IsotopeEnvelope) for many (pattern, candidate) pairs at once.
+"""  # noqa: E501
+import re
+from typing import Dict, Iterable, List, NamedTuple, Optional, Sequence, Tuple
+
+import numpy as np
+from molmass.elements import ELEMENTS
+
+from mass_spec_app.scripts import chem_utils as cu
+
+# Tokens: "[13C3]"/"[13C]3", the "[13]C3" notation of our input files, plain "C3", and brackets  # noqa: E501
+TOKEN_PATTERN = re.compile(
+    r"\[(\d+)([A-Z][a-z]?)(\d*)\](\d*)"
+    r"|\[(\d+)\]([A-Z][a-z]?)(\d*)"
+    r"|([A-Z][a-z]?)(\d*)"
+    r"|(\()"
+    r"|\)(\d*)"
+)
+# symbols molmass accepts as shortcuts for isotopes
+ISOTOPE_ALIASES = {"D": (2, "H"), "T": (3, "H")}
+
+
+def _build_mass_table() -> Tuple[np.ndarray, Dict[str, int]]:
+    """
+    Build the mass array and the column of every element and isotope in it.
+    An element ("C") gets the mass of its most abundant isotope, like molmass' Formula.isotope,
+    a specific isotope ("13C") gets its own mass.
+    """  # noqa: E501
+    masses: List[float] = []
+    columns: Dict[str, int] = {}
+    for element in ELEMENTS:
+        if not element.isotopes:
+            continue
+        most_abundant = max(
+            element.isotopes.values(), key=lambda iso: iso.abundance
+        )
+        columns[element.symbol] = len(masses)
+        masses.append(most_abundant.mass)
+        for massnumber, isotope in element.isotopes.items():
+            columns[f"{massnumber}{element.symbol}"] = len(masses)
+            masses.append(isotope.mass)
+    for alias, (massnumber, symbol) in ISOTOPE_ALIASES.items():
+        if f"{massnumber}{symbol}" in columns:
+            columns[alias] = columns[f"{massnumber}{symbol}"]
+    return np.array(masses, dtype=np.float64), columns
+
+
+MASSES, COLUMNS = _build_mass_table()
+
+
+def _column(key: str, formula: str) -> int:
+    try:
+        return COLUMNS[key]
+    except KeyError:
+        raise ValueError(f"Unknown element or isotope {key} in {formula}")
+
+
+def parse_formula(formula: str) -> Dict[int, int]:
+    """
+    Parse a molecular formula into {column in MASSES: atom count}.
+    Supports element counts, parentheses and the isotope notations [13C3], [13C]3 and [13]C3.
+    """  # noqa: E501
+    stack: List[Dict[int, int]] = [{}]
+    position = 0
+    for match in TOKEN_PATTERN.finditer(formula):
+        if match.start() != position:
+            break
+        position = match.end()
+        (
+            iso_mass,
+            iso_symbol,
+            iso_inner,
+            iso_outer,
+            old_mass,
+            old_symbol,
+            old_count,
+            symbol,
+            count,
+            group_open,
+            group_count,
+        ) = match.groups()
+        if group_open:
+            stack.append({})
+            continue
+        if group_count is not None:
+            if len(stack) == 1:
+                raise ValueError(f"Unbalanced parentheses in {formula}")
+            group = stack.pop()
+            multiplier = int(group_count or 1)
+            if multiplier == 0:
+                raise ValueError(f"Count is zero in {formula}")
+            for column, atoms in group.items():
+                stack[-1][column] = (
+                    stack[-1].get(column, 0) + atoms * multiplier
+                )
+            continue
+        if iso_symbol:
+            column = _column(f"{iso_mass}{iso_symbol}", formula)
+            atoms = int(iso_inner or 1) * int(iso_outer or 1)
+        elif old_symbol:
+            column = _column(f"{old_mass}{old_symbol}", formula)
+            atoms = int(old_count or 1)
+        else:
+            column = _column(symbol, formula)
+            atoms = int(count or 1)
+        # like molmass, explicit zero counts are rejected
+        if atoms == 0:
+            raise ValueError(f"Count is zero in {formula}")
+        stack[-1][column] = stack[-1].get(column, 0) + atoms
+    if position != len(formula) or not formula:
+        raise ValueError(f"Can not parse formula {formula}")
+    if len(stack) != 1:
+        raise ValueError(f"Unbalanced parentheses in {formula}")
+    return stack[0]
+
+
+def monoisotopic_mass(formula: str) -> float:
+    """Compute the monoisotopic mass of a single formula."""
+    composition = parse_formula(formula)
+    columns = np.fromiter(composition.keys(), dtype=np.int64)
+    counts = np.fromiter(composition.values(), dtype=np.float64)
+    return float(np.dot(MASSES[columns], counts))
+
+
+def batch_monoisotopic_mass(
+    formulas: Iterable[str], fallback: bool = True
+) -> np.ndarray:
+    """
+    Compute the monoisotopic masses of many formulas as a NumPy array.
+    Every distinct formula is parsed once and all masses are summed in one vectorized step.
+    Formulas the engine can not parse are computed by molmass if fallback is set,
+    formulas that fail there as well (or without fallback) get NaN.
+    """  # noqa: E501
+    formulas = list(formulas)
+    unique: Dict[str, int] = {}
+    inverse = np.fromiter(
+        (unique.setdefault(f, len(unique)) for f in formulas),
+        dtype=np.int64,
+        count=len(formulas),
+    )
+
+    rows: List[int] = []
+    columns: List[int] = []
+    counts: List[int] = []
+    fallback_masses: Dict[int, Optional[float]] = {}
+    for row, formula in enumerate(unique):
+        try:
+            composition = parse_formula(formula)
+        except (ValueError, TypeError):
+            fallback_masses[row] = None
+            if fallback:
+                try:
+                    fallback_masses[row] = cu.get_monoisotopic_mass(formula)
+                except ValueError:
+                    pass
+            continue
+        rows.extend([row] * len(composition))
+        columns.extend(composition.keys())
+        counts.extend(composition.values())
+
+    column_array = np.array(columns, dtype=np.int64)
+    # bincount returns int64 when no formula was parsed here
+    unique_masses = np.bincount(
+        np.array(rows, dtype=np.int64),
+        weights=MASSES[column_array] * np.array(counts, dtype=np.float64),
+        minlength=len(unique),
+    ).astype(np.float64)
+    for row, mass in fallback_masses.items():
+        unique_masses[row] = np.nan if mass is None else mass
+    return unique_masses[inverse]
+
+
+def pad_patterns(patterns: Sequence[Sequence[float]]) -> np.ndarray:
+    """Stack peak lists of different lengths into one array, NaN padded."""
+    padded = np.full(
+        (len(patterns), max(map(len, patterns), default=0)), np.nan
+    )
+    for row, pattern in enumerate(patterns):
+        padded[row, : len(pattern)] = pattern  # noqa: E203
+    return padded
+
+
+def unpack_isotope_envelopes(
+    envelopes: Sequence[Optional[bytes]], masses: Iterable[float], peaks: int
+) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Unpack stored isotope envelopes into (m/z, abundance) arrays of shape (rows, peaks).
+    The offsets are added to the (measured) masses, missing envelopes and peaks are NaN.
+    """  # noqa: E501
+    offsets = np.full((len(envelopes), peaks), np.nan)
+    abundances = np.full((len(envelopes), peaks), np.nan)
+    for row, envelope in enumerate(envelopes):
+        if envelope is None:
+            continue
+        values = np.frombuffer(envelope, dtype=cu.ENVELOPE_DTYPE).reshape(
+            2, -1
+        )[:, :peaks]
+        offsets[row, : values.shape[1]] = values[0]  # noqa: E203
+        abundances[row, : values.shape[1]] = values[1]  # noqa: E203
+    masses = np.fromiter(masses, dtype=np.float64, count=len(envelopes))
+    return masses[:, None] + offsets, abundances
+
+
+class IsotopeScores(NamedTuple):
+    """Scores of (observed pattern, isotope envelope) pairs, one entry per pair."""  # noqa: E501
+
+    scores: np.ndarray  # cosine similarity, NaN without an envelope
+    matched_peaks: np.ndarray
+    # observed intensity of every envelope peak, relative to the most intense one  # noqa: E501
+    observed_abundances: np.ndarray
+
+
+def score_isotope_patterns(
+    observed_mzs: np.ndarray,
+    observed_intensities: np.ndarray,
+    envelope_mzs: np.ndarray,
+    envelope_abundances: np.ndarray,
+    ppm: float,
+) -> IsotopeScores:
+    """
+    Score observed isotope patterns against isotope envelopes, row by row.
+    Observed arrays have shape (pairs, observed peaks) and are NaN padded (see pad_patterns),
+    envelope arrays have shape (pairs, envelope peaks) (see unpack_isotope_envelopes).
+    Every envelope peak takes the most intense observed peak within ppm of its m/z (0 if none),
+    the score is the cosine similarity of the envelope abundances and these intensities,
+    so it is independent of the overall intensity and 1.0 for a perfect match.
+    """  # noqa: E501
+    if ppm < 0:
+        raise ValueError("ppm must not be negative")
+    # (pairs, envelope peaks, observed peaks), NaN never lies within ppm
+    within = (
+        np.abs(observed_mzs[:, None, :] - envelope_mzs[:, :, None])
+        <= (envelope_mzs * ppm * 1e-6)[:, :, None]
+    )
+    matched = np.where(within, observed_intensities[:, None, :], 0.0).max(
+        axis=2, initial=0.0
+    )
+    expected = np.nan_to_num(envelope_abundances)
+    norms = np.linalg.norm(expected, axis=1) * np.linalg.norm(matched, axis=1)
+    with np.errstate(invalid="ignore", divide="ignore"):
+        scores = np.where(
+            norms > 0, (expected * matched).sum(axis=1) / norms, 0.0
+        )
+        observed = matched / matched.max(axis=1, initial=0.0)[:, None]
+    scores[np.isnan(envelope_abundances).all(axis=1)] = np.nan
+    return IsotopeScores(
+        scores=scores,
+        matched_peaks=within.any(axis=2).sum(axis=1),
+        observed_abundances=np.nan_to_num(observed),
+    )
@@ -5,14 +5,22 @@ It processes raw data, maps it to the relevant models, and inserts it into the d
 """  # noqa: E501
 import json
 import logging
-from datetime import datetime, timezone
+import multiprocessing
+import time
+from collections import deque
+from concurrent.futures import Future, ProcessPoolExecutor
+from typing import Deque, Dict, Iterator, List, Optional, Tuple
 
 import pandas as pd
+from sqlalchemy import insert, select
 from sqlalchemy.orm import Session
 
+from mass_spec_app import config
 from mass_spec_app.api import schemas
 from mass_spec_app.db import crud, models
+from mass_spec_app.db.adduct_registry import RegisteredAdduct, adduct_registry
 from mass_spec_app.scripts import chem_utils as cu
+from mass_spec_app.scripts import mass_engine
 
 # File paths
 ADDUCTS_FILE = "./migration/adducts.json"
@@ -20,110 +28,301 @@ COMPOUNDS_FILE = "./migration/compounds.xlsx"
 MEASURED_COMPOUNDS_FILE = "./migration/measured-compounds.xlsx"
 
 
-# table to verify that initial migration was done
-def check_initialization_status(db: Session) -> bool:
-    """Check if the database has been initialized."""
-    status = db.query(models.InitializationStatus).first()
-    return status is not None and status.is_initialized
+def _report_rate(stage: str, rows: int, elapsed: float) -> None:
+    """Print the throughput of a population stage."""
+    rate = rows / elapsed if elapsed > 0 else float("inf")
+    print(f"{stage}: {rows} rows in {elapsed:.2f}s ({rate:.0f} rows/s)")
 
 
-def set_initialization_status(db: Session) -> None:
-    """Set the database as initialized with a timezone-aware timestamp."""
-    status = models.InitializationStatus(
-        is_initialized=True,
-        initialized_at=datetime.now(
-            tz=timezone.utc
-        ),  # Use timezone-aware datetime
+def _chunks(df: pd.DataFrame, chunk_size: int) -> Iterator[pd.DataFrame]:
+    """Split a DataFrame into chunks of at most chunk_size rows."""
+    for start in range(0, len(df), chunk_size):
+        yield df.iloc[start : start + chunk_size]  # noqa: E203
+
+
+def _compute_masses(formulas: pd.Series) -> pd.Series:
+    """
+    Compute the monoisotopic masses of a column of formulas with the batch mass engine.
+    Formulas that can not be parsed get NaN.
+    """  # noqa: E501
+    return pd.Series(
+        mass_engine.batch_monoisotopic_mass(formulas), index=formulas.index
     )
-    db.add(status)
-    db.commit()
+
+
+def _compute_envelopes(formulas: pd.Series) -> pd.Series:
+    """
+    Compute the packed isotope envelopes of a column of formulas (see chem_utils.IsotopeEnvelope).
+    Formulas that can not be parsed get None.
+    """  # noqa: E501
+
+    def envelope(formula: str) -> Optional[bytes]:
+        try:
+            return cu.get_isotope_envelope(formula).pack()
+        except ValueError:
+            return None
+
+    return formulas.map(envelope)
+
+
+def _compute_measured_formulas(
+    compounds: pd.Series,
+    adduct_names: pd.Series,
+    adducts: Dict[str, RegisteredAdduct],
+) -> List[Optional[Tuple[str, float]]]:
+    """
+    Compute the measured (formula, mass) for pairs of compound (formula, computed mass) and adduct
+    with the registered adducts, like the create paths in crud.
+    Every distinct pair is computed once, pairs without a compound or adduct or that fail get None,
+    which leaves the error reporting to crud.create_measured_compounds_bulk.
+    """  # noqa: E501
+    pairs = list(zip(compounds, adduct_names))
+    measured_formulas: Dict[
+        Tuple[Tuple[str, float], str], Tuple[str, float]
+    ] = {}
+    for compound, adduct_name in set(pairs):
+        adduct = adducts.get(adduct_name)
+        if not isinstance(compound, tuple) or adduct is None:
+            continue
+        try:
+            measured_formulas[(compound, adduct_name)] = (
+                adduct.measured_formula_and_mass(*compound)
+            )
+        except ValueError:
+            pass
+    return [measured_formulas.get(pair) for pair in pairs]
+
+
+def _measured_formula_chunks(
+    df: pd.DataFrame,
+    compounds: Dict[int, Tuple[str, float]],
+    adducts: Dict[str, RegisteredAdduct],
+    chunk_size: int,
+    workers: int,
+) -> Iterator[Tuple[pd.DataFrame, List[Optional[Tuple[str, float]]]]]:
+    """
+    Yield the chunks of measured compounds in order, with their measured (formula, mass).
+    With workers, a process pool computes the next chunks while the caller writes the current
+    one; at most two chunks per worker are in flight, which bounds the memory of large imports.
+    """  # noqa: E501
+    chunks = (
+        (
+            chunk,
+            chunk["compound_id"].map(compounds),
+            chunk["adduct_name"],
+        )
+        for chunk in _chunks(df, chunk_size)
+    )
+    if workers <= 0:
+        for chunk, chunk_compounds, adduct_names in chunks:
+            yield chunk, _compute_measured_formulas(
+                chunk_compounds, adduct_names, adducts
+            )
+        return
+
+    # spawned workers do not inherit the database connections of the caller
+    with ProcessPoolExecutor(
+        workers, mp_context=multiprocessing.get_context("spawn")
+    ) as executor:
+        pending: Deque[Tuple[pd.DataFrame, Future]] = deque()
+        for chunk, chunk_compounds, adduct_names in chunks:
+            pending.append(
+                (
+                    chunk,
+                    executor.submit(
+                        _compute_measured_formulas,
+                        chunk_compounds,
+                        adduct_names,
+                        adducts,
+                    ),
+                )
+            )
+            if len(pending) >= 2 * workers:
+                chunk, future = pending.popleft()
+                yield chunk, future.result()
+        while pending:
+            chunk, future = pending.popleft()
+            yield chunk, future.result()
 
 
 def populate_adducts(db: Session) -> None:
-    """Populate the Adducts table using the AdductCreate schema."""
+    """Populate the Adducts table from adducts.json with one bulk insert."""
     logging.info("Populating Adducts")
     with open(ADDUCTS_FILE) as f:
         adducts_data = json.load(f)
 
-    for adduct in adducts_data:
-        # Create an AdductCreate schema object
-        adduct_create = schemas.AdductCreate(
-            adduct_name=adduct["name"],
-            mass_adjustment=float(adduct["mass"]),
-            ion_mode=adduct["ion_mode"],
-        )
-        # Use the CRUD function to insert into the database
-        crud.create_adduct(db, adduct_create)
+    db.execute(
+        insert(models.Adduct),
+        [
+            {
+                "adduct_name": adduct["name"],
+                "mass_adjustment": float(adduct["mass"]),
+                "ion_mode": adduct["ion_mode"],
+            }
+            for adduct in adducts_data
+        ],
+    )
+    db.commit()
+    # the bulk insert bypasses crud.create_adduct, so reload the registry
+    adduct_registry.load(db)
 
 
-def populate_compounds(db: Session) -> None:
-    """Populate the Compounds table from compounds.xlsx using the CompoundCreate schema."""  # noqa: E501
+def populate_compounds(
+    db: Session, chunk_size: int = config.POPULATE_CHUNK_SIZE
+) -> None:
+    """Populate the Compounds table from compounds.xlsx in bulk inserted chunks."""  # noqa: E501
     logging.info("Populating Compounds")
-    compounds_df = pd.read_excel(COMPOUNDS_FILE)
+    started = time.perf_counter()
+    compounds_df = pd.read_excel(
+        COMPOUNDS_FILE,
+        usecols=["compound_id", "compound_name", "molecular_formula", "type"],
+    )
+    _report_rate(
+        "Compounds read", len(compounds_df), time.perf_counter() - started
+    )
 
-    for _, row in compounds_df.iterrows():
-        # Handle NaN values in the 'type' column by setting a default value (like None or "Unknown")  # noqa: E501
-        compound_type = (
-            row["type"] if pd.notna(row["type"]) else None
-        )  # Set to None if NaN, or "Unknown" as an alternative
+    compute_time = insert_time = 0.0
+    inserted = 0
+    for chunk in _chunks(compounds_df, chunk_size):
+        started = time.perf_counter()
         # we sanitize molecular formulas on import
-        molecular_formula = cu.convert_isotope_notation(
-            row["molecular_formula"]
-        )
-        # Create a CompoundCreate schema object
-        compound_create = schemas.CompoundCreate(
-            compound_id=row["compound_id"],
-            compound_name=row["compound_name"],
-            molecular_formula=molecular_formula,
-            type=compound_type,
+        formulas = chunk["molecular_formula"].map(cu.convert_isotope_notation)
+        masses = _compute_masses(formulas)
+        envelopes = _compute_envelopes(formulas)
+        valid = masses.notna() & envelopes.notna()
+        for compound_id, formula in chunk.loc[
+            ~valid, ["compound_id", "molecular_formula"]
+        ].itertuples(index=False):
+            print(
+                f"Error: Could not compute the mass of compound {compound_id}"
+                f" ({formula}). Skipping entry."
+            )
+        records = pd.DataFrame(
+            {
+                "compound_id": chunk["compound_id"][valid].astype(int),
+                "compound_name": chunk["compound_name"][valid],
+                "molecular_formula": formulas[valid],
+                # Handle NaN values in the 'type' column by setting them to None  # noqa: E501
+                "type": chunk["type"][valid].astype(object),
+                "computed_mass": masses[valid],
+                "isotope_envelope": envelopes[valid],
+            }
         )
-        # Use the CRUD function to insert into the database
-        crud.create_compound(db, compound_create)
+        records["type"] = records["type"].where(records["type"].notna(), None)
+        compute_time += time.perf_counter() - started
 
+        started = time.perf_counter()
+        if len(records):
+            db.execute(insert(models.Compound), records.to_dict("records"))
+            db.commit()
+        inserted += len(records)
+        insert_time += time.perf_counter() - started
 
-def populate_measured_compounds(db: Session) -> None:
-    """Populate the MeasuredCompounds table using the MeasuredCompoundCreate schema."""  # noqa: E501
+    _report_rate("Compounds computed", len(compounds_df), compute_time)
+    _report_rate("Compounds inserted", inserted, insert_time)
+
+
+def populate_measured_compounds(
+    db: Session,
+    chunk_size: int = config.POPULATE_CHUNK_SIZE,
+    workers: int = config.POPULATE_WORKERS,
+) -> None:
+    """
+    Populate the MeasuredCompounds table from measured-compounds.xlsx in bulk inserted chunks.
+    With workers, the measured formulas and masses are computed in a process pool (see
+    _measured_formula_chunks), the compute time is then the time spent waiting for them.
+    """  # noqa: E501
     logging.info("Populating Measured Compounds")
+    started = time.perf_counter()
     measured_compounds_df = pd.read_excel(MEASURED_COMPOUNDS_FILE)
+    _report_rate(
+        "Measured compounds read",
+        len(measured_compounds_df),
+        time.perf_counter() - started,
+    )
 
-    for _, row in measured_compounds_df.iterrows():
-        # Get the adduct_name from the file (assuming the column is present)
-        adduct_name = row.get("adduct_name")
-        retention_time = row.get("retention_time")
-        # Handle NaN values in the 'type' column by setting a default value (like None or "Unknown")  # noqa: E501
-        retention_time_comment = (
-            row["retention_time_comment"]
-            if pd.notna(row["retention_time_comment"])
-            else None
-        )  # Set to None if NaN, or "Unknown" as an alternativeion_time from input  # noqa: E501
-
-        if not adduct_name:
-            print(
-                f"Adduct name missing for compound {row['compound_name']}. Skipping entry."  # noqa: E501
-            )
-            continue
+    missing_adduct = measured_compounds_df["adduct_name"].isna()
+    for compound_name in measured_compounds_df.loc[
+        missing_adduct, "compound_name"
+    ]:
+        print(
+            f"Adduct name missing for compound {compound_name}. Skipping entry."  # noqa: E501
+        )
+    measured_compounds_df = measured_compounds_df[~missing_adduct].copy()
+    # Handle NaN values in the comment column by setting them to None
+    measured_compounds_df["retention_time_comment"] = measured_compounds_df[
+        "retention_time_comment"
+    ].astype(object)
+    measured_compounds_df.loc[
+        measured_compounds_df["retention_time_comment"].isna(),
+        "retention_time_comment",
+    ] = None
 
-        # Prepare MeasuredCompoundCreate schema using RetentionTime model
-        measured_compound_create = schemas.MeasuredCompoundCreate(
-            compound_id=row["compound_id"],
-            adduct_name=adduct_name,
-            retention_time=retention_time,
-            retention_time_comment=retention_time_comment,
+    # the compounds were populated before, so their formulas and masses are
+    # loaded once, the adducts are passed on to the process pool
+    compounds = {
+        compound_id: (molecular_formula, computed_mass)
+        for compound_id, molecular_formula, computed_mass in db.execute(
+            select(
+                models.Compound.compound_id,
+                models.Compound.molecular_formula,
+                models.Compound.computed_mass,
+            ).where(models.Compound.computed_mass.is_not(None))
         )
+    }
+    adducts = {
+        adduct_name: adduct
+        for adduct_name in measured_compounds_df["adduct_name"].unique()
+        if (adduct := adduct_registry.get(db, adduct_name)) is not None
+    }
 
-        try:
-            # Create measured compound
-            crud.create_measured_compound_and_retention_time(
-                db, measured_compound_create
-            )
-        except ValueError as e:
-            print(f"Error: {e}. Skipping entry.")
+    compute_time = insert_time = 0.0
+    inserted = 0
+    computed_chunks = _measured_formula_chunks(
+        measured_compounds_df, compounds, adducts, chunk_size, workers
+    )
+    while True:
+        started = time.perf_counter()
+        computed = next(computed_chunks, None)
+        if computed is None:
+            break
+        chunk, measured_formulas = computed
+        # Prepare MeasuredCompoundCreate schemas for the whole chunk
+        measured_compounds = [
+            schemas.MeasuredCompoundCreate.model_validate(record)
+            for record in chunk[
+                [
+                    "compound_id",
+                    "adduct_name",
+                    "retention_time",
+                    "retention_time_comment",
+                ]
+            ].to_dict("records")
+        ]
+        compute_time += time.perf_counter() - started
+
+        started = time.perf_counter()
+        results = crud.create_measured_compounds_bulk(
+            db, measured_compounds, measured_formulas=measured_formulas
+        )
+        insert_time += time.perf_counter() - started
+        for result in results:
+            if result.success:
+                inserted += 1
+            else:
+                print(f"Error: {result.error}. Skipping entry.")
+
+    _report_rate(
+        "Measured compounds computed", len(measured_compounds_df), compute_time
+    )
+    _report_rate("Measured compounds inserted", inserted, insert_time)
 
 
 def populate_data(db: Session) -> None:
     """Populate the database only if it hasn't been initialized."""
     logging.info("Populating Initial Data")
-    if not check_initialization_status(db):
+    if not crud.check_initialization_status(db):
+        started = time.perf_counter()
         # Populate Adducts
         populate_adducts(db)
 
@@ -134,8 +333,11 @@ def populate_data(db: Session) -> None:
         populate_measured_compounds(db)
 
         # set DB as initialized
-        set_initialization_status(db)
+        crud.set_initialization_status(db)
 
-        print("Initial database population completed.")
+        print(
+            "Initial database population completed in"
+            f" {time.perf_counter() - started:.2f}s."
+        )
     else:
         print("DB Already Populated")
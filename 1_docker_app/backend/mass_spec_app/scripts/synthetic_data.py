@@ -0,0 +1,176 @@
+# 2024-09 Kai-Michael Kammer
+"""
+Generator of synthetic libraries for benchmarks and load tests, scaled by the number of measured compounds.
+Compounds draw their formulas from a pool of random CHNO(S) formulas (libraries contain many isomers),
+each compound is measured with every adduct of ADDUCTS at a random retention time.
+Masses and measured formulas are computed with the same code as populate_data, rows are bulk inserted.
+"""  # noqa: E501
+import math
+import time
+from typing import Dict, List, Tuple
+
+import numpy as np
+from sqlalchemy import insert, text
+from sqlalchemy.orm import Session
+
+from mass_spec_app import config
+from mass_spec_app.db import crud, models
+from mass_spec_app.db.adduct_registry import adduct_registry
+from mass_spec_app.db.mass_index import mass_index
+from mass_spec_app.scripts import chem_utils as cu
+from mass_spec_app.scripts import mass_engine
+
+# (adduct name, ion mode) of the generated library
+ADDUCTS: Tuple[Tuple[str, str], ...] = (
+    ("M+H", "positive"),
+    ("M+Na", "positive"),
+    ("M+K", "positive"),
+    ("M+NH4", "positive"),
+    ("M-H", "negative"),
+    ("M+Cl", "negative"),
+)
+COMPOUND_TYPES = ("metabolite", "drug", "lipid", "standard")
+
+
+def random_formulas(rng: np.random.Generator, count: int) -> List[str]:
+    """Return count distinct random formulas of small organic molecules."""
+    formulas: Dict[str, None] = {}
+    while len(formulas) < count:
+        carbons = rng.integers(2, 40, count)
+        hydrogens = carbons + rng.integers(2, 30, count)
+        nitrogens = rng.integers(0, 6, count)
+        oxygens = rng.integers(1, 12, count)
+        sulfurs = rng.integers(0, 2, count)
+        for c, h, n, o, s in zip(
+            carbons, hydrogens, nitrogens, oxygens, sulfurs
+        ):
+            formula = (
+                f"C{c}H{h}"
+                + (f"N{n}" if n else "")
+                + f"O{o}"
+                + ("S" if s else "")
+            )
+            formulas[formula] = None
+    return list(formulas)[:count]
+
+
+def generate_library(
+    db: Session,
+    measured_compounds: int,
+    formulas: int = 5000,
+    seed: int = 0,
+    chunk_size: int = config.POPULATE_CHUNK_SIZE,
+) -> Dict[str, float]:
+    """
+    Fill an empty database with a synthetic library of about measured_compounds rows.
+    The adduct registry and the mass index are reloaded afterwards.
+    Returns the row counts per table and the time taken.
+    """  # noqa: E501
+    started = time.perf_counter()
+    rng = np.random.default_rng(seed)
+    compound_count = math.ceil(measured_compounds / len(ADDUCTS))
+    retention_time_count = max(1, measured_compounds // 20)
+
+    adduct_ids = db.scalars(
+        insert(models.Adduct).returning(
+            models.Adduct.adduct_id, sort_by_parameter_order=True
+        ),
+        [
+            {
+                "adduct_name": adduct_name,
+                "mass_adjustment": cu.parse_adduct(adduct_name).mass,
+                "ion_mode": ion_mode,
+            }
+            for adduct_name, ion_mode in ADDUCTS
+        ],
+    ).all()
+    # evenly spaced, so every retention time is unique
+    retention_times = np.round(np.linspace(0.5, 30.0, retention_time_count), 6)
+    retention_time_ids = db.scalars(
+        insert(models.RetentionTime).returning(
+            models.RetentionTime.retention_time_id,
+            sort_by_parameter_order=True,
+        ),
+        [
+            {"retention_time": float(rt), "comment": None}
+            for rt in retention_times
+        ],
+    ).all()
+
+    formula_pool = random_formulas(rng, min(formulas, compound_count))
+    pool_masses = mass_engine.batch_monoisotopic_mass(formula_pool)
+    # measured formula and mass of every pool formula with every adduct
+    measured = {
+        (formula, adduct_name): cu.measured_formula_and_mass(
+            formula, mass, cu.parse_adduct(adduct_name)
+        )
+        for formula, mass in zip(formula_pool, pool_masses)
+        for adduct_name, _ in ADDUCTS
+    }
+    # packed isotope envelopes of the pool and the measured formulas
+    envelopes = {
+        formula: cu.get_isotope_envelope(formula).pack()
+        for formula in {
+            *formula_pool,
+            *(formula for formula, _ in measured.values()),
+        }
+    }
+
+    compound_formulas = rng.integers(0, len(formula_pool), compound_count)
+    compound_types = rng.integers(0, len(COMPOUND_TYPES), compound_count)
+    for start in range(0, compound_count, chunk_size):
+        stop = min(start + chunk_size, compound_count)
+        db.execute(
+            insert(models.Compound),
+            [
+                {
+                    "compound_id": i + 1,
+                    "compound_name": f"Compound {i + 1}",
+                    "molecular_formula": formula_pool[compound_formulas[i]],
+                    "type": COMPOUND_TYPES[compound_types[i]],
+                    "computed_mass": float(pool_masses[compound_formulas[i]]),
+                    "isotope_envelope": envelopes[
+                        formula_pool[compound_formulas[i]]
+                    ],
+                }
+                for i in range(start, stop)
+            ],
+        )
+
+    measured_retention_times = rng.choice(
+        retention_time_ids, measured_compounds
+    )
+    for start in range(0, measured_compounds, chunk_size):
+        stop = min(start + chunk_size, measured_compounds)
+        records = []
+        for row in range(start, stop):
+            compound, adduct = divmod(row, len(ADDUCTS))
+            formula, mass = measured[
+                (formula_pool[compound_formulas[compound]], ADDUCTS[adduct][0])
+            ]
+            records.append(
+                {
+                    "compound_id": compound + 1,
+                    "adduct_id": adduct_ids[adduct],
+                    "retention_time_id": int(measured_retention_times[row]),
+                    "measured_mass": mass,
+                    "molecular_formula": formula,
+                    "isotope_envelope": envelopes[formula],
+                }
+            )
+        db.execute(insert(models.MeasuredCompound), records)
+    crud.insert_search_rows(db)
+    db.commit()
+    # fresh statistics, like a library that autovacuum has seen
+    db.execute(text("ANALYZE"))
+    db.commit()
+
+    adduct_registry.load(db)
+    mass_index.build(db)
+    return {
+        "adducts": len(adduct_ids),
+        "retention_times": len(retention_times),
+        "compounds": compound_count,
+        "measured_compounds": measured_compounds,
+        "seconds": time.perf_counter() - started,
+    }
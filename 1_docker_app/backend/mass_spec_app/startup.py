@@ -0,0 +1,46 @@
+# 2024-09 Kai-Michael Kammer
+"""
+Startup time report of a worker, broken into phases: importing the app, checking whether the
+database is initialized, populating it (first start only), loading the adduct registry and
+building the mass index. It is printed once the worker is ready to serve requests.
+With gunicorn's preload_app the master imports the app once, forked workers only run the rest.
+"""  # noqa: E501
+import time
+from contextlib import contextmanager
+from typing import Dict, Iterator
+
+from mass_spec_app import IMPORT_STARTED
+
+
+class StartupReport:
+    def __init__(self, started: float) -> None:
+        self.started = started
+        # seconds per phase, in the order they ran
+        self.phases: Dict[str, float] = {}
+
+    def record(self, name: str, started: float) -> None:
+        """Record a phase that started at the given perf_counter time."""
+        self.phases[name] = time.perf_counter() - started
+
+    @contextmanager
+    def phase(self, name: str) -> Iterator[None]:
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.record(name, started)
+
+    def forked(self) -> None:
+        """Reset the report in a worker forked from a master that imported the app."""  # noqa: E501
+        self.started = time.perf_counter()
+        self.phases.clear()
+
+    def summary(self) -> str:
+        phases = ", ".join(
+            f"{name} {seconds:.3f}s" for name, seconds in self.phases.items()
+        )
+        total = time.perf_counter() - self.started
+        return f"Startup completed in {total:.3f}s ({phases})"
+
+
+startup_report = StartupReport(IMPORT_STARTED)
@@ -6,7 +6,7 @@ setup(
     author="Kai Kammer",
     python_requires=">=3.12",
     author_email="kaikammer@mailbox.org",
-    packages=find_packages(),
+    packages=find_packages(exclude=["benchmarks", "benchmarks.*"]),
     install_requires=[
         "Jinja2==3.0.3",
         "SQLAlchemy==2.0.35",
@@ -26,6 +26,8 @@ setup(
         "uvicorn==0.30.6",
         "gunicorn==23.0.0",
         "fastapi==0.115.0",
+        "prometheus-client==0.21.0",
+        "python-multipart==0.0.12",
     ],
     extras_require={
         "dev": [
@@ -1,13 +1,30 @@
+import asyncio
+import csv
+import io
+import json
+import os
+import pstats
+import time
+
+import pandas as pd
 import pytest
 from fastapi.testclient import TestClient
 from sqlalchemy import create_engine
+from sqlalchemy.ext.asyncio import async_sessionmaker, create_async_engine
 from sqlalchemy.orm import sessionmaker
+from sqlalchemy.pool import NullPool
 from sqlalchemy_utils import create_database, database_exists, drop_database
 
-from mass_spec_app import config
+from mass_spec_app import config, jobs
+from mass_spec_app.api import schemas
+from mass_spec_app.api.response_cache import response_cache
 from mass_spec_app.app import app
+from mass_spec_app.db import crud
+from mass_spec_app.db.mass_index import mass_index
 from mass_spec_app.db.models import Base
-from mass_spec_app.db.session import get_db
+from mass_spec_app.db.query_counter import QueryCounter
+from mass_spec_app.db.session import get_async_db, get_db
+from mass_spec_app.profiling import capture_statements, profile_store
 
 # Setup test database connection
 engine = create_engine(config.DATABASE_URL_TEST)
@@ -17,6 +34,16 @@ if not database_exists(engine.url):
 TestingSessionLocal = sessionmaker(
     autocommit=False, autoflush=False, bind=engine
 )
+Base.metadata.create_all(bind=engine)
+# the TestClient runs every request in a new event loop, so connections
+# of the async engine must not be pooled across requests
+async_engine = create_async_engine(
+    config.DATABASE_URL_TEST, poolclass=NullPool
+)
+capture_statements(async_engine.sync_engine)
+TestingAsyncSessionLocal = async_sessionmaker(
+    bind=async_engine, autoflush=False, expire_on_commit=False
+)
 
 
 # Dependency override
@@ -29,7 +56,13 @@ def override_get_db():
         db.close()
 
 
+async def override_get_async_db():
+    async with TestingAsyncSessionLocal() as db:
+        yield db
+
+
 app.dependency_overrides[get_db] = override_get_db
+app.dependency_overrides[get_async_db] = override_get_async_db
 client = TestClient(app)
 
 
@@ -56,6 +89,341 @@ def test_create_compound():
     assert response.json()["compound_name"] == "Water"
 
 
+def test_search_measured_compounds_by_mass(monkeypatch):
+    """Test GET /measured-compounds/search-mass with a ppm window."""
+    db = next(override_get_db())
+    crud.create_adduct(
+        db,
+        schemas.AdductCreate(
+            adduct_name="M+H", mass_adjustment=1.007276, ion_mode="positive"
+        ),
+    )
+    db.close()
+    client.post(
+        "/compounds/",
+        json={
+            "compound_id": 100,
+            "compound_name": "Caffeine",
+            "molecular_formula": "C8H10N4O2",
+        },
+    )
+    # the CPU bound steps of the create run in the threadpool
+    calls = []
+
+    def record_event_loop(function):
+        def wrapper(*args, **kwargs):
+            try:
+                asyncio.get_running_loop()
+                calls.append((function.__name__, "event loop"))
+            except RuntimeError:
+                calls.append((function.__name__, "threadpool"))
+            return function(*args, **kwargs)
+
+        return wrapper
+
+    monkeypatch.setattr(
+        crud,
+        "compute_measured_compound",
+        record_event_loop(crud.compute_measured_compound),
+    )
+    monkeypatch.setattr(mass_index, "add", record_event_loop(mass_index.add))
+    created = client.post(
+        "/measured-compounds/",
+        json={"compound_id": 100, "retention_time": 2.5, "adduct_name": "M+H"},
+    ).json()
+    assert calls == [
+        ("compute_measured_compound", "threadpool"),
+        ("add", "threadpool"),
+    ]
+    monkeypatch.undo()
+
+    response = client.get(
+        "/measured-compounds/search-mass",
+        params={"mz": created["measured_mass"], "ppm": 5},
+    )
+    assert response.status_code == 200
+    assert [m["measured_compound_id"] for m in response.json()] == [
+        created["measured_compound_id"]
+    ]
+
+    response = client.post(
+        "/measured-compounds/",
+        json={"compound_id": 100, "retention_time": 2.5, "adduct_name": "M+H"},
+    )
+    assert response.status_code == 409
+
+    response = client.get(
+        "/measured-compounds/search-mass", params={"mz": 1.0, "ppm": 5}
+    )
+    assert response.json() == []
+
+    response = client.get(
+        "/measured-compounds/search-mass", params={"mz": -1.0, "ppm": 5}
+    )
+    assert response.status_code == 400
+
+
+def test_annotate_peaks():
+    """Test POST /measured-compounds/annotate with a small peak list."""
+    created = next(
+        m
+        for m in client.get(
+            "/measured-compounds/", params={"limit": 1000}
+        ).json()
+        if m["compound"]["compound_id"] == 100
+    )
+    mz = created["measured_mass"]
+    response = client.post(
+        "/measured-compounds/annotate",
+        json={
+            "peaks": [
+                {"mz": mz, "rt": 2.55, "ion_mode": "positive"},
+                {"mz": mz, "rt": 9.0},
+                {"mz": 1.0},
+            ],
+            "ppm": 5,
+            "rt_tol": 0.1,
+        },
+    )
+    assert response.status_code == 200
+    matches = response.json()
+    assert [m["peak_index"] for m in matches] == [0]
+    assert matches[0]["measured_compound_id"] == (
+        created["measured_compound_id"]
+    )
+    assert matches[0]["mass_error_ppm"] == 0
+
+    response = client.post(
+        "/measured-compounds/annotate",
+        json={"peaks": [{"mz": mz}], "ppm": -1},
+    )
+    assert response.status_code == 400
+
+
+def test_score_isotope_patterns():
+    """Test POST /measured-compounds/score-isotopes against the stored envelopes."""  # noqa: E501
+    created = next(
+        m
+        for m in client.get(
+            "/measured-compounds/", params={"limit": 1000}
+        ).json()
+        if m["compound"]["compound_id"] == 100
+    )
+    envelope = client.get(
+        "/tools/isotope-envelope/",
+        params={"molecular_formula": created["molecular_formula"]},
+    ).json()
+    assert envelope["masses"][0] == pytest.approx(created["measured_mass"])
+    assert max(envelope["abundances"]) == 1.0
+
+    # the expected pattern, one with a wrong M+1 peak and one without match
+    mzs = envelope["masses"][:3]
+    response = client.post(
+        "/measured-compounds/score-isotopes",
+        json={
+            "patterns": [
+                {
+                    "mzs": mzs,
+                    "intensities": [
+                        1e5 * a for a in envelope["abundances"][:3]
+                    ],
+                },
+                {"mzs": mzs[:2], "intensities": [1e5, 9e5]},
+                {"mzs": [1.0], "intensities": [1.0]},
+            ],
+            "ppm": 5,
+        },
+    )
+    assert response.status_code == 200
+    scores = response.json()
+    assert [s["pattern_index"] for s in scores] == [0, 1]
+    assert scores[0]["measured_compound_id"] == (
+        created["measured_compound_id"]
+    )
+    assert scores[0]["score"] == pytest.approx(1.0, abs=1e-6)
+    assert scores[0]["matched_peaks"] == 3
+    assert scores[1]["score"] < 0.5
+    assert scores[1]["matched_peaks"] == 2
+
+    response = client.post(
+        "/measured-compounds/score-isotopes",
+        json={"patterns": [{"mzs": mzs, "intensities": [1.0]}]},
+    )
+    assert response.status_code == 400
+
+
+def test_measured_compounds_query_count():
+    """Test that the query count of the measured-compound reads is fixed."""
+    client.post(
+        "/compounds/",
+        json={
+            "compound_id": 101,
+            "compound_name": "Theophylline",
+            "molecular_formula": "C7H8N4O2",
+            "type": "drug",
+        },
+    )
+    db = next(override_get_db())
+    crud.create_adduct(
+        db,
+        schemas.AdductCreate(
+            adduct_name="M+Na", mass_adjustment=22.989218, ion_mode="positive"
+        ),
+    )
+    db.close()
+    client.post(
+        "/measured-compounds/bulk",
+        json=[
+            {"compound_id": 101, "retention_time": rt, "adduct_name": "M+Na"}
+            for rt in (1.1, 1.2, 1.3, 1.4, 1.5)
+        ],
+    )
+
+    for url in ["/measured-compounds/", "/measured-compounds_filtered/"]:
+        counts = []
+        for limit in (1, 5):
+            with QueryCounter(async_engine.sync_engine) as counter:
+                response = client.get(url, params={"limit": limit})
+            assert len(response.json()) == limit
+            counts.append(counter.count)
+        assert counts[0] == counts[1], url
+
+
+def test_keyset_pagination():
+    """Test walking the measured compounds page by page with the cursor."""
+    all_ids = [
+        m["measured_compound_id"]
+        for m in client.get(
+            "/measured-compounds/", params={"limit": 1000}
+        ).json()
+    ]
+    assert all_ids == sorted(all_ids)
+
+    walked_ids = []
+    params = {"limit": 2}
+    while True:
+        response = client.get("/measured-compounds/", params=params)
+        walked_ids += [m["measured_compound_id"] for m in response.json()]
+        if "X-Next-Cursor" not in response.headers:
+            break
+        params["cursor"] = response.headers["X-Next-Cursor"]
+    assert walked_ids == all_ids
+
+    response = client.get("/compounds/", params={"cursor": "not-a-cursor"})
+    assert response.status_code == 400
+
+
+def test_export_measured_compounds():
+    """Test streaming the measured compounds as NDJSON and CSV."""
+    expected = client.get(
+        "/measured-compounds/", params={"limit": 1000}
+    ).json()
+
+    response = client.get("/measured-compounds/export")
+    assert response.status_code == 200
+    assert response.headers["content-type"] == "application/x-ndjson"
+    rows = [json.loads(line) for line in response.text.splitlines()]
+    assert [r["measured_compound_id"] for r in rows] == [
+        m["measured_compound_id"] for m in expected
+    ]
+    assert rows[0]["compound_name"] == expected[0]["compound"]["compound_name"]
+
+    response = client.get(
+        "/measured-compounds/export",
+        params={"format": "csv", "compound_type": "drug"},
+    )
+    assert response.headers["content-type"].startswith("text/csv")
+    rows = list(csv.DictReader(io.StringIO(response.text)))
+    assert rows
+    assert {r["compound_type"] for r in rows} == {"drug"}
+
+    response = client.get(
+        "/measured-compounds/export", params={"retention_time": -1}
+    )
+    assert response.status_code == 400
+
+
+def test_retention_time_window():
+    """Test filtering measured compounds by a retention time window."""
+    response = client.get(
+        "/measured-compounds_filtered/",
+        params={"rt_min": 1.15, "rt_max": 1.35, "ion_mode": "positive"},
+    )
+    assert response.status_code == 200
+    assert sorted(
+        m["retention_time"]["retention_time"] for m in response.json()
+    ) == [1.2, 1.3]
+
+    response = client.get(
+        "/measured-compounds_filtered/",
+        params={
+            "retention_time": 1.2,
+            "rt_tol": 0.05,
+            "compound_type": "drug",
+        },
+    )
+    assert [
+        m["retention_time"]["retention_time"] for m in response.json()
+    ] == [1.2]
+
+    response = client.get(
+        "/measured-compounds/export", params={"rt_min": 1.15, "rt_max": 1.35}
+    )
+    assert len(response.text.splitlines()) == 2
+
+    response = client.get(
+        "/measured-compounds_filtered/", params={"rt_min": 2, "rt_max": 1}
+    )
+    assert response.status_code == 400
+
+
+def test_response_cache_and_etag(monkeypatch):
+    """Test cached GET responses, ETag/If-None-Match and invalidation."""
+    response = client.get("/compounds/", params={"limit": 1000})
+    etag = response.headers["etag"]
+    with QueryCounter(async_engine.sync_engine) as counter:
+        cached = client.get("/compounds/", params={"limit": 1000})
+    assert counter.count == 0
+    assert cached.json() == response.json()
+    assert cached.headers["etag"] == etag
+
+    response = client.get(
+        "/compounds/", params={"limit": 1000}, headers={"If-None-Match": etag}
+    )
+    assert response.status_code == 304
+    assert response.content == b""
+
+    # creating a compound invalidates the cached compound pages
+    client.post(
+        "/compounds/",
+        json={
+            "compound_id": 102,
+            "compound_name": "Paraxanthine",
+            "molecular_formula": "C7H8N4O2",
+        },
+    )
+    response = client.get(
+        "/compounds/", params={"limit": 1000}, headers={"If-None-Match": etag}
+    )
+    assert response.status_code == 200
+    assert response.headers["etag"] != etag
+    assert 102 in [c["compound_id"] for c in response.json()]
+
+    # errors are not cached and have no ETag
+    response = client.get("/compounds/999999")
+    assert response.status_code == 404
+    assert "etag" not in response.headers
+
+    # large responses are streamed through, uncached and without an ETag
+    monkeypatch.setattr(response_cache, "max_body", 10)
+    too_large = response_cache.stats()["too_large"]
+    response = client.get("/compounds/", params={"limit": 999})
+    assert response.status_code == 200
+    assert 102 in [c["compound_id"] for c in response.json()]
+    assert "etag" not in response.headers
+    assert response_cache.stats()["too_large"] == too_large + 1
+
+
 @pytest.fixture(scope="session", autouse=True)
 def cleanup(request):
     def __cleanup():
@@ -64,3 +432,218 @@ def cleanup(request):
             print("remove test db")
 
     request.addfinalizer(__cleanup)
+
+
+@pytest.fixture
+def job_runner(tmp_path, monkeypatch):
+    """Run the jobs submitted by the routes on the test database."""
+    monkeypatch.setattr(config, "JOB_DIR", str(tmp_path))
+    jobs.job_runner.start(TestingSessionLocal)
+    yield jobs.job_runner
+    jobs.job_runner.stop()
+
+
+def wait_for_job(job_id, timeout=10):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        job = client.get(f"/jobs/{job_id}").json()
+        if job["status"] not in ("queued", "running"):
+            return job
+        time.sleep(0.02)
+    raise TimeoutError(f"job {job_id} did not finish")
+
+
+def test_upload_imports(job_runner):
+    """Test importing compounds from csv and measured compounds from xlsx."""
+    compounds_csv = (
+        "compound_id,compound_name,molecular_formula,type\n"
+        "900,Glucose,C6H12O6,sugar\n"
+        "901,Labelled,C21H25[2]H3O4,\n"
+        "902,Broken,Xx2,\n"
+        "100,Caffeine,C8H10N4O2,\n"
+        "x,Invalid,H2O,\n"
+    )
+    response = client.post(
+        "/compounds/upload",
+        files={"file": ("compounds.csv", compounds_csv, "text/csv")},
+    )
+    assert response.status_code == 202
+    assert response.json()["kind"] == "import_compounds"
+    job = wait_for_job(response.json()["job_id"])
+    assert job["status"] == "completed"
+    progress = job["progress"]
+    assert (progress["rows_read"], progress["inserted"]) == (5, 2)
+    assert progress["rejected"] == 3
+    errors = progress["errors"]
+    assert errors[0].startswith("Row 6: compound_id")
+    assert errors[1].startswith("Row 4: Could not compute the mass")
+    assert errors[2] == "Row 5: Compound 100 already exists"
+    assert client.get("/compounds/901").json()["molecular_formula"] == (
+        "C21H25[2H3]O4"
+    )
+
+    measured_xlsx = io.BytesIO()
+    pd.DataFrame(
+        {
+            "compound_id": [900, 901, 999],
+            "adduct_name": ["M+H", None, "M+H"],
+            "retention_time": [7.5, 7.5, 8.0],
+        }
+    ).to_excel(measured_xlsx, index=False)
+    response = client.post(
+        "/measured-compounds/upload",
+        files={"file": ("measured.xlsx", measured_xlsx.getvalue())},
+    )
+    job = wait_for_job(response.json()["job_id"])
+    assert job["result"] == job["progress"]
+    assert (job["result"]["rows_read"], job["result"]["inserted"]) == (3, 1)
+    assert job["result"]["rejected"] == 2
+    assert any(
+        "Compound '999' not found" in e for e in job["result"]["errors"]
+    )
+    assert any(
+        m["compound"]["compound_id"] == 900
+        for m in client.get(
+            "/measured-compounds/", params={"limit": 1000}
+        ).json()
+    )
+    # the uploads are removed once imported
+    assert not os.listdir(config.JOB_DIR)
+
+    response = client.post(
+        "/compounds/upload", files={"file": ("compounds.json", b"[]")}
+    )
+    assert response.status_code == 400
+
+
+def test_jobs(job_runner, monkeypatch):
+    """Test the export and recompute jobs, results and cancellation."""
+    job = client.post("/jobs/export", params={"format": "csv"}).json()
+    assert job["status"] == "queued"
+    job = wait_for_job(job["job_id"])
+    assert job["status"] == "completed"
+    response = client.get(f"/jobs/{job['job_id']}/result")
+    assert response.status_code == 200
+    rows = list(csv.DictReader(io.StringIO(response.text)))
+    assert len(rows) == job["result"]["rows"] > 0
+    # the export file is deleted after the retention
+    assert jobs.remove_expired_files(config.JOB_DIR, retention=-1) == 1
+    response = client.get(f"/jobs/{job['job_id']}/result")
+    assert response.status_code == 410
+
+    job = wait_for_job(client.post("/jobs/recompute-masses").json()["job_id"])
+    assert job["status"] == "completed"
+    assert job["result"]["measured_compounds"] == len(rows)
+    assert client.get(f"/jobs/{job['job_id']}/result").json() == (
+        job["result"]
+    )
+    assert client.get("/jobs/", params={"status": "completed"}).json()
+
+    # the next search rebuilds the mass index with the recomputed masses
+    monkeypatch.setattr(config, "MASS_INDEX_GENERATION_INTERVAL", 0)
+    response = client.get(
+        "/measured-compounds/search-mass",
+        params={"mz": float(rows[0]["measured_mass"]), "ppm": 1},
+    )
+    assert response.status_code == 200
+    assert mass_index._generation is not None
+
+    assert client.post("/jobs/export", params={"rt_min": -1}).status_code == (
+        400
+    )
+    assert client.get(f"/jobs/{'0' * 32}").status_code == 404
+
+    # a queued job is cancelled at once
+    job_runner.stop()
+    job = client.post("/jobs/recompute-masses").json()
+    job = client.post(f"/jobs/{job['job_id']}/cancel").json()
+    assert job["status"] == "cancelled"
+    response = client.get(f"/jobs/{job['job_id']}/result")
+    assert response.status_code == 409
+
+
+def test_pool_metrics():
+    """Test GET /admin/pool-metrics/ for both engines."""
+    response = client.get("/admin/pool-metrics/")
+    assert response.status_code == 200
+    for engine_metrics in response.json().values():
+        assert engine_metrics["size"] == config.DB_POOL_SIZE
+        assert "checkout_ms_mean" in engine_metrics
+        assert "connection_errors" in engine_metrics
+
+
+def test_metrics():
+    """Test GET /metrics in the Prometheus text format."""
+    client.get("/compounds/")
+    response = client.get("/metrics")
+    assert response.status_code == 200
+    assert response.headers["content-type"].startswith("text/plain")
+    lines = response.text.splitlines()
+    assert any(
+        line.startswith("http_request_duration_seconds_count")
+        and 'route="/compounds/"' in line
+        for line in lines
+    )
+    assert 'http_requests_in_progress{method="GET",route="/metrics"} 1.0' in (
+        lines
+    )
+    assert any(line.startswith("db_pool_checkouts_total") for line in lines)
+
+
+def test_profile_request(monkeypatch, tmp_path):
+    """Test profiling a request flagged with the admin token."""
+    monkeypatch.setattr(config, "ADMIN_TOKEN", "secret")
+    monkeypatch.setattr(profile_store, "directory", str(tmp_path))
+    admin = {"X-Admin-Token": "secret"}
+
+    # unflagged or without the token the request is not profiled
+    assert "x-profile-id" not in client.get("/compounds/").headers
+    response = client.get("/compounds/?profile=1")
+    assert "x-profile-id" not in response.headers
+    assert client.get("/admin/profiles/").status_code == 403
+
+    response = client.get("/compounds/?profile=1", headers=admin)
+    assert response.status_code == 200
+    profile_id = response.headers["x-profile-id"]
+    response = client.get("/compounds/", headers={**admin, "X-Profile": "1"})
+    assert response.headers["x-profile-id"] != profile_id
+
+    profiles = client.get("/admin/profiles/", headers=admin).json()
+    assert len(profiles) == 2
+    profile = client.get(f"/admin/profiles/{profile_id}", headers=admin).json()
+    assert profile["path"] == "/compounds/"
+    assert profile["status"] == 200
+    assert any(
+        s["statement"].lstrip().startswith("SELECT")
+        for s in profile["statements"]
+    )
+    assert profile["functions"]
+    response = client.get(
+        f"/admin/profiles/{profile_id}/pstats", headers=admin
+    )
+    assert response.status_code == 200
+    assert response.content
+    response = client.get(f"/admin/profiles/{'0' * 32}", headers=admin)
+    assert response.status_code == 404
+
+
+def test_profile_sync_route(monkeypatch, tmp_path):
+    """Test that the threadpool call of a sync route is in its profile."""
+    monkeypatch.setattr(config, "ADMIN_TOKEN", "secret")
+    monkeypatch.setattr(profile_store, "directory", str(tmp_path))
+    response = client.get(
+        "/tools/monoisotopic-mass/?molecular_formula=C6H12O6&profile=1",
+        headers={"X-Admin-Token": "secret"},
+    )
+    assert response.status_code == 200
+    profile_id = response.headers["x-profile-id"]
+    stats = pstats.Stats(profile_store.stats_path(profile_id))
+    assert any(
+        name == "get_mono_isotopic_mass" and filename.endswith("routes.py")
+        for filename, _, name in stats.stats
+    )
+
+
+def test_profiles_disabled():
+    """Test that the profile routes are hidden without an admin token."""
+    assert client.get("/admin/profiles/").status_code == 404
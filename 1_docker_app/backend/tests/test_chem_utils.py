@@ -1,9 +1,18 @@
 import pytest
+from molmass import Formula
 
 from mass_spec_app.scripts.chem_utils import (
+    IsotopeEnvelope,
+    LRUCache,
+    _caches,
+    clear_caches,
     convert_isotope_notation,
+    get_cache_stats,
+    get_isotope_envelope,
     get_measured_formula,
     get_monoisotopic_mass,
+    measured_formula_and_mass,
+    parse_adduct,
 )
 
 
@@ -33,3 +42,121 @@ def test_get_measured_formula():
         molecular_formula=input_formula, adduct_name=input_adduct
     )
     assert expected_formula == output_formula
+
+
+def test_lru_cache():
+    """Test eviction and counters of the bounded LRU cache."""
+    cache = LRUCache(maxsize=2)
+    assert cache.get_or_compute("a", lambda: 1) == 1
+    assert cache.get_or_compute("b", lambda: 2) == 2
+    # hit on "a" makes "b" the least recently used entry
+    assert cache.get_or_compute("a", lambda: 0) == 1
+    assert cache.get_or_compute("c", lambda: 3) == 3
+    assert cache.get_or_compute("b", lambda: 4) == 4
+
+    stats = cache.stats()
+    assert stats["hits"] == 1
+    assert stats["misses"] == 4
+    assert stats["evictions"] == 2
+    assert stats["size"] == 2
+
+
+def test_formula_caches():
+    """Test that repeated formulas are served from the caches."""
+    clear_caches()
+    first = get_monoisotopic_mass("C8H10N4O2")
+    assert get_monoisotopic_mass("C8H10N4O2") == first
+    get_measured_formula(molecular_formula="C8H10N4O2", adduct_name="M+H")
+    get_measured_formula(molecular_formula="C8H10N4O2", adduct_name="M+H")
+
+    stats = get_cache_stats()
+    assert stats["monoisotopic_mass"]["hits"] == 1
+    assert stats["monoisotopic_mass"]["misses"] == 1
+    assert stats["measured_formula"]["hits"] == 1
+    # invalid formulas are not cached
+    with pytest.raises(ValueError):
+        get_monoisotopic_mass("Xx2")
+    assert get_cache_stats()["monoisotopic_mass"]["size"] == 1
+
+
+@pytest.mark.parametrize(
+    "adduct_name, expected_formula",
+    [
+        ("M+H", "C8H11N4O2"),
+        ("M-H", "C8H9N4O2"),
+        ("M+Na", "C8H10N4NaO2"),
+        ("M+NH4", "C8H14N5O2"),
+        ("M+2H", "C8H12N4O2"),
+        ("M+H-H2O", "C8H9N4O"),
+    ],
+)
+def test_parse_adduct(adduct_name, expected_formula):
+    """Test measured formulas and masses from parsed adducts."""
+    delta = parse_adduct(adduct_name)
+    formula, mass = measured_formula_and_mass(
+        "C8H10N4O2", get_monoisotopic_mass("C8H10N4O2"), delta
+    )
+    assert formula == expected_formula
+    assert get_measured_formula("C8H10N4O2", adduct_name) == expected_formula
+    assert pytest.approx(mass, abs=1e-9) == get_monoisotopic_mass(formula)
+
+
+def test_parse_adduct_errors():
+    """Test invalid adduct names and impossible adducts."""
+    for adduct_name in ["MH", "M+", "M+Xx", "H+M"]:
+        with pytest.raises(ValueError):
+            parse_adduct(adduct_name)
+    with pytest.raises(ValueError):
+        get_measured_formula("CH4", "M-Na")
+
+
+def test_parse_adduct_cache(monkeypatch):
+    """Test that parsed adducts are kept in a bounded cache."""
+    clear_caches()
+    monkeypatch.setattr(_caches["adduct_delta"], "maxsize", 2)
+    for adduct_name in ["M+H", "M+Na", "M+K", "M+H", "M+Xx"]:
+        try:
+            parse_adduct(adduct_name)
+        except ValueError:
+            pass
+    stats = get_cache_stats()["adduct_delta"]
+    assert stats["size"] == 2
+    assert stats["evictions"] == 2
+    assert stats["errors"] == 1
+
+
+@pytest.mark.parametrize(
+    "molecular_formula",
+    ["C8H10N4O2", "C21H26Cl2O4", "C21H25[2]H3O4", "C6H12O6Na", "CFe2O", "H2"],
+)
+def test_get_isotope_envelope(molecular_formula):
+    """Test isotope envelopes against the spectrum of molmass."""
+    formula = Formula(convert_isotope_notation(molecular_formula))
+    spectrum = dict(formula.spectrum().items())
+    peaks = [spectrum.get(formula.isotope.massnumber + i) for i in range(4)]
+    most_abundant = max(peak.fraction for peak in peaks if peak)
+
+    envelope = get_isotope_envelope(molecular_formula)
+    assert len(envelope.offsets) == len(envelope.abundances) == 4
+    for peak, offset, abundance in zip(
+        peaks, envelope.offsets, envelope.abundances
+    ):
+        if peak is None:
+            assert abundance == 0
+            continue
+        # lighter isotopes (54Fe) are left out, which shifts iron compounds a little  # noqa: E501
+        assert offset == pytest.approx(
+            peak.mass - formula.isotope.mass, abs=1e-5
+        )
+        assert abundance == pytest.approx(
+            peak.fraction / most_abundant, rel=1e-3
+        )
+
+    # packed as float32, 8 bytes per peak
+    unpacked = IsotopeEnvelope.unpack(envelope.pack())
+    assert len(envelope.pack()) == 32
+    assert unpacked.offsets == pytest.approx(envelope.offsets, abs=1e-6)
+    assert unpacked.abundances == pytest.approx(envelope.abundances)
+
+    with pytest.raises(ValueError):
+        get_isotope_envelope("C2Xx")
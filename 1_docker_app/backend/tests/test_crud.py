@@ -1,15 +1,37 @@
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timezone
+
 import pytest
-from sqlalchemy import create_engine
+from sqlalchemy import create_engine, insert, text, update
 from sqlalchemy.orm import sessionmaker
 from sqlalchemy_utils import create_database, database_exists, drop_database
 
+from mass_spec_app import config
 from mass_spec_app.api import schemas
 from mass_spec_app.config import DATABASE_URL_TEST
+from mass_spec_app.db import crud
+from mass_spec_app.db.adduct_registry import AdductRegistry
 from mass_spec_app.db.crud import (
+    create_adduct,
     create_compound,
+    create_measured_compound_and_retention_time,
+    create_measured_compounds_bulk,
     get_measured_compounds_filtered,
+    get_or_create_retention_time,
+    select_measured_compound_ids,
+    select_measured_compounds_flat,
+)
+from mass_spec_app.db.mass_index import mass_index
+from mass_spec_app.db.models import (
+    Adduct,
+    Base,
+    Job,
+    MeasuredCompound,
+    MeasuredCompoundSearch,
+    RetentionTime,
 )
-from mass_spec_app.db.models import Base
+from mass_spec_app.scripts.chem_utils import get_monoisotopic_mass
 
 engine = create_engine(DATABASE_URL_TEST)
 if not database_exists(engine.url):
@@ -52,6 +74,427 @@ def test_get_measured_compounds_filtered(db_session):
     assert isinstance(compounds, list)
 
 
+def test_create_measured_compounds_bulk(db_session):
+    """Test bulk creation of measured compounds with a per-row report."""
+    create_adduct(
+        db_session,
+        schemas.AdductCreate(
+            adduct_name="M+H", mass_adjustment=1.007276, ion_mode="positive"
+        ),
+    )
+    create_compound(
+        db_session,
+        schemas.CompoundCreate(
+            compound_id=1,
+            compound_name="Caffeine",
+            molecular_formula="C8H10N4O2",
+        ),
+    )
+    rows = [
+        {"compound_id": 1, "retention_time": 2.5, "adduct_name": "M+H"},
+        {"compound_id": 1, "retention_time": 3.5, "adduct_name": "M+H"},
+        # duplicate of the first row
+        {"compound_id": 1, "retention_time": 2.5, "adduct_name": "M+H"},
+        {"compound_id": 1, "retention_time": 2.5, "adduct_name": "M+K"},
+        {"compound_id": 2, "retention_time": 2.5, "adduct_name": "M+H"},
+    ]
+    results = create_measured_compounds_bulk(
+        db_session, [schemas.MeasuredCompoundCreate(**row) for row in rows]
+    )
+
+    assert [r.index for r in results] == [0, 1, 2, 3, 4]
+    assert [r.success for r in results] == [True, True, False, False, False]
+    assert "already exists" in results[2].error
+    assert "Adduct 'M+K'" in results[3].error
+    assert "Compound '2'" in results[4].error
+    assert db_session.query(MeasuredCompound).count() == 2
+    assert db_session.query(RetentionTime).count() == 2
+
+    # retention times are reused on the next batch
+    results = create_measured_compounds_bulk(
+        db_session, [schemas.MeasuredCompoundCreate(**rows[1])]
+    )
+    assert not results[0].success
+    assert db_session.query(RetentionTime).count() == 2
+
+
+def test_create_measured_compounds_bulk_chunked(db_session, monkeypatch):
+    """Test that the bulk lookups and upserts work across several chunks."""
+    monkeypatch.setattr(crud, "BULK_PARAMETER_CHUNK_SIZE", 2)
+    create_adduct(
+        db_session,
+        schemas.AdductCreate(
+            adduct_name="M+H", mass_adjustment=1.007276, ion_mode="positive"
+        ),
+    )
+    create_compound(
+        db_session,
+        schemas.CompoundCreate(
+            compound_id=1,
+            compound_name="Caffeine",
+            molecular_formula="C8H10N4O2",
+        ),
+    )
+    rows = [
+        schemas.MeasuredCompoundCreate(
+            compound_id=1, retention_time=1.0 + i, adduct_name="M+H"
+        )
+        for i in range(5)
+    ]
+    results = create_measured_compounds_bulk(db_session, rows[:3])
+    assert all(r.success for r in results)
+
+    results = create_measured_compounds_bulk(db_session, rows)
+    assert [r.success for r in results] == [False] * 3 + [True] * 2
+    assert db_session.query(MeasuredCompound).count() == 5
+    assert db_session.query(MeasuredCompoundSearch).count() == 5
+
+
+def test_adduct_registry_reload_interval(db_session, monkeypatch):
+    """Test that unknown adduct names reload the registry at most once per interval."""  # noqa: E501
+    registry = AdductRegistry()
+    registry.load(db_session)
+    loads = []
+    load = registry.load
+
+    def counted_load(db):
+        loads.append(db)
+        load(db)
+
+    monkeypatch.setattr(registry, "load", counted_load)
+    # created by another worker, so not registered here
+    db_session.add(
+        Adduct(
+            adduct_name="M+Na", mass_adjustment=22.989218, ion_mode="positive"
+        )
+    )
+    db_session.commit()
+
+    for adduct_name in ["M+Na", "M+Xx", "M+Yy"]:
+        assert registry.get(db_session, adduct_name) is None
+    assert loads == []
+
+    monkeypatch.setattr(config, "ADDUCT_RELOAD_INTERVAL", 0)
+    assert registry.get(db_session, "M+Na").adduct_name == "M+Na"
+    assert len(loads) == 1
+
+
+def test_retention_time_window_uses_index(db_session):
+    """Test that a retention time window is an index range scan."""
+    # with a handful of rows a sequential scan is cheaper, so disable it
+    db_session.execute(text("SET LOCAL enable_seqscan = off"))
+    statement = select_measured_compounds_flat(retention_time=2.5, rt_tol=0.1)
+    sql = statement.compile(engine, compile_kwargs={"literal_binds": True})
+    plan = "\n".join(db_session.execute(text(f"EXPLAIN {sql}")).scalars())
+    assert "ix_retention_times_retention_time" in plan
+    assert "ix_measured_compounds_retention_time_id" in plan
+
+    with pytest.raises(ValueError):
+        get_measured_compounds_filtered(db_session, rt_min=2.0, rt_max=1.0)
+    with pytest.raises(ValueError):
+        get_measured_compounds_filtered(db_session, retention_time=-1.0)
+
+
+def test_create_measured_compound_with_registered_adduct(db_session):
+    """Test measured compounds with multi-atom adducts from the registry."""
+    create_adduct(
+        db_session,
+        schemas.AdductCreate(
+            adduct_name="M+NH4", mass_adjustment=18.033823, ion_mode="positive"
+        ),
+    )
+    create_compound(
+        db_session,
+        schemas.CompoundCreate(
+            compound_id=1,
+            compound_name="Caffeine",
+            molecular_formula="C8H10N4O2",
+        ),
+    )
+    measured_compound = create_measured_compound_and_retention_time(
+        db_session,
+        schemas.MeasuredCompoundCreate(
+            compound_id=1, retention_time=2.5, adduct_name="M+NH4"
+        ),
+    )
+    assert measured_compound.molecular_formula == "C8H14N5O2"
+    assert pytest.approx(measured_compound.measured_mass) == (
+        get_monoisotopic_mass("C8H14N5O2")
+    )
+
+    with pytest.raises(ValueError):
+        create_measured_compound_and_retention_time(
+            db_session,
+            schemas.MeasuredCompoundCreate(
+                compound_id=1, retention_time=2.5, adduct_name="M+K"
+            ),
+        )
+
+
+def test_search_table(db_session):
+    """Test that every create fills the search table the filtered reads use."""
+    for adduct_name, ion_mode in (("M+H", "positive"), ("M-H", "negative")):
+        create_adduct(
+            db_session,
+            schemas.AdductCreate(
+                adduct_name=adduct_name, mass_adjustment=0, ion_mode=ion_mode
+            ),
+        )
+    for compound_id, compound_type in ((1, "drug"), (2, None)):
+        create_compound(
+            db_session,
+            schemas.CompoundCreate(
+                compound_id=compound_id,
+                compound_name=f"Compound {compound_id}",
+                molecular_formula="C8H10N4O2",
+                type=compound_type,
+            ),
+        )
+    create_measured_compound_and_retention_time(
+        db_session,
+        schemas.MeasuredCompoundCreate(
+            compound_id=1, retention_time=2.5, adduct_name="M+H"
+        ),
+    )
+    create_measured_compounds_bulk(
+        db_session,
+        [
+            schemas.MeasuredCompoundCreate(
+                compound_id=compound_id, retention_time=rt, adduct_name=adduct
+            )
+            for compound_id in (1, 2)
+            for rt in (1.0, 2.0, 3.0)
+            for adduct in ("M+H", "M-H")
+        ],
+    )
+
+    columns = list(MeasuredCompoundSearch.__table__.columns.keys())
+    joined = {
+        row.measured_compound_id: tuple(row[column] for column in columns)
+        for row in db_session.execute(select_measured_compounds_flat())
+        .mappings()
+        .all()
+    }
+    search = {
+        row.measured_compound_id: tuple(getattr(row, c) for c in columns)
+        for row in db_session.query(MeasuredCompoundSearch)
+    }
+    assert len(search) == 13
+    assert search == joined
+
+    for filters in (
+        {},
+        {"compound_type": "drug"},
+        {"ion_mode": "negative"},
+        {"compound_type": "drug", "ion_mode": "positive"},
+        {"retention_time": 2.0, "rt_tol": 0.6, "ion_mode": "positive"},
+        {"rt_min": 2.0, "compound_type": "drug", "skip": 1, "limit": 2},
+    ):
+        page = {
+            "skip": filters.pop("skip", 0),
+            "limit": filters.pop("limit", 100),
+        }
+        expected = [
+            row.measured_compound_id
+            for row in db_session.execute(
+                select_measured_compounds_flat(**filters)
+                .offset(page["skip"])
+                .limit(page["limit"])
+            )
+        ]
+        assert expected
+        assert [
+            m.measured_compound_id
+            for m in get_measured_compounds_filtered(
+                db_session, **filters, **page
+            )
+        ] == expected, filters
+
+    # the filtered page is read from the search table alone
+    db_session.execute(text("SET LOCAL enable_seqscan = off"))
+    statement = select_measured_compound_ids(compound_type="drug")
+    sql = statement.compile(engine, compile_kwargs={"literal_binds": True})
+    plan = "\n".join(db_session.execute(text(f"EXPLAIN {sql}")).scalars())
+    assert "ix_measured_compound_search_type_ion_mode_id" in plan
+    assert "Join" not in plan and "Nested Loop" not in plan
+
+
+def test_mass_index_sync_out_of_order_commits(db_session):
+    """Test that sync picks up an id committed after a higher id was indexed."""  # noqa: E501
+    create_adduct(
+        db_session,
+        schemas.AdductCreate(
+            adduct_name="M+H", mass_adjustment=1.007276, ion_mode="positive"
+        ),
+    )
+    for compound_id in (1, 2):
+        create_compound(
+            db_session,
+            schemas.CompoundCreate(
+                compound_id=compound_id,
+                compound_name=f"Compound {compound_id}",
+                molecular_formula="C8H10N4O2",
+            ),
+        )
+    first = create_measured_compound_and_retention_time(
+        db_session,
+        schemas.MeasuredCompoundCreate(
+            compound_id=1, retention_time=1.0, adduct_name="M+H"
+        ),
+    )
+    mass_index.build(db_session)
+
+    with TestingSessionLocal() as other:
+        # another worker's insert takes the next id but commits later
+        slow_id = other.execute(
+            insert(MeasuredCompound)
+            .values(
+                compound_id=2,
+                adduct_id=first.adduct_id,
+                retention_time_id=first.retention_time_id,
+                measured_mass=500.0,
+                molecular_formula="C8H11N4O2",
+            )
+            .returning(MeasuredCompound.measured_compound_id)
+        ).scalar_one()
+        fast = create_measured_compound_and_retention_time(
+            db_session,
+            schemas.MeasuredCompoundCreate(
+                compound_id=1, retention_time=2.0, adduct_name="M+H"
+            ),
+        )
+        assert fast.measured_compound_id > slow_id
+        mass_index.sync(db_session)
+        assert mass_index.search(mz=500.0, ppm=1.0) == []
+        other.commit()
+
+    mass_index.sync(db_session)
+    assert mass_index.search(mz=500.0, ppm=1.0) == [slow_id]
+    # the gap is closed, sync only looks above the highest id again
+    assert mass_index._gap_ids.tolist() == []
+
+
+def test_mass_index_rebuilt_after_recompute(db_session, monkeypatch):
+    """Test that sync rebuilds the index once a recompute job completed."""
+    create_adduct(
+        db_session,
+        schemas.AdductCreate(
+            adduct_name="M+H", mass_adjustment=1.007276, ion_mode="positive"
+        ),
+    )
+    create_compound(
+        db_session,
+        schemas.CompoundCreate(
+            compound_id=1,
+            compound_name="Caffeine",
+            molecular_formula="C8H10N4O2",
+        ),
+    )
+    measured = create_measured_compound_and_retention_time(
+        db_session,
+        schemas.MeasuredCompoundCreate(
+            compound_id=1, retention_time=1.0, adduct_name="M+H"
+        ),
+    )
+    mass_index.build(db_session)
+
+    # another worker's recompute rewrites the mass of the existing id
+    db_session.execute(update(MeasuredCompound).values(measured_mass=500.0))
+    db_session.commit()
+    mass_index.sync(db_session)
+    assert mass_index.search(mz=500.0, ppm=1.0) == []
+    now = datetime.now(tz=timezone.utc)
+    db_session.add(
+        Job(
+            job_id="a" * 32,
+            kind="recompute_masses",
+            status="completed",
+            params={},
+            progress={},
+            created_at=now,
+            finished_at=now,
+        )
+    )
+    db_session.commit()
+    # the generation is not checked again within the interval
+    mass_index.sync(db_session)
+    assert mass_index.search(mz=500.0, ppm=1.0) == []
+    monkeypatch.setattr(config, "MASS_INDEX_GENERATION_INTERVAL", 0)
+    mass_index.sync(db_session)
+    assert mass_index.search(mz=500.0, ppm=1.0) == [
+        measured.measured_compound_id
+    ]
+
+
+def test_mass_index_searchable_during_build(db_session, monkeypatch):
+    """Test that searches see the old snapshot until a rebuild swaps in the new one."""  # noqa: E501
+    create_adduct(
+        db_session,
+        schemas.AdductCreate(
+            adduct_name="M+H", mass_adjustment=1.007276, ion_mode="positive"
+        ),
+    )
+    create_compound(
+        db_session,
+        schemas.CompoundCreate(
+            compound_id=1,
+            compound_name="Caffeine",
+            molecular_formula="C8H10N4O2",
+        ),
+    )
+    measured = create_measured_compound_and_retention_time(
+        db_session,
+        schemas.MeasuredCompoundCreate(
+            compound_id=1, retention_time=1.0, adduct_name="M+H"
+        ),
+    )
+    mass_index.build(db_session)
+    encode_ion_modes = mass_index._encode_ion_modes
+    searched = []
+
+    def encode_and_search(ion_modes):
+        # a search of another thread while the rebuild holds the lock
+        searched.append(mass_index.search(mz=measured.measured_mass, ppm=1.0))
+        return encode_ion_modes(ion_modes)
+
+    monkeypatch.setattr(mass_index, "_encode_ion_modes", encode_and_search)
+    mass_index.build(db_session)
+    assert searched == [[measured.measured_compound_id]]
+    assert mass_index.search(mz=measured.measured_mass, ppm=1.0) == [
+        measured.measured_compound_id
+    ]
+    assert mass_index.match_peaks(
+        [measured.measured_mass], ppm=1.0, ion_modes=["positive"]
+    ).ids.tolist() == [measured.measured_compound_id]
+
+
+def test_get_or_create_retention_time_concurrent(db_session):
+    """Test that concurrent writers upserting the same retention times create no duplicates."""  # noqa: E501
+    retention_times = [round(0.5 + i * 0.1, 1) for i in range(20)]
+    workers = 16
+    barrier = threading.Barrier(workers)
+
+    def upsert_all(worker: int) -> dict:
+        barrier.wait()
+        ids = {}
+        with TestingSessionLocal() as db:
+            # every worker walks the values in a different order
+            shift = worker % len(retention_times)
+            for rt in retention_times[shift:] + retention_times[:shift]:
+                ids[rt] = get_or_create_retention_time(
+                    db, schemas.RetentionTimeCreate(retention_time=rt)
+                ).retention_time_id
+                db.commit()
+        return ids
+
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        results = list(executor.map(upsert_all, range(workers)))
+
+    assert db_session.query(RetentionTime).count() == len(retention_times)
+    # every worker got the id of the same row for each value
+    assert all(ids == results[0] for ids in results)
+
+
 @pytest.fixture(scope="session", autouse=True)
 # remove the test db after all tests
 def cleanup(request):
@@ -0,0 +1,238 @@
+import os
+import threading
+import time
+from datetime import datetime, timedelta, timezone
+
+import pytest
+from sqlalchemy import create_engine, text
+from sqlalchemy.orm import sessionmaker
+from sqlalchemy_utils import create_database, database_exists
+
+from mass_spec_app import jobs
+from mass_spec_app.config import DATABASE_URL_TEST
+from mass_spec_app.db.models import Base, Job
+
+engine = create_engine(DATABASE_URL_TEST, pool_size=10)
+if not database_exists(engine.url):
+    print("create test db")
+    create_database(engine.url)
+TestingSessionLocal = sessionmaker(
+    autocommit=False, autoflush=False, bind=engine
+)
+
+
+@pytest.fixture(scope="function")
+def db_session():
+    # Setup the test database before each test
+    Base.metadata.create_all(bind=engine)
+    db = TestingSessionLocal()
+    yield db
+    db.close()
+    Base.metadata.drop_all(bind=engine)
+
+
+@pytest.fixture
+def runner(db_session):
+    runner = jobs.JobRunner(concurrency=4, poll_interval=0.05)
+    runner.start(TestingSessionLocal)
+    yield runner
+    runner.stop()
+
+
+def wait_for(db, job_ids, timeout=30):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        db.expire_all()
+        found = [jobs.get_job(db, job_id) for job_id in job_ids]
+        if all(job.status not in (jobs.QUEUED, jobs.RUNNING) for job in found):
+            return found
+        time.sleep(0.01)
+    raise TimeoutError("jobs did not finish")
+
+
+def test_many_short_jobs(db_session, runner, monkeypatch):
+    """Test that many short jobs all complete, in submission order and within the concurrency limit."""  # noqa: E501
+    running = 0
+    max_running = 0
+    lock = threading.Lock()
+
+    def short_job(db, params, context):
+        nonlocal running, max_running
+        with lock:
+            running += 1
+            max_running = max(max_running, running)
+        time.sleep(0.005)
+        with lock:
+            running -= 1
+        return {"n": params["n"]}
+
+    monkeypatch.setitem(jobs.HANDLERS, "short", short_job)
+    job_ids = []
+    for n in range(200):
+        job_ids.append(jobs.submit(db_session, "short", {"n": n}).job_id)
+        runner.notify()
+    finished = wait_for(db_session, job_ids)
+
+    assert [job.result for job in finished] == [{"n": n} for n in range(200)]
+    assert all(job.status == jobs.COMPLETED for job in finished)
+    # claims are serialized and take the oldest queued job first
+    started = [job.started_at for job in finished]
+    assert started == sorted(started)
+    assert all(job.created_at <= job.started_at for job in finished)
+    assert max_running <= runner.concurrency
+
+    # an idle runner picks up a single submit
+    job = jobs.submit(db_session, "short", {"n": 0})
+    runner.notify()
+    (job,) = wait_for(db_session, [job.job_id])
+    assert job.status == jobs.COMPLETED
+
+
+def test_concurrency_over_workers(db_session, monkeypatch):
+    """Test that the concurrency limit holds for the runners of all workers."""
+    running = 0
+    max_running = 0
+    lock = threading.Lock()
+
+    def short_job(db, params, context):
+        nonlocal running, max_running
+        with lock:
+            running += 1
+            max_running = max(max_running, running)
+        time.sleep(0.02)
+        with lock:
+            running -= 1
+        return {}
+
+    monkeypatch.setitem(jobs.HANDLERS, "short", short_job)
+    # two workers with two runner threads each
+    runners = [
+        jobs.JobRunner(concurrency=2, poll_interval=0.01) for _ in range(2)
+    ]
+    for runner in runners:
+        runner.start(TestingSessionLocal)
+    try:
+        job_ids = [
+            jobs.submit(db_session, "short", {}).job_id for _ in range(40)
+        ]
+        for runner in runners:
+            runner.notify()
+        finished = wait_for(db_session, job_ids)
+    finally:
+        for runner in runners:
+            runner.stop()
+
+    assert all(job.status == jobs.COMPLETED for job in finished)
+    assert max_running == 2
+    # both workers ran jobs
+    assert {job.worker_id for job in finished} == {
+        runner.worker_id for runner in runners
+    }
+
+
+def test_cancel_and_failure(db_session, runner, monkeypatch):
+    """Test cancelling a running job and recording the error of a failed one."""  # noqa: E501
+    started = threading.Event()
+
+    def endless_job(db, params, context):
+        started.set()
+        while True:
+            context.report(force=True, step=1)
+            time.sleep(0.01)
+
+    def failing_job(db, params, context):
+        raise ValueError("broken input")
+
+    monkeypatch.setitem(jobs.HANDLERS, "endless", endless_job)
+    monkeypatch.setitem(jobs.HANDLERS, "failing", failing_job)
+
+    endless = jobs.submit(db_session, "endless", {})
+    runner.notify()
+    assert started.wait(5)
+    assert jobs.cancel(db_session, endless.job_id).cancel_requested
+    failing = jobs.submit(db_session, "failing", {})
+    runner.notify()
+    endless, failing = wait_for(db_session, [endless.job_id, failing.job_id])
+
+    assert endless.status == jobs.CANCELLED
+    assert endless.progress == {"step": 1}
+    assert endless.worker_id == runner.worker_id
+    assert failing.status == jobs.FAILED
+    assert failing.error == "ValueError: broken input"
+
+    with pytest.raises(ValueError):
+        jobs.submit(db_session, "unknown", {})
+
+
+def test_failed_statement_after_commit(db_session, runner, monkeypatch):
+    """Test that a job failing on an aborted transaction is recorded as failed."""  # noqa: E501
+
+    def aborting_job(db, params, context):
+        # a committed chunk expires the job, then a statement fails
+        db.commit()
+        db.execute(text("SELECT 1 / 0"))
+
+    monkeypatch.setitem(jobs.HANDLERS, "aborting", aborting_job)
+    monkeypatch.setitem(jobs.HANDLERS, "short", lambda db, params, c: {})
+    job_ids = [jobs.submit(db_session, "aborting", {}).job_id]
+    runner.notify()
+    (job,) = wait_for(db_session, job_ids)
+    assert job.status == jobs.FAILED
+    assert job.error.startswith("DataError")
+
+    # the runners are still alive and pick up the next jobs
+    job_ids = [
+        jobs.submit(db_session, "short", {}).job_id
+        for _ in range(runner.concurrency)
+    ]
+    runner.notify()
+    assert all(
+        job.status == jobs.COMPLETED for job in wait_for(db_session, job_ids)
+    )
+    assert all(thread.is_alive() for thread in runner._threads)
+
+
+def test_recover_orphans(db_session):
+    """Test that running jobs of a dead worker are failed or cancelled."""
+    now = datetime.now(tz=timezone.utc)
+    for job_id, heartbeat_at, cancel_requested in (
+        ("a" * 32, now - timedelta(minutes=5), False),
+        ("b" * 32, now - timedelta(minutes=5), True),
+        ("c" * 32, None, False),
+        ("d" * 32, now, False),
+    ):
+        db_session.add(
+            Job(
+                job_id=job_id,
+                kind="short",
+                status=jobs.RUNNING,
+                params={},
+                progress={},
+                cancel_requested=cancel_requested,
+                created_at=now,
+                worker_id="gone",
+                heartbeat_at=heartbeat_at,
+            )
+        )
+    db_session.commit()
+
+    assert jobs.recover_orphans(db_session, timeout=60) == 3
+    statuses = [
+        jobs.get_job(db_session, job_id * 32).status
+        for job_id in ("a", "b", "c", "d")
+    ]
+    assert statuses == [jobs.FAILED, jobs.CANCELLED, jobs.FAILED, jobs.RUNNING]
+    assert jobs.get_job(db_session, "a" * 32).finished_at is not None
+
+
+def test_remove_expired_files(tmp_path):
+    """Test that job files older than the retention are deleted."""
+    old, new = tmp_path / "old.csv", tmp_path / "new.csv"
+    old.write_text("a")
+    new.write_text("b")
+    an_hour_ago = time.time() - 3600
+    os.utime(old, (an_hour_ago, an_hour_ago))
+
+    assert jobs.remove_expired_files(str(tmp_path), retention=60) == 1
+    assert [path.name for path in tmp_path.iterdir()] == ["new.csv"]
+    assert jobs.remove_expired_files(str(tmp_path / "missing"), 60) == 0
@@ -0,0 +1,121 @@
+import numpy as np
+import pytest
+
+from mass_spec_app.scripts.chem_utils import (
+    get_isotope_envelope,
+    get_monoisotopic_mass,
+)
+from mass_spec_app.scripts.mass_engine import (
+    batch_monoisotopic_mass,
+    monoisotopic_mass,
+    pad_patterns,
+    parse_formula,
+    score_isotope_patterns,
+    unpack_isotope_envelopes,
+)
+
+FORMULAS = [
+    "C8H10N4O2",
+    "C21H25[2]H3O4",
+    "C21H25[2H3]O4",
+    "C21H24[2H]3O4",
+    "C10[13]C6H20N2",
+    "[13C2]H6",
+    "(CH3)2O",
+    "CD3",
+    "C6H12O6Na",
+    "C9H8ClNO2S",
+    "C12H7Br2O",
+]
+
+
+@pytest.mark.parametrize("formula", FORMULAS)
+def test_mass_engine_parity(formula):
+    """Test that the mass engine agrees with molmass."""
+    assert monoisotopic_mass(formula) == pytest.approx(
+        get_monoisotopic_mass(formula), abs=1e-9
+    )
+
+
+def test_batch_monoisotopic_mass():
+    """Test the batch API including repeated and invalid formulas."""
+    formulas = FORMULAS + FORMULAS[:3] + ["Xx2", "C(H2", "C0H4"]
+    masses = batch_monoisotopic_mass(formulas)
+
+    assert isinstance(masses, np.ndarray)
+    assert masses.shape == (len(formulas),)
+    expected = [get_monoisotopic_mass(f) for f in formulas[:-3]]
+    np.testing.assert_allclose(masses[:-3], expected, rtol=0, atol=1e-9)
+    assert np.isnan(masses[-3:]).all()
+
+
+def test_batch_monoisotopic_mass_without_parsed_formulas():
+    """Test batches that only hold fallback or invalid formulas."""
+    masses = batch_monoisotopic_mass(["CH3COO-", "CH3COO-"])
+    assert masses.dtype == np.float64
+    np.testing.assert_allclose(
+        masses, [get_monoisotopic_mass("CH3COO-")] * 2, rtol=0, atol=1e-9
+    )
+
+    masses = batch_monoisotopic_mass(["Xx", "C(H2"])
+    assert masses.dtype == np.float64
+    assert np.isnan(masses).all()
+    assert batch_monoisotopic_mass([]).shape == (0,)
+
+
+def test_parse_formula_errors():
+    """Test that unsupported formulas raise a ValueError."""
+    for formula in ["", "C(H2", "CH2)", "Xx2", "C0H4", "C-H"]:
+        with pytest.raises(ValueError):
+            parse_formula(formula)
+
+
+def test_score_isotope_patterns():
+    """Test scoring observed patterns against packed isotope envelopes."""
+    formula = "C21H26Cl2O4"
+    mass = get_monoisotopic_mass(formula)
+    envelope = get_isotope_envelope(formula)
+    mzs, abundances = unpack_isotope_envelopes(
+        [envelope.pack(), envelope.pack(), envelope.pack(), None],
+        [mass] * 4,
+        peaks=4,
+    )
+    assert mzs[0] == pytest.approx(mass + np.array(envelope.offsets))
+    assert np.isnan(mzs[3]).all()
+
+    expected = np.array(envelope.abundances)
+    observed_mzs = pad_patterns(
+        [
+            list(mzs[0]),
+            # M and M+1 only (the M+2 chlorine peak is missing)
+            list(mzs[0][:2]),
+            # shifted by 20 ppm
+            list(mzs[0] * (1 + 20e-6)),
+            list(mzs[0]),
+        ]
+    )
+    observed_intensities = pad_patterns(
+        [
+            list(expected * 5e4),
+            list(expected[:2] * 5e4),
+            list(expected * 5e4),
+            list(expected * 5e4),
+        ]
+    )
+    assert observed_mzs.shape == (4, 4)
+    assert np.isnan(observed_mzs[1, 2:]).all()
+
+    scores = score_isotope_patterns(
+        observed_mzs, observed_intensities, mzs, abundances, ppm=5
+    )
+    assert scores.scores[0] == pytest.approx(1.0, abs=1e-6)
+    assert scores.scores[1] < 0.9
+    assert scores.scores[2] == 0
+    assert np.isnan(scores.scores[3])
+    assert scores.matched_peaks.tolist() == [4, 2, 0, 0]
+    assert scores.observed_abundances[0] == pytest.approx(expected, rel=1e-6)
+
+    with pytest.raises(ValueError):
+        score_isotope_patterns(
+            observed_mzs, observed_intensities, mzs, abundances, ppm=-1
+        )
@@ -0,0 +1,103 @@
+import numpy as np
+import pytest
+
+from mass_spec_app.db.mass_index import MassIndex, ppm_window
+
+
+def test_ppm_window():
+    """Test the mass bounds of a ppm window."""
+    lower, upper = ppm_window(1000.0, 5.0)
+    assert pytest.approx(lower) == 999.995
+    assert pytest.approx(upper) == 1000.005
+    with pytest.raises(ValueError):
+        ppm_window(-1.0, 5.0)
+
+
+def test_mass_index_search():
+    """Test range lookups on the sorted mass index."""
+    index = MassIndex()
+    index.add_many(ids=[3, 1, 2], masses=[300.0, 100.0, 200.0])
+    index.add(4, 200.0001)
+
+    assert len(index) == 4
+    assert index.search(mz=200.0, ppm=1.0) == [2, 4]
+    assert index.search(mz=100.0, ppm=0.0) == [1]
+    assert index.search(mz=150.0, ppm=10.0) == []
+    # already indexed ids are not added twice
+    index.add(1, 100.0)
+    assert len(index) == 4
+
+
+def test_mass_index_gaps():
+    """Test that ids skipped below the highest indexed id are kept as gaps."""
+    index = MassIndex()
+    index.add_many(ids=[1, 2, 5], masses=[100.0, 200.0, 500.0])
+    assert index._gap_ids.tolist() == [3, 4]
+    index.add(4, 400.0)
+    assert index._gap_ids.tolist() == [3]
+    index.add(8, 800.0)
+    assert index._gap_ids.tolist() == [3, 6, 7]
+
+
+def test_match_peaks():
+    """Test matching a peak list with ppm, rt and ion mode tolerances."""
+    index = MassIndex()
+    index.add_many(
+        ids=[1, 2, 3, 4],
+        masses=[100.0, 200.0, 200.0005, 300.0],
+        compound_ids=[10, 20, 30, 40],
+        retention_times=[1.0, 2.0, 5.0, 3.0],
+        ion_modes=["positive", "positive", "negative", "positive"],
+    )
+    mzs = [200.0002, 100.0, 500.0, 200.0002]
+    matches = index.match_peaks(mzs=mzs, ppm=5.0)
+    assert matches.peak_indices.tolist() == [0, 0, 1, 3, 3]
+    assert matches.ids.tolist() == [2, 3, 1, 2, 3]
+    assert matches.compound_ids.tolist() == [20, 30, 10, 20, 30]
+    assert pytest.approx(matches.mass_errors_ppm[0]) == 1.0
+
+    matches = index.match_peaks(
+        mzs=mzs,
+        ppm=5.0,
+        rts=[2.1, None, None, 4.9],
+        rt_tol=0.2,
+        ion_modes=[None, "positive", None, "unknown"],
+    )
+    assert matches.peak_indices.tolist() == [0, 1]
+    assert matches.ids.tolist() == [2, 1]
+    assert matches.records()[1]["ion_mode"] == "positive"
+
+    with pytest.raises(ValueError):
+        index.match_peaks(mzs=[0.0], ppm=5.0)
+
+
+def test_match_peaks_against_brute_force():
+    """Test the vectorized matching against comparing every pair."""
+    rng = np.random.default_rng(0)
+    index = MassIndex()
+    masses = rng.uniform(100, 110, 2000)
+    rts = rng.uniform(0, 10, 2000)
+    index.add_many(
+        ids=range(1, 2001),
+        masses=masses,
+        compound_ids=range(1, 2001),
+        retention_times=rts,
+    )
+    peak_mzs = rng.uniform(100, 110, 300)
+    peak_rts = rng.uniform(0, 10, 300)
+    matches = index.match_peaks(
+        mzs=peak_mzs, ppm=20.0, rts=peak_rts, rt_tol=0.5
+    )
+
+    expected = {
+        (peak, int(i) + 1)
+        for peak in range(300)
+        for i in np.flatnonzero(
+            (np.abs(masses - peak_mzs[peak]) <= peak_mzs[peak] * 20e-6)
+            & (np.abs(rts - peak_rts[peak]) <= 0.5)
+        )
+    }
+    assert expected
+    assert set(zip(matches.peak_indices.tolist(), matches.ids.tolist())) == (
+        expected
+    )
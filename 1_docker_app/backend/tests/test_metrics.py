@@ -0,0 +1,80 @@
+import os
+
+from prometheus_client import REGISTRY
+from sqlalchemy import create_engine, text
+
+from mass_spec_app import config
+from mass_spec_app.api.request_metrics import route_template
+from mass_spec_app.app import app
+from mass_spec_app.metrics import instrument_queries, render_metrics
+from mass_spec_app.scripts import chem_utils as cu
+
+
+def statement_count(engine_name, statement):
+    return REGISTRY.get_sample_value(
+        "db_statement_duration_seconds_count",
+        {"engine": engine_name, "statement": statement},
+    )
+
+
+def test_instrument_queries():
+    """Test that statement durations are recorded per statement type."""
+    engine = create_engine(config.DATABASE_URL_TEST)
+    instrument_queries(engine, "test")
+    with engine.connect() as connection:
+        connection.execute(text("SELECT 1"))
+        connection.execute(text("SELECT 2"))
+        connection.execute(text("SET TIME ZONE 'UTC'"))
+    assert statement_count("test", "SELECT") == 2
+    assert statement_count("test", "OTHER") >= 1
+    engine.dispose()
+
+
+def test_route_template():
+    """Test that requests are labelled with the route template."""
+    routes = [
+        (route.path_regex, route.path, route.methods) for route in app.routes
+    ]
+
+    def template(method, path):
+        return route_template(routes, {"method": method, "path": path})
+
+    assert template("GET", "/compounds/12") == "/compounds/{compound_id}"
+    assert template("GET", "/measured-compounds/search-mass") == (
+        "/measured-compounds/search-mass"
+    )
+    # the path exists, but not with this method
+    assert template("DELETE", "/compounds/12") == "/compounds/{compound_id}"
+    assert template("GET", "/wp-admin/login.php") == "unmatched"
+
+
+def test_render_formula_cache_metrics():
+    """Test that the chem_utils cache counters are exported."""
+    cu.clear_caches()
+    cu.get_monoisotopic_mass("C6H12O6")
+    cu.get_monoisotopic_mass("C6H12O6")
+    content, content_type = render_metrics()
+    assert content_type.startswith("text/plain")
+    lines = content.decode().splitlines()
+    assert 'chem_cache_hits_total{cache="monoisotopic_mass"} 1.0' in lines
+    assert 'chem_cache_misses_total{cache="monoisotopic_mass"} 1.0' in lines
+    assert any(
+        line.startswith(
+            'chem_cache_compute_seconds_total{cache="monoisotopic_mass"}'
+        )  # noqa: E501
+        for line in lines
+    )
+
+
+def test_render_metrics_multiprocess(tmp_path, monkeypatch):
+    """Test that the collected counters of a worker carry its pid."""
+    monkeypatch.setattr(config, "PROMETHEUS_MULTIPROC_DIR", str(tmp_path))
+    cu.clear_caches()
+    cu.get_monoisotopic_mass("C6H12O6")
+    content, _ = render_metrics()
+    lines = content.decode().splitlines()
+    pid = os.getpid()
+    assert (
+        f'chem_cache_misses_total{{cache="monoisotopic_mass",pid="{pid}"}} 1.0'
+        in lines
+    )
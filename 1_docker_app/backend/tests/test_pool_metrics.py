@@ -0,0 +1,56 @@
+import pytest
+from sqlalchemy import create_engine, exc, text
+
+from mass_spec_app import config
+from mass_spec_app.db.pool_metrics import (
+    InstrumentedQueuePool,
+    get_pool_metrics,
+    instrument_engine,
+)
+
+
+def create_instrumented_engine(url=config.DATABASE_URL_TEST, **kwargs):
+    engine = create_engine(url, poolclass=InstrumentedQueuePool, **kwargs)
+    instrument_engine(engine)
+    return engine
+
+
+def test_checkout_metrics():
+    """Test that checkouts, pool usage and timeouts are recorded."""
+    engine = create_instrumented_engine(
+        pool_size=1, max_overflow=0, pool_timeout=0.1
+    )
+    with engine.connect() as connection:
+        connection.execute(text("SELECT 1"))
+        metrics = get_pool_metrics(engine)
+        assert metrics["checked_out"] == 1
+        assert metrics["checkouts"] == 1
+        # the only connection is in use, so the next checkout times out
+        with pytest.raises(exc.TimeoutError):
+            engine.connect()
+
+    metrics = get_pool_metrics(engine)
+    assert metrics["checked_out"] == 0
+    assert metrics["checked_in"] == 1
+    assert metrics["checkout_timeouts"] == 1
+    assert metrics["checkout_ms_max"] >= metrics["checkout_ms_mean"] > 0
+
+    # counters survive engine.dispose(), which recreates the pool
+    engine.dispose()
+    assert get_pool_metrics(engine)["checkouts"] == 1
+
+
+def test_connection_error_metrics():
+    """Test that failed connections are counted but failing statements are not."""  # noqa: E501
+    engine = create_instrumented_engine()
+    with engine.connect() as connection:
+        with pytest.raises(exc.ProgrammingError):
+            connection.execute(text("SELECT * FROM missing_table"))
+    assert get_pool_metrics(engine)["connection_errors"] == 0
+
+    unreachable = create_instrumented_engine(
+        "postgresql+psycopg://postgres@/missing?host=/nonexistent"
+    )
+    with pytest.raises(exc.OperationalError):
+        unreachable.connect()
+    assert get_pool_metrics(unreachable)["connection_errors"] == 1
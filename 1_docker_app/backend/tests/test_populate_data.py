@@ -0,0 +1,143 @@
+import json
+
+import pandas as pd
+import pytest
+from sqlalchemy import create_engine
+from sqlalchemy.orm import sessionmaker
+from sqlalchemy_utils import create_database, database_exists, drop_database
+
+from mass_spec_app.config import DATABASE_URL_TEST
+from mass_spec_app.db import crud
+from mass_spec_app.db.mass_index import mass_index
+from mass_spec_app.db.models import Base, Compound, MeasuredCompound
+from mass_spec_app.scripts import chem_utils as cu
+from mass_spec_app.scripts import populate_data as pdata
+from mass_spec_app.scripts import synthetic_data
+
+engine = create_engine(DATABASE_URL_TEST)
+if not database_exists(engine.url):
+    print("create test db")
+    create_database(engine.url)
+TestingSessionLocal = sessionmaker(
+    autocommit=False, autoflush=False, bind=engine
+)
+
+
+@pytest.fixture(scope="function")
+def db_session():
+    # Setup the test database before each test
+    Base.metadata.create_all(bind=engine)
+    db = TestingSessionLocal()
+    yield db
+    db.close()
+    Base.metadata.drop_all(bind=engine)
+
+
+@pytest.fixture(scope="function")
+def input_files(tmp_path, monkeypatch):
+    """Write small input files and point populate_data at them."""
+    adducts_file = tmp_path / "adducts.json"
+    adducts_file.write_text(
+        json.dumps(
+            [
+                {"name": "M+H", "mass": 1.007276, "ion_mode": "positive"},
+                {"name": "M-H", "mass": -1.007276, "ion_mode": "negative"},
+            ]
+        )
+    )
+    compounds_file = tmp_path / "compounds.xlsx"
+    pd.DataFrame(
+        {
+            "compound_id": [1, 2, 3],
+            "compound_name": ["Caffeine", "Labelled", "Broken"],
+            "molecular_formula": ["C8H10N4O2", "C21H25[2]H3O4", "Xx2"],
+            "type": ["drug", None, None],
+        }
+    ).to_excel(compounds_file, index=False)
+    measured_file = tmp_path / "measured-compounds.xlsx"
+    pd.DataFrame(
+        {
+            "compound_id": [1, 1, 2, 2, 3],
+            "compound_name": ["Caffeine"] * 2 + ["Labelled"] * 2 + ["Broken"],
+            "adduct_name": ["M+H", "M-H", "M+H", None, "M+H"],
+            "retention_time": [2.5, 2.5, 4.0, 4.0, 5.0],
+            "retention_time_comment": ["first", None, None, None, None],
+        }
+    ).to_excel(measured_file, index=False)
+    monkeypatch.setattr(pdata, "ADDUCTS_FILE", str(adducts_file))
+    monkeypatch.setattr(pdata, "COMPOUNDS_FILE", str(compounds_file))
+    monkeypatch.setattr(pdata, "MEASURED_COMPOUNDS_FILE", str(measured_file))
+
+
+def test_populate_data(db_session, input_files, capsys):
+    """Test the chunked population from the input files."""
+    pdata.populate_data(db_session)
+    output = capsys.readouterr().out
+
+    assert db_session.query(Compound).count() == 2
+    assert db_session.query(MeasuredCompound).count() == 3
+    assert crud.check_initialization_status(db_session)
+    assert "Adduct name missing for compound Labelled" in output
+    assert "Compound '3' not found in the database.. Skipping entry." in output
+    assert "rows/s" in output
+
+    # a second run does not populate again
+    pdata.populate_data(db_session)
+    assert "DB Already Populated" in capsys.readouterr().out
+    assert db_session.query(MeasuredCompound).count() == 3
+
+
+def test_populate_measured_compounds_parallel(db_session, input_files, capsys):
+    """Test that the process pool import writes and reports like the sequential one."""  # noqa: E501
+    pdata.populate_adducts(db_session)
+    pdata.populate_compounds(db_session)
+    capsys.readouterr()
+    pdata.populate_measured_compounds(db_session, chunk_size=2, workers=2)
+    output = capsys.readouterr().out
+
+    measured = db_session.query(MeasuredCompound).all()
+    assert len(measured) == 3
+    assert {m.molecular_formula for m in measured} == {
+        "C8H11N4O2",
+        "C8H9N4O2",
+        "C21H26[2H]3O4",
+    }
+    # computed with the registered adducts like the create paths
+    for m in measured:
+        assert m.measured_mass == (
+            m.compound.computed_mass
+            + cu.parse_adduct(m.adduct.adduct_name).mass
+        )
+    assert "Adduct name missing for compound Labelled" in output
+    assert "Compound '3' not found in the database.. Skipping entry." in output
+
+
+def test_generate_synthetic_library(db_session):
+    """Test that the synthetic library has the requested size and consistent masses."""  # noqa: E501
+    counts = synthetic_data.generate_library(
+        db_session, measured_compounds=1200, formulas=50
+    )
+    assert counts["compounds"] == 200
+    assert db_session.query(Compound).count() == 200
+    assert db_session.query(MeasuredCompound).count() == 1200
+    assert len(mass_index) == 1200
+
+    measured_compound = db_session.get(MeasuredCompound, 1)
+    assert measured_compound.molecular_formula == cu.get_measured_formula(
+        measured_compound.compound.molecular_formula,
+        measured_compound.adduct.adduct_name,
+    )
+    assert pytest.approx(measured_compound.measured_mass) == (
+        cu.get_monoisotopic_mass(measured_compound.molecular_formula)
+    )
+
+
+@pytest.fixture(scope="session", autouse=True)
+# remove the test db after all tests
+def cleanup(request):
+    def __cleanup():
+        if database_exists(engine.url):
+            print("remove test db")
+            drop_database(engine.url)
+
+    request.addfinalizer(__cleanup)
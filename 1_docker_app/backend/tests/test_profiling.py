@@ -0,0 +1,50 @@
+import cProfile
+
+from sqlalchemy import create_engine, text
+
+from mass_spec_app import config
+from mass_spec_app.profiling import (
+    ProfileStore,
+    capture_statements,
+    captured_statements,
+)
+
+
+def test_capture_statements():
+    """Test that statements are only recorded while a request is profiled."""
+    engine = create_engine(config.DATABASE_URL_TEST)
+    capture_statements(engine)
+    statements = []
+    with engine.connect() as connection:
+        connection.execute(text("SELECT 1"))
+        token = captured_statements.set(statements)
+        try:
+            connection.execute(text("SELECT :value"), {"value": 2})
+        finally:
+            captured_statements.reset(token)
+        connection.execute(text("SELECT 3"))
+    assert [s["statement"] for s in statements] == ["SELECT %(value)s"]
+    assert "2" in statements[0]["parameters"]
+    assert statements[0]["duration_ms"] >= 0
+    engine.dispose()
+
+
+def test_profile_store(tmp_path):
+    """Test that the store keeps the newest profiles and rejects unknown ids."""  # noqa: E501
+    store = ProfileStore(str(tmp_path), keep=2)
+    ids = [f"{i:032x}" for i in range(3)]
+    for profile_id in ids:
+        profiler = cProfile.Profile()
+        profiler.enable()
+        sorted(range(100))
+        profiler.disable()
+        store.save(profile_id, {"profile_id": profile_id}, profiler)
+
+    assert set(store.ids()) == set(ids[1:])
+    profile = store.get(ids[2])
+    assert profile["profile_id"] == ids[2]
+    assert profile["functions"]
+    assert store.stats_path(ids[2]).endswith(f"{ids[2]}.prof")
+    assert store.get(ids[0]) is None
+    assert store.get("../../etc/passwd") is None
+    assert store.stats_path("../secret") is None
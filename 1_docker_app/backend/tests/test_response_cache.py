@@ -0,0 +1,67 @@
+import time
+
+from mass_spec_app.api.response_cache import ResponseCache, _Entry
+
+
+def make_entry(cache, versions, body=b"[]"):
+    return _Entry(
+        versions=versions,
+        expires=time.monotonic() + cache.ttl,
+        status=200,
+        headers=[],
+        body=body,
+        etag='"etag"',
+    )
+
+
+def test_response_cache_versions_and_lru():
+    """Test invalidation through table versions and LRU eviction."""
+    cache = ResponseCache(maxsize=2, ttl=60)
+    versions = cache.versions(("compounds",))
+    cache.set(("/compounds/", ""), make_entry(cache, versions))
+    assert cache.get(("/compounds/", ""), versions) is not None
+
+    cache.invalidate("compounds")
+    assert cache.versions(("compounds",)) != versions
+    assert (
+        cache.get(("/compounds/", ""), cache.versions(("compounds",))) is None
+    )
+
+    for i in range(3):
+        cache.set((f"/adducts/{i}", ""), make_entry(cache, ()))
+    assert cache.get(("/adducts/0", ""), ()) is None
+    assert cache.get(("/adducts/2", ""), ()) is not None
+    assert cache.stats()["size"] == 2
+
+
+def test_response_cache_ttl():
+    """Test that entries expire after the TTL and a TTL of 0 disables caching."""  # noqa: E501
+    cache = ResponseCache(maxsize=10, ttl=0.01)
+    cache.set(("/adducts/", ""), make_entry(cache, ()))
+    time.sleep(0.02)
+    assert cache.get(("/adducts/", ""), ()) is None
+
+    disabled = ResponseCache(maxsize=10, ttl=0)
+    disabled.set(("/adducts/", ""), make_entry(disabled, ()))
+    assert disabled.stats()["size"] == 0
+
+
+def test_response_cache_size_limits():
+    """Test that large bodies are not cached and the total body size is bounded."""  # noqa: E501
+    cache = ResponseCache(maxsize=10, ttl=60, max_body=4, max_bytes=8)
+    cache.set(("/adducts/", ""), make_entry(cache, (), body=b"12345"))
+    assert cache.get(("/adducts/", ""), ()) is None
+    assert cache.stats()["too_large"] == 1
+
+    for i in range(3):
+        cache.set((f"/adducts/{i}", ""), make_entry(cache, (), body=b"1234"))
+    assert cache.get(("/adducts/0", ""), ()) is None
+    assert cache.get(("/adducts/2", ""), ()) is not None
+    stats = cache.stats()
+    assert (stats["size"], stats["bytes"]) == (2, 8)
+
+    # replacing an entry does not count its old body
+    cache.set(("/adducts/2", ""), make_entry(cache, (), body=b"12"))
+    assert cache.stats()["bytes"] == 6
+    cache.clear()
+    assert cache.stats()["bytes"] == 0
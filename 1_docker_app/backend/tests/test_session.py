@@ -1,6 +1,9 @@
+import asyncio
+
+from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy.orm import Session
 
-from mass_spec_app.db.session import get_db
+from mass_spec_app.db.session import get_async_db, get_db
 
 
 def test_get_db():
@@ -8,3 +11,15 @@ def test_get_db():
     session = next(get_db())
     assert isinstance(session, Session)
     session.close()
+
+
+def test_get_async_db():
+    """Test the async session creation and lifecycle."""
+
+    async def check_session():
+        sessions = get_async_db()
+        session = await sessions.__anext__()
+        assert isinstance(session, AsyncSession)
+        await sessions.aclose()
+
+    asyncio.run(check_session())
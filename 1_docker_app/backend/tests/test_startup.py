@@ -0,0 +1,36 @@
+import subprocess
+import sys
+
+from mass_spec_app.startup import StartupReport
+
+
+def test_app_import_skips_population_code():
+    """Test that importing the app does not import pandas or populate_data."""
+    modules = subprocess.run(
+        [
+            sys.executable,
+            "-c",
+            "import sys, mass_spec_app; print(' '.join(sys.modules))",
+        ],
+        capture_output=True,
+        check=True,
+        text=True,
+    ).stdout.split()
+    assert "mass_spec_app.app" in modules
+    assert "pandas" not in modules
+    assert "mass_spec_app.scripts.populate_data" not in modules
+
+
+def test_startup_report():
+    """Test that the report lists the phases in the order they ran."""
+    report = StartupReport(0.0)
+    report.record("import", 0.0)
+    with report.phase("mass index"):
+        pass
+    summary = report.summary()
+    assert summary.startswith("Startup completed in")
+    assert summary.index("import") < summary.index("mass index")
+
+    report.forked()
+    assert report.phases == {}
+    assert "(import" not in report.summary()
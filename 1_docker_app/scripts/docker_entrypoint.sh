@@ -10,5 +10,8 @@ if [ "$1" = 'debug' ]; then
   exec python -m debugpy --wait-for-client --listen 0.0.0.0:5678 -m uvicorn mass_spec_app:app --host 0.0.0.0 --port 8255
 else
   echo "Starting the app in normal mode..."
+  # shared by the gunicorn workers to aggregate the /metrics of all of them
+  export PROMETHEUS_MULTIPROC_DIR="${PROMETHEUS_MULTIPROC_DIR:-/tmp/prometheus_multiproc}"
+  rm -rf "$PROMETHEUS_MULTIPROC_DIR" && mkdir -p "$PROMETHEUS_MULTIPROC_DIR"
   exec gunicorn --bind 0.0.0.0:8255 -k uvicorn.workers.UvicornWorker mass_spec_app:app
 fi